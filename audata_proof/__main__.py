@@ -1,3 +1,4 @@
+import argparse
 import json
 import os
 import sys
@@ -6,12 +7,14 @@ import traceback
 from loguru import logger as console_logger
 
 from audata_proof.config import settings
-from audata_proof.db import db
-from audata_proof.proof import Proof
-from audata_proof.utils import check_user, extract_data, unzip_dir
+from audata_proof.startup import StartupProfile
 
 
-def run() -> None:
+def run(profile: StartupProfile | None = None) -> None:
+    profile = profile or StartupProfile()
+
+    # Inputs are validated before heavy dependencies are imported,
+    # so a run without them fails fast
     input_files_exist = os.path.isdir(settings.INPUT_DIR) and bool(
         os.listdir(settings.INPUT_DIR)
     )
@@ -21,31 +24,65 @@ def run() -> None:
             f'No input files found in {settings.INPUT_DIR}'
         )
 
-    unzip_dir(settings.INPUT_DIR)
+    profile.import_modules()
+    with profile.stage('import audata_proof.utils'):
+        from audata_proof.utils import extract_data
 
-    ogg_files, telegram_id = extract_data(settings.INPUT_DIR)
+    with profile.stage('read inputs'):
+        audio_files, telegram_id = extract_data(settings.INPUT_DIR)
 
     # Init single db session which will be passed into all handlers
     # It is generally recommended to do it this way to avoid
     # excessive inits in functions which also turns to be kind of chaotic
-    db.init()
+    with profile.stage('init db'):
+        from audata_proof.db import db
+
+        db.init()
+
+    with profile.stage('import models'):
+        from audata_proof.model.registry import model_registry
 
-    # Make sure user exists or create one
-    check_user(telegram_id, db)
+    with profile.stage('import proof'):
+        from audata_proof.metrics import profiled
+        from audata_proof.proof import Proof
 
-    proof = Proof(db, ogg_files[0], telegram_id)
-    proof_response = proof.generate()
+    with (
+        profile.stage('generate proof'),
+        profiled(settings.PROOF_PROFILER, settings.OUTPUT_DIR),
+    ):
+        proof = Proof(db, audio_files, telegram_id)
+        proof_response = proof.generate()
+    # Models are loaded by the proof once a stage needs them, their
+    # load times are reported apart from the rest of it
+    for name, seconds in model_registry.load_times.items():
+        profile.times['generate proof'] -= seconds
+        profile.times[f'load {name}'] = seconds
+
+    with open(os.path.join(settings.OUTPUT_DIR, 'metrics.json'), 'w') as f:
+        f.write(proof.metrics.model_dump_json(indent=2))
 
     output_path = os.path.join(settings.OUTPUT_DIR, 'results.json')
-    #with open(output_path, 'w') as f:
-        #json.dump(proof_response.model_dump(), f, indent=2)
+    # with open(output_path, 'w') as f:
+    # json.dump(proof_response.model_dump(), f, indent=2)
     console_logger.info(f'Proof generation complete: {proof_response}')
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m audata_proof')
+    parser.add_argument(
+        '--startup-profile',
+        action='store_true',
+        help='report time of imports and initialization of every stage',
+    )
+    args = parser.parse_args()
+
+    profile = StartupProfile(enabled=args.startup_profile)
     try:
-        run()
+        run(profile)
     except Exception as e:
         console_logger.error(f'Error during proof generation: {e}')
         traceback.print_exc()
         sys.exit(1)
+    finally:
+        if profile.enabled:
+            console_logger.info(f'Startup profile:\n{profile.report()}')
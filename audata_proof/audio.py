@@ -0,0 +1,313 @@
+import io
+import os
+import tempfile
+import threading
+from collections.abc import Iterable, Iterator
+from functools import cached_property
+
+import numpy as np
+import soundfile as sf
+from loguru import logger as console_logger
+
+from audata_proof.config import settings
+
+# acoustid, librosa and soxr are imported where they're used, so
+# reading inputs and fingerprinting don't import what they don't need
+
+# Amount of frames converted to PCM at once while fingerprinting
+PCM_BLOCK_SIZE = 4096
+# Seconds decoded around an excerpt, so its edges are resampled
+# as they are within the whole file
+EXCERPT_MARGIN = 0.1
+
+
+class AudioAsset:
+    """
+    Audio file decoded once and shared between all handlers.
+
+    The file is decoded at its native sample rate on first access,
+    views needed by handlers (resampled audio, PCM for chromaprint)
+    are computed on first access and cached. Fingerprinting decodes
+    only the part chromaprint reads, until then.
+
+    When streaming, handlers read the file block by block with
+    `blocks` and `stream`, or a part of it with `excerpt`, so memory
+    they need doesn't depend on its length. `samples` and other views
+    of the whole file are still available.
+    """
+
+    def __init__(
+        self,
+        source: str | bytes,
+        name: str | None = None,
+        streaming: bool | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        source : str | bytes
+            Path to the audio file or its content.
+        name : str, optional
+            Name of the file, by default path's base name.
+        streaming : bool, optional
+            Decode the file block by block, by default if
+            `settings.AUDIO_DECODE` is 'stream'. Formats libsndfile
+            can't read are decoded fully anyway.
+        """
+        self.source = source
+        self.name = name or (
+            os.path.basename(source) if isinstance(source, str) else 'audio'
+        )
+        if streaming is None:
+            streaming = settings.AUDIO_DECODE == 'stream'
+        self._resampled: dict[int, np.ndarray] = {}
+        # Handlers might run concurrently, see `proof.run_stages`
+        self._lock = threading.Lock()
+
+        try:
+            with self._open() as f:
+                self.sample_rate = f.samplerate
+                self._channels = f.channels
+                self.frames = f.frames
+            self.streaming = streaming
+        except sf.LibsndfileError as e:
+            # librosa falls back to audioread for such formats
+            console_logger.debug(f'Decoding {self.name} upfront: {e}')
+            self.streaming = False
+            self.samples = self._load()
+
+    def _open(self) -> sf.SoundFile:
+        return sf.SoundFile(
+            io.BytesIO(self.source)
+            if isinstance(self.source, bytes)
+            else self.source
+        )
+
+    def _load(self) -> np.ndarray:
+        """Decode the whole file, it keeps channels for chromaprint."""
+        import librosa
+
+        samples, self.sample_rate = librosa.load(
+            io.BytesIO(self.source)
+            if isinstance(self.source, bytes)
+            else self.source,
+            sr=None,
+            mono=False,
+        )
+        samples = np.atleast_2d(samples)
+        # Length in the header might be an estimate, e.g. of mp3
+        self._channels, self.frames = samples.shape
+        return samples
+
+    @cached_property
+    def samples(self) -> np.ndarray:
+        """Samples of every channel, decoded on first access."""
+        if self.streaming:
+            return np.concatenate(list(self.blocks()), axis=1)
+        return self._load()
+
+    @property
+    def channels(self) -> int:
+        return self._channels
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate
+
+    def resampled_length(self, sample_rate: int) -> int:
+        """Length of `resampled(sample_rate)`, without resampling."""
+        if sample_rate == self.sample_rate:
+            return self.frames
+        # Same as `librosa.resample` computes it
+        return int(np.ceil(self.frames * (sample_rate / self.sample_rate)))
+
+    @cached_property
+    def mono(self) -> np.ndarray:
+        import librosa
+
+        return librosa.to_mono(self.samples)
+
+    def resampled(self, sample_rate: int) -> np.ndarray:
+        """
+        Mono audio at `sample_rate`.
+
+        Same as `librosa.load(file_path, sr=sample_rate)` would return.
+        When streaming, it's joined from `stream`, so the file isn't
+        held at its native sample rate meanwhile.
+        """
+        if sample_rate == self.sample_rate and not self.streaming:
+            return self.mono
+        with self._lock:
+            if sample_rate not in self._resampled:
+                if self.streaming:
+                    resampled = np.concatenate(list(self.stream(sample_rate)))
+                else:
+                    import librosa
+
+                    resampled = librosa.resample(
+                        self.mono,
+                        orig_sr=self.sample_rate,
+                        target_sr=sample_rate,
+                    )
+                self._resampled[sample_rate] = resampled
+            return self._resampled[sample_rate]
+
+    def blocks(self, block_len: int | None = None) -> Iterator[np.ndarray]:
+        """
+        Samples of every channel at the native sample rate, in blocks
+        of shape (channels, `block_len`), by default
+        `settings.AUDIO_BLOCK_LEN`.
+        """
+        block_len = block_len or settings.AUDIO_BLOCK_LEN
+        # Read from the file, unless it's decoded already
+        if 'samples' in self.__dict__:
+            for start in range(0, self.frames, block_len):
+                yield self.samples[:, start : start + block_len]
+            return
+        with self._open() as f:
+            for block in f.blocks(block_len, dtype='float32', always_2d=True):
+                yield block.T
+
+    def stream(
+        self, sample_rate: int, block_len: int | None = None
+    ) -> Iterator[np.ndarray]:
+        """
+        Mono audio at `sample_rate`, block by block.
+
+        Blocks are resampled with a streaming resampler of the same
+        quality `librosa.resample` uses, joined they have the length
+        of `resampled(sample_rate)` and match it up to rounding.
+        """
+        blocks = (block.mean(axis=0) for block in self.blocks(block_len))
+        if sample_rate == self.sample_rate:
+            yield from blocks
+            return
+
+        import soxr
+
+        resampler = soxr.ResampleStream(
+            self.sample_rate, sample_rate, 1, dtype='float32', quality='HQ'
+        )
+        # Length `librosa.resample` fixes its output to
+        left = self.resampled_length(sample_rate)
+        for block in blocks:
+            resampled = resampler.resample_chunk(block)[:left]
+            left -= len(resampled)
+            if len(resampled):
+                yield resampled
+        resampled = resampler.resample_chunk(
+            np.empty(0, np.float32), last=True
+        )[:left]
+        left -= len(resampled)
+        yield np.concatenate([resampled, np.zeros(left, np.float32)])
+
+    def excerpt(self, start: int, length: int, sample_rate: int) -> np.ndarray:
+        """
+        Mono audio at `sample_rate` from `start` on, at most `length`
+        samples. When streaming, only frames around it are decoded.
+        """
+        if not self.streaming:
+            return self.resampled(sample_rate)[start : start + length]
+
+        import soxr
+
+        # Up to the end of `resampled(sample_rate)`
+        length = max(
+            0, min(length, self.resampled_length(sample_rate) - start)
+        )
+
+        ratio = self.sample_rate / sample_rate
+        margin = int(EXCERPT_MARGIN * self.sample_rate)
+        first = max(0, int(start * ratio) - margin)
+        last = min(
+            self.frames, int(np.ceil((start + length) * ratio)) + margin
+        )
+        with self._open() as f:
+            f.seek(first)
+            block = f.read(last - first, dtype='float32', always_2d=True)
+        samples = block.T.mean(axis=0)
+        if sample_rate != self.sample_rate:
+            samples = soxr.resample(
+                samples, self.sample_rate, sample_rate, quality='HQ'
+            )
+        offset = round(start - first / ratio)
+        samples = samples[offset : offset + length]
+        # Resampling a part might round its length down
+        return np.pad(samples, (0, length - len(samples)))
+
+    def pcm_blocks(
+        self,
+        block_size: int = PCM_BLOCK_SIZE,
+        max_length: float | None = None,
+    ) -> Iterator[bytes]:
+        """
+        Interleaved 16-bit PCM blocks at the native sample rate, of
+        the first `max_length` seconds if it's given.
+        """
+        left = None if max_length is None else max_length * self.sample_rate
+        for block in self.blocks(block_size):
+            if left is not None:
+                if left <= 0:
+                    break
+                block = block[:, : int(np.ceil(left))]
+                left -= block.shape[1]
+            pcm = np.clip(block.T * 32768, -32768, 32767).astype('<i2')
+            yield pcm.tobytes()
+
+    @cached_property
+    def fingerprint(self) -> tuple[float, bytes]:
+        """
+        Duration and chromaprint fingerprint, as `fingerprint_file`.
+
+        Like it, only the first `acoustid.MAX_AUDIO_LENGTH` seconds
+        are fingerprinted, so only these are decoded, unless the whole
+        file is already.
+        """
+        import acoustid
+
+        if not acoustid.have_chromaprint:
+            # fpcalc decodes the file itself, so it needs one on disk,
+            # its extension tells the format
+            if isinstance(self.source, str):
+                return acoustid.fingerprint_file(self.source)
+            suffix = os.path.splitext(self.name)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+                f.write(self.source)
+                f.flush()
+                return acoustid.fingerprint_file(f.name)
+        fprint = acoustid.fingerprint(
+            self.sample_rate,
+            self.channels,
+            self.pcm_blocks(max_length=acoustid.MAX_AUDIO_LENGTH),
+        )
+        return self.duration, fprint
+
+
+def frame_blocks(
+    blocks: Iterable[np.ndarray], frame_len: int, hop_len: int
+) -> Iterator[np.ndarray]:
+    """
+    Frames of `frame_len` samples starting every `hop_len` samples
+    of a stream of 1-d blocks, e.g. `AudioAsset.stream`.
+
+    At most a frame and a block are held at once. The last item is
+    the remainder from the start of the frame after the last full
+    one to the end, shorter than `frame_len` and possibly empty.
+    """
+    if frame_len < 1 or hop_len < 1:
+        raise ValueError('frame_len and hop_len must be >= 1')
+
+    buffer = np.empty(0, np.float32)
+    # Samples between frames when they hop over more than their length
+    skip = 0
+    for block in blocks:
+        if skip:
+            dropped = min(skip, len(block))
+            block = block[dropped:]
+            skip -= dropped
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= frame_len:
+            yield buffer[:frame_len]
+            skip = max(0, hop_len - len(buffer))
+            buffer = buffer[hop_len:]
+    yield buffer
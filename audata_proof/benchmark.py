@@ -0,0 +1,389 @@
+"""
+Benchmarks of proof stages on synthetic data.
+
+Audio is synthetic speech-like signal and the uniqueness check runs
+against a synthetic corpus of contributions seeded into a database,
+so results are reproducible without any real submissions.
+
+The database is never the configured one, its URL is passed
+explicitly and has to be local unless `--allow-remote` is given,
+use a throwaway one. Nothing is registered while benchmarking, and
+seeded rows and the benchmark user are removed afterwards.
+
+Usage::
+
+    python -m audata_proof.benchmark --db-url postgresql+psycopg://...
+        --corpus 100000 --output bench.json
+    python -m audata_proof.benchmark --db-url postgresql+psycopg://...
+        --baseline bench.json
+
+With `--baseline` it exits with 1 if median time of any stage
+regressed by more than `--tolerance` against the stored report.
+"""
+
+import argparse
+import io
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from hashlib import md5
+from typing import Any
+from uuid import uuid4
+
+import numpy as np
+import soundfile as sf
+from loguru import logger as console_logger
+from pydantic import BaseModel
+from sqlalchemy import delete, func, insert
+from sqlalchemy.engine import make_url
+
+from audata_proof import handlers
+from audata_proof.audio import AudioAsset
+from audata_proof.config import settings
+from audata_proof.db import Database, db
+from audata_proof.fingerprint import encode_fingerprint, fingerprint_keys
+from audata_proof.proof import Proof
+from audata_proof.schemas.db import Contributions, FingerprintIndex, Users
+from audata_proof.utils import decode_db_fingerprint, process_audio
+
+# Marks rows of the synthetic corpus
+SYNTHETIC_LINK = 'synthetic://'
+# Telegram id of the user proofs are generated for
+BENCHMARK_USER = 'benchmark'
+# Hosts of databases considered local, no host is a Unix socket
+LOCAL_HOSTS = {None, '', 'localhost', '127.0.0.1', '::1'}
+
+
+class StageTiming(BaseModel):
+    """Wall time of a stage in seconds over repeated runs."""
+
+    median: float
+    min: float
+    mean: float
+    repeat: int
+
+
+class BenchmarkReport(BaseModel):
+    """
+    Timings of proof stages.
+
+    parameters: Audio duration, corpus size and other arguments.
+    environment: Python, platform and amount of CPUs.
+    stages: Timing of every stage by name.
+    """
+
+    parameters: dict[str, Any]
+    environment: dict[str, Any]
+    stages: dict[str, StageTiming]
+
+
+def synthetic_speech(
+    duration: float, sample_rate: int = 16000, seed: int = 0
+) -> np.ndarray:
+    """
+    Speech-like signal: harmonics of a wandering pitch shaped by
+    syllable-rate envelope, with pauses and a bit of noise.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * sample_rate)
+    t = np.arange(n) / sample_rate
+
+    # Pitch wanders between 100 and 250 Hz, changing every 50 ms
+    steps = rng.uniform(100, 250, size=int(duration * 20) + 2)
+    f0 = np.interp(t, np.arange(len(steps)) / 20, steps)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 11))
+
+    # About 4 syllables per second, every fifth one is a pause
+    syllables = rng.uniform(0.15, 0.35, size=int(duration * 4) + 2)
+    starts = np.concatenate([[0], np.cumsum(syllables)])
+    index = np.searchsorted(starts, t, side='right') - 1
+    position = (t - starts[index]) / syllables[index]
+    envelope = np.sin(np.pi * position) * (index % 5 != 4)
+
+    signal = voiced * envelope + 0.01 * rng.standard_normal(n)
+    return (0.5 * signal / np.abs(signal).max()).astype(np.float32)
+
+
+def synthetic_wav(
+    duration: float, sample_rate: int = 16000, seed: int = 0
+) -> bytes:
+    """`synthetic_speech` as content of a WAV file."""
+    buffer = io.BytesIO()
+    sf.write(
+        buffer,
+        synthetic_speech(duration, sample_rate, seed),
+        sample_rate,
+        format='WAV',
+    )
+    return buffer.getvalue()
+
+
+def seed_synthetic_corpus(
+    db: Database,
+    size: int,
+    length: int = 1000,
+    seed: int = 0,
+    batch_size: int = 10000,
+) -> int:
+    """
+    Make the database hold `size` synthetic contributions with
+    random fingerprints of `length` sub-fingerprints, indexed.
+
+    Returns
+    -------
+    int
+        Amount of contributions added.
+    """
+    with db.session() as session:
+        existing = (
+            session.query(func.count(Contributions.id))
+            .filter(Contributions.file_link.startswith(SYNTHETIC_LINK))
+            .scalar()
+        )
+    rng = np.random.default_rng([seed, existing])
+    for start in range(existing, size, batch_size):
+        contributions, index = [], []
+        for i in range(start, min(start + batch_size, size)):
+            frames = rng.integers(0, 2**32, size=length, dtype=np.uint32)
+            link = f'{SYNTHETIC_LINK}{i}'
+            contribution_id = uuid4()
+            contributions.append(
+                {
+                    'id': contribution_id,
+                    'fingerprint': frames.astype('<u4').tobytes(),
+                    'fingerprint_length': length,
+                    'fingerprint_hash': md5(frames.tobytes()).hexdigest(),
+                    'file_link': link,
+                    'file_link_hash': md5(link.encode()).hexdigest(),
+                    'duration': length * 0.124,
+                }
+            )
+            index.extend(
+                {'key': int(key), 'contribution_id': contribution_id}
+                for key in fingerprint_keys(frames)
+            )
+        with db.session() as session:
+            session.execute(insert(Contributions), contributions)
+            session.execute(insert(FingerprintIndex), index)
+        console_logger.info(f'Seeded {start + len(contributions)}/{size}')
+    return max(0, size - existing)
+
+
+def remove_synthetic_corpus(db: Database) -> int:
+    """
+    Delete contributions seeded by `seed_synthetic_corpus`, their
+    index rows are deleted with them.
+
+    Returns
+    -------
+    int
+        Amount of contributions deleted.
+    """
+    with db.session() as session:
+        return session.execute(
+            delete(Contributions).where(
+                Contributions.file_link.startswith(SYNTHETIC_LINK)
+            )
+        ).rowcount
+
+
+def is_local_url(db_url: str) -> bool:
+    """Whether a database URL points to this host."""
+    return make_url(db_url).host in LOCAL_HOSTS
+
+
+def time_stage(
+    stage: Callable[[Any], Any],
+    setup: Callable[[], Any] = lambda: None,
+    repeat: int = 5,
+    warmup: int = 1,
+) -> StageTiming:
+    """
+    Time `stage(setup())`, setup isn't timed, so every run can get
+    fresh arguments without caches warmed by the previous one.
+    """
+    times = []
+    for run in range(warmup + repeat):
+        argument = setup()
+        start = time.perf_counter()
+        stage(argument)
+        if run >= warmup:
+            times.append(time.perf_counter() - start)
+    return StageTiming(
+        median=float(np.median(times)),
+        min=float(np.min(times)),
+        mean=float(np.mean(times)),
+        repeat=repeat,
+    )
+
+
+def run_benchmarks(
+    db_url: str,
+    duration: float = 30.0,
+    corpus: int = 1000,
+    repeat: int = 5,
+    seed: int = 0,
+    stages: list[str] | None = None,
+) -> BenchmarkReport:
+    """
+    Time every stage, or the ones in `stages`, on synthetic data in
+    the database at `db_url`, see the module.
+    """
+    register = settings.REGISTER_CONTRIBUTIONS
+    settings.REGISTER_CONTRIBUTIONS = False
+    db.init(db_url)
+    with db.session() as session:
+        user_existed = (
+            session.query(Users.id)
+            .filter_by(telegram_id=BENCHMARK_USER)
+            .first()
+            is not None
+        )
+    try:
+        seed_synthetic_corpus(db, corpus, seed=seed)
+        timings = _time_stages(duration, repeat, seed, stages)
+    finally:
+        removed = remove_synthetic_corpus(db)
+        if not user_existed:
+            with db.session() as session:
+                session.execute(
+                    delete(Users).where(Users.telegram_id == BENCHMARK_USER)
+                )
+        console_logger.info(f'Removed {removed} synthetic contributions')
+        db.dispose()
+        settings.REGISTER_CONTRIBUTIONS = register
+
+    return BenchmarkReport(
+        parameters={
+            'duration': duration,
+            'corpus': corpus,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        environment={
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        stages=timings,
+    )
+
+
+def _time_stages(
+    duration: float, repeat: int, seed: int, stages: list[str] | None
+) -> dict[str, StageTiming]:
+    content = synthetic_wav(duration, seed=seed)
+    # Fingerprint as the legacy text column stores it
+    frames = np.random.default_rng(seed).integers(
+        0, 2**32, size=int(duration * 8), dtype=np.uint32
+    )
+    db_fprint = '\\x' + encode_fingerprint(frames).hex()
+
+    def audio() -> AudioAsset:
+        return AudioAsset(content, 'synthetic.wav')
+
+    def fingerprinted_audio() -> AudioAsset:
+        asset = audio()
+        # Fingerprinting isn't part of the uniqueness check itself
+        _ = asset.fingerprint
+        return asset
+
+    with tempfile.NamedTemporaryFile(suffix='.wav') as f:
+        f.write(content)
+        f.flush()
+        benchmarks: dict[str, tuple[Callable, Callable]] = {
+            'decode_db_fingerprint': (
+                decode_db_fingerprint,
+                lambda: db_fprint,
+            ),
+            'process_audio': (process_audio, lambda: f.name),
+            'check_uniqueness': (
+                lambda asset: handlers.check_uniqueness(asset, db),
+                fingerprinted_audio,
+            ),
+            'check_uniqueness_scan': (
+                lambda asset: handlers.check_uniqueness(
+                    asset, db, use_index=False
+                ),
+                fingerprinted_audio,
+            ),
+            'check_authenticity': (handlers.check_authenticity, audio),
+            'check_quality': (handlers.Quality().check_quality, audio),
+            'proof_generate': (
+                lambda proof: proof.generate(),
+                lambda: Proof(db, {'synthetic.wav': content}, BENCHMARK_USER),
+            ),
+        }
+        return {
+            name: time_stage(stage, setup, repeat)
+            for name, (stage, setup) in benchmarks.items()
+            if not stages or name in stages
+        }
+
+
+def compare(
+    report: BenchmarkReport, baseline: BenchmarkReport, tolerance: float
+) -> list[str]:
+    """Stages whose median time exceeds the baseline's by `tolerance`."""
+    regressions = []
+    for name, timing in report.stages.items():
+        if name not in baseline.stages:
+            continue
+        expected = baseline.stages[name].median
+        change = timing.median / expected - 1 if expected else 0.0
+        console_logger.info(
+            f'{name}: {timing.median:.4f}s, baseline {expected:.4f}s '
+            f'({change:+.1%})'
+        )
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m audata_proof.benchmark')
+    parser.add_argument(
+        '--db-url',
+        required=True,
+        help='Database to seed, a throwaway one, never DB_URI',
+    )
+    parser.add_argument(
+        '--allow-remote',
+        action='store_true',
+        help='Allow a database on another host',
+    )
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--corpus', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='*')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if not (args.allow_remote or is_local_url(args.db_url)):
+        parser.error('--db-url is not local, pass --allow-remote if it is')
+
+    report = run_benchmarks(
+        args.db_url,
+        args.duration,
+        args.corpus,
+        args.repeat,
+        args.seed,
+        args.stages,
+    )
+    with open(args.output, 'w') as f:
+        f.write(report.model_dump_json(indent=2))
+    console_logger.info(f'Benchmark report written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = BenchmarkReport.model_validate_json(f.read())
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            console_logger.error(f'Regressed stages: {regressions}')
+            sys.exit(1)
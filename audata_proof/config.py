@@ -1,6 +1,7 @@
 from functools import lru_cache
 from typing import Literal
 
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -14,6 +15,8 @@ class Settings(BaseSettings):
 
     path_to_yaml: str = 'audata_proof/model/model_config_RawNet.yaml'
     path_to_model: str = 'audata_proof/model/model.pth'
+    # Exported with `python -m audata_proof.model.export`
+    path_to_onnx_model: str = 'audata_proof/model/model.onnx'
 
     # Terms explanation:
     # "staging" term is equivalent to "testnet"
@@ -29,6 +32,108 @@ class Settings(BaseSettings):
     USER_EMAIL: str | None = None
     OUTPUT_DIR: str = 'demo/output'
 
+    # How proof stages are run, either one after another or
+    # concurrently, each in its own thread
+    PROOF_EXECUTOR: Literal['sequential', 'threads'] = 'sequential'
+    # Run checks from the cheapest to the most expensive one and
+    # stop at the first failed one, instead of running all of them
+    PROOF_EARLY_EXIT: bool = False
+    # Processes evaluating files of a proof in parallel, 0 is
+    # the amount of CPUs
+    PROOF_WORKERS: int = 0
+    # Include metrics of stages into attributes of the proof, they
+    # are written to metrics.json in OUTPUT_DIR (in the job directory
+    # of the daemon) either way
+    PROOF_METRICS_IN_RESPONSE: bool = False
+    # Profile a single proof, see `audata_proof.metrics.profiled`
+    PROOF_PROFILER: Literal['none', 'cprofile', 'torch'] = 'none'
+
+    # How audio is decoded, 'full' holds the whole file in memory,
+    # 'stream' decodes and resamples it block by block, so memory of
+    # checks doesn't grow with length of recordings
+    AUDIO_DECODE: Literal['full', 'stream'] = 'full'
+    # Frames at the native sample rate decoded at once when streaming
+    AUDIO_BLOCK_LEN: int = 65536
+
+    # Where the uniqueness check reads fingerprints from, 'snapshot'
+    # keeps a local copy synced incrementally, see `audata_proof.snapshot`
+    UNIQUENESS_SOURCE: Literal['db', 'snapshot'] = 'db'
+    # Directory of the snapshot, by default `fingerprints` in USE_SEALING
+    SNAPSHOT_DIR: str | None = None
+    # Seconds before the watermark queried again on every sync
+    SNAPSHOT_SYNC_LAG: float = 60.0
+
+    # Record files of valid proofs as contributions, so later
+    # uploads are checked against them
+    REGISTER_CONTRIBUTIONS: bool = True
+    # Smallest index keys of a fingerprint locked while registering
+    REGISTRATION_LOCK_KEYS: int = 4
+    # Compare only candidates found in the fingerprint index, False
+    # scans every contribution, which is exhaustive but slower
+    UNIQUENESS_USE_INDEX: bool = True
+    # Processes scanning shards of contributions when the index isn't
+    # used, 0 is the amount of CPUs
+    UNIQUENESS_SCAN_WORKERS: int = 1
+    # Seconds a sharded scan may take, it's scanned serially after
+    UNIQUENESS_SCAN_TIMEOUT: float = 300.0
+
+    # Daemon parameters, see `audata_proof.daemon`
+
+    SPOOL_DIR: str = 'demo/spool'
+    # Processes running jobs in parallel, 0 is the amount of CPUs
+    DAEMON_WORKERS: int = 0
+    # Seconds between checks for incoming jobs
+    DAEMON_POLL_INTERVAL: float = 0.5
+    # Times a job is started before it's failed, when processes
+    # running it keep dying
+    DAEMON_MAX_ATTEMPTS: int = 3
+
+    # Limits of uploaded zip archives, read in memory, sizes are
+    # in bytes of decompressed members
+    ARCHIVE_MAX_MEMBERS: int = 100
+    ARCHIVE_MAX_MEMBER_SIZE: int = 64 * 1024 * 1024
+    ARCHIVE_MAX_TOTAL_SIZE: int = 256 * 1024 * 1024
+    # Largest decompressed to compressed size ratio of a member
+    ARCHIVE_MAX_RATIO: int = 100
+
+    # Authenticity check parameters, lengths are in samples at 24 kHz
+
+    AUTHENTICITY_SEGMENT_LEN: int = 96000
+    # Hop between segment starts, less than segment length to overlap
+    AUTHENTICITY_HOP_LEN: int = 96000
+    # Trailing remainder shorter than that is dropped
+    AUTHENTICITY_MIN_TAIL_LEN: int = 24000
+    AUTHENTICITY_BATCH_SIZE: int = 8
+    # Inference backend of the RawNet model, the onnx one needs the
+    # model exported with `python -m audata_proof.model.export` first,
+    # which requires the dev dependencies
+    AUTHENTICITY_BACKEND: Literal['torch', 'onnx'] = 'torch'
+    # int8 quantizes GRU and Linear layers, only with torch backend.
+    # Check verdicts with `python -m audata_proof.model.quantization`
+    # before switching to it
+    AUTHENTICITY_PRECISION: Literal['fp32', 'int8'] = 'fp32'
+    # 0 lets ONNX Runtime pick amount of threads itself
+    ONNX_INTRA_OP_THREADS: int = 0
+    # 'sequential' evaluates segments spread over the file batch by
+    # batch and stops once the verdict can't flip
+    AUTHENTICITY_DECISION: Literal['mean', 'sequential'] = 'mean'
+    AUTHENTICITY_MIN_SEGMENTS: int = 8
+    # 0 is no limit, verdict is the one of evaluated segments then
+    AUTHENTICITY_MAX_SEGMENTS: int = 0
+    # Probability of the sequential verdict differing from the mean
+    # one, split between the checks done after every batch
+    AUTHENTICITY_ERROR_RATE: float = 0.01
+
+    # Quality check parameters
+
+    # DNSMOS windows to score, 'sampled' caps the cost of long files
+    QUALITY_WINDOWS: Literal['all', 'sampled'] = 'all'
+    # Seconds of audio scored at most in 'sampled' mode
+    QUALITY_MAX_DURATION: float = 120.0
+    QUALITY_BATCH_SIZE: int = 16
+    # Seed of windows sampling, so scores are reproducible
+    QUALITY_SEED: int = 0
+
     # Database environment variables
 
     DB_HOST_LOCAL: str = 'localhost'
@@ -62,6 +167,19 @@ class Settings(BaseSettings):
 
         return f'postgresql+psycopg://{user}:{password}@{host}:{port}/{db}'
 
+    @model_validator(mode='after')
+    def check_authenticity_model(self) -> 'Settings':
+        # There is no int8 ONNX model, see `AUTHENTICITY_MODELS`
+        if (
+            self.AUTHENTICITY_BACKEND == 'onnx'
+            and self.AUTHENTICITY_PRECISION == 'int8'
+        ):
+            raise ValueError(
+                'AUTHENTICITY_PRECISION int8 is only supported with '
+                'AUTHENTICITY_BACKEND torch'
+            )
+        return self
+
     # Settings class configuration
     model_config = SettingsConfigDict(
         # Env file should be in the same dir from where the app is executed
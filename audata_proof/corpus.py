@@ -0,0 +1,270 @@
+"""
+Bulk import of audio files into contributions.
+
+Files of a directory (searched recursively) or of a zip archive are
+fingerprinted on a pool of processes and inserted batch by batch
+together with their index keys. Every file is identified by its
+link, the path relative to the imported directory or archive. Links
+of files skipped as duplicates or failed are appended to a state
+file, by default PATH.skipped, files whose link is already in the
+database or in the state file are skipped before they're
+fingerprinted, so an interrupted import is resumed by running it
+again. Remove the state file to retry failed files.
+
+Usage: python -m audata_proof.corpus PATH [--workers N] [--batch-size N]
+    [--state FILE]
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+import zipfile
+from collections.abc import Iterator
+from hashlib import md5
+from typing import Any
+from uuid import uuid4
+
+from loguru import logger as console_logger
+from sqlalchemy.dialects.postgresql import insert
+
+from audata_proof.db import Database, db
+from audata_proof.fingerprint import (
+    decode_fingerprint,
+    fingerprint_keys,
+    pack_fingerprint,
+)
+from audata_proof.schemas.db import Contributions, FingerprintIndex
+
+AUDIO_EXTENSIONS = ('.ogg', '.wav', '.mp3', '.flac')
+
+# (link, path of the file or archive, archive member or None)
+Source = tuple[str, str, str | None]
+
+
+def iter_sources(path: str) -> Iterator[Source]:
+    """Audio files of a directory or a zip archive, sorted by link."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, 'r') as archive:
+            members = sorted(
+                info.filename
+                for info in archive.infolist()
+                if not info.is_dir()
+                and info.filename.lower().endswith(AUDIO_EXTENSIONS)
+            )
+        for member in members:
+            yield member, path, member
+        return
+
+    sources = []
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                file_path = os.path.join(root, filename)
+                link = os.path.relpath(file_path, path)
+                sources.append((link, file_path))
+    for link, file_path in sorted(sources):
+        yield link, file_path, None
+
+
+def link_hash(link: str) -> str:
+    return md5(link.encode()).hexdigest()
+
+
+def _fingerprint_source(source: Source) -> tuple[str, dict[str, Any] | None]:
+    """Link and row of a contribution with its index keys, or None."""
+    # Deferred, so the parent doesn't need librosa loaded to fork
+    from audata_proof.audio import AudioAsset
+
+    link, path, member = source
+    try:
+        if member is None:
+            audio = AudioAsset(path)
+        else:
+            with zipfile.ZipFile(path, 'r') as archive:
+                audio = AudioAsset(archive.read(member), link)
+        # Hash is computed as in uniqueness checks, so they find it
+        duration, fprint = audio.fingerprint
+        frames = decode_fingerprint(fprint)
+    except Exception as e:
+        console_logger.error(f'Failed to fingerprint {link}: {e}')
+        return link, None
+    return link, {
+        'id': uuid4(),
+        'fingerprint': pack_fingerprint(frames),
+        'fingerprint_length': len(frames),
+        'fingerprint_hash': md5(str(fprint).encode()).hexdigest(),
+        'file_link': link,
+        'file_link_hash': link_hash(link),
+        'duration': duration,
+        'keys': fingerprint_keys(frames).tolist(),
+    }
+
+
+def read_state(path: str) -> set[str]:
+    """Links of files settled by earlier runs, see the module."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as state:
+        return {line.rstrip('\n') for line in state if line.strip()}
+
+
+def write_state(path: str, links: list[str]) -> None:
+    """Append links of files skipped as duplicates or failed."""
+    if not links:
+        return
+    with open(path, 'a', encoding='utf-8') as state:
+        state.writelines(f'{link}\n' for link in links)
+        state.flush()
+        os.fsync(state.fileno())
+
+
+def pending_sources(
+    db: Database,
+    sources: list[Source],
+    settled: set[str] | None = None,
+    chunk_size: int = 10000,
+) -> list[Source]:
+    """Sources whose links aren't in the database nor settled yet."""
+    if settled:
+        sources = [source for source in sources if source[0] not in settled]
+    pending = []
+    for start in range(0, len(sources), chunk_size):
+        chunk = sources[start : start + chunk_size]
+        with db.session() as session:
+            imported = {
+                file_link_hash
+                for (file_link_hash,) in session.query(
+                    Contributions.file_link_hash
+                ).filter(
+                    Contributions.file_link_hash.in_(
+                        [link_hash(link) for link, _, _ in chunk]
+                    )
+                )
+            }
+        pending.extend(
+            source for source in chunk if link_hash(source[0]) not in imported
+        )
+    return pending
+
+
+def insert_batch(db: Database, rows: list[dict[str, Any]]) -> list[str]:
+    """
+    Insert contributions and their index keys in one transaction.
+
+    Rows conflicting with existing ones (same link or fingerprint
+    hash) are skipped, so are their keys.
+
+    Returns
+    -------
+    list[str]
+        Links of skipped rows.
+    """
+    keys = {row['id']: row.pop('keys') for row in rows}
+    with db.session() as session:
+        inserted = (
+            session.execute(
+                insert(Contributions)
+                .on_conflict_do_nothing()
+                .returning(Contributions.id),
+                rows,
+            )
+            .scalars()
+            .all()
+        )
+        index = [
+            {'key': key, 'contribution_id': contribution_id}
+            for contribution_id in inserted
+            for key in keys[contribution_id]
+        ]
+        if index:
+            session.execute(insert(FingerprintIndex), index)
+    inserted_ids = set(inserted)
+    return [row['file_link'] for row in rows if row['id'] not in inserted_ids]
+
+
+def import_corpus(
+    db: Database,
+    path: str,
+    workers: int = 0,
+    batch_size: int = 1000,
+    limit: int | None = None,
+    state: str | None = None,
+) -> int:
+    """
+    Import audio files of a directory or a zip archive, see the module.
+
+    Parameters
+    ----------
+    db : Database
+        Initialized database.
+    path : str
+        Directory or zip archive.
+    workers : int, optional
+        Processes fingerprinting files, 0 is the amount of CPUs.
+    batch_size : int, optional
+        Contributions inserted per transaction, by default 1000.
+    limit : int, optional
+        Import at most that many of pending files, by default all.
+    state : str, optional
+        File of links skipped as duplicates or failed, by default
+        `path` followed by `.skipped`.
+
+    Returns
+    -------
+    int
+        Amount of imported contributions.
+    """
+    state = state or os.path.normpath(path) + '.skipped'
+    sources = list(iter_sources(path))
+    pending = pending_sources(db, sources, read_state(state))[:limit]
+    console_logger.info(
+        f'{len(sources)} audio files found, '
+        f'{len(sources) - len(pending)} already imported or skipped'
+    )
+    if not pending:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    imported = skipped = failed = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers) as pool:
+        batch: list[dict[str, Any]] = []
+        failures: list[str] = []
+        rows = pool.imap_unordered(_fingerprint_source, pending, chunksize=4)
+        for done, (link, row) in enumerate(rows, start=1):
+            if row is None:
+                failures.append(link)
+            else:
+                batch.append(row)
+            if len(batch) == batch_size or done == len(pending):
+                duplicates = insert_batch(db, batch) if batch else []
+                write_state(state, duplicates + failures)
+                imported += len(batch) - len(duplicates)
+                skipped += len(duplicates)
+                failed += len(failures)
+                batch, failures = [], []
+                elapsed = time.perf_counter() - start
+                console_logger.info(
+                    f'{done}/{len(pending)} files processed, '
+                    f'{imported} imported, {skipped} duplicates skipped, '
+                    f'{failed} failed, {imported / elapsed:.1f} rows/s'
+                )
+    return imported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m audata_proof.corpus')
+    parser.add_argument('path', help='directory or zip archive of audio')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument(
+        '--state', help='file of skipped links, by default PATH.skipped'
+    )
+    args = parser.parse_args()
+
+    db.init()
+    import_corpus(
+        db, args.path, args.workers, args.batch_size, state=args.state
+    )
@@ -0,0 +1,355 @@
+"""
+Long-running proof worker.
+
+Everything a proof needs (imports, database engine and models) is
+initialized once, then jobs are taken from a spool directory::
+
+    SPOOL_DIR/
+        incoming/<job>/    Input directory of a job, as `INPUT_DIR`
+        processing/<daemon>/<job>/
+                           Job taken by a daemon, `<daemon>.lock`
+                           is locked while the daemon runs
+        done/<job>/        Inputs, `results.json` and `metrics.json`
+                           of a finished job
+        failed/<job>/      Inputs and `error.json` of a failed job
+
+A job has to appear in `incoming` at once, so write it elsewhere on
+the same filesystem and rename it there. Jobs are run by a pool of
+worker processes forked after models are loaded, so weights are
+shared with them copy-on-write. Jobs of a daemon that died, or of
+a worker that died, are moved back to incoming behind waiting jobs,
+once a job was started `DAEMON_MAX_ATTEMPTS` times it's failed
+instead, so an upload crashing workers can't do it forever. Daemons
+sharing a spool must run on the same host, as locks are.
+
+Run with `python -m audata_proof.daemon`, stop with SIGTERM or SIGINT.
+"""
+
+import contextlib
+import fcntl
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+import traceback
+from multiprocessing.pool import AsyncResult
+from uuid import uuid4
+
+import torch
+from loguru import logger as console_logger
+
+from audata_proof.config import settings
+from audata_proof.db import Database, db
+from audata_proof.metrics import profiled
+from audata_proof.model.registry import model_registry
+from audata_proof.proof import Proof
+from audata_proof.utils import extract_data
+
+INCOMING = 'incoming'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+# File of a job counting times it was started
+ATTEMPTS = '.attempts'
+
+
+def _attempts(job_dir: str) -> int:
+    try:
+        with open(os.path.join(job_dir, ATTEMPTS)) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+class Spool:
+    """
+    Directories jobs move through, every move is an atomic rename.
+
+    Every daemon claims jobs into its own directory in `processing`
+    and holds a lock of it while it runs, so jobs of daemons which
+    are gone can be told from jobs others are still running.
+    """
+
+    def __init__(self, path: str, owner: str | None = None) -> None:
+        self.path = path
+        # Unlike a pid, never reused by a later daemon
+        self.owner = owner or uuid4().hex
+        os.makedirs(os.path.join(path, PROCESSING), exist_ok=True)
+        # Released by the system when the daemon dies, forked workers
+        # share it. Taken before the directory is created, so one
+        # without a lock file is a job claimed by an older version.
+        self._lease = open(self._lease_file(self.owner), 'a')
+        fcntl.flock(self._lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for state in (INCOMING, PROCESSING, DONE, FAILED):
+            os.makedirs(self.dir(state), exist_ok=True)
+
+    def close(self) -> None:
+        self._lease.close()
+
+    def dir(self, state: str, job: str = '') -> str:
+        if state == PROCESSING:
+            return os.path.join(self.path, PROCESSING, self.owner, job)
+        return os.path.join(self.path, state, job)
+
+    def _lease_file(self, owner: str) -> str:
+        return os.path.join(self.path, PROCESSING, f'{owner}.lock')
+
+    def move(self, job: str, source: str, target: str) -> None:
+        os.rename(self.dir(source, job), self.dir(target, job))
+
+    def claim(self, limit: int) -> list[str]:
+        """Move at most `limit` incoming jobs to processing, oldest first."""
+        entries = []
+        for entry in os.scandir(self.dir(INCOMING)):
+            try:
+                entries.append((entry.stat().st_mtime, entry))
+            except FileNotFoundError:
+                # Claimed by another daemon meanwhile
+                continue
+
+        jobs: list[str] = []
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            if len(jobs) == limit:
+                break
+            if not entry.is_dir():
+                continue
+            try:
+                self.move(entry.name, INCOMING, PROCESSING)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                console_logger.error(f'Failed to claim job {entry.name}: {e}')
+                continue
+            jobs.append(entry.name)
+        return jobs
+
+    def requeue(self) -> list[str]:
+        """Move jobs of daemons which are gone back to incoming."""
+        jobs = []
+        for entry in os.scandir(os.path.join(self.path, PROCESSING)):
+            if not entry.is_dir() or entry.name == self.owner:
+                continue
+            lease_file = self._lease_file(entry.name)
+            if not os.path.exists(lease_file):
+                try:
+                    state = self.retry(entry.path, entry.name)
+                except FileNotFoundError:
+                    # Requeued by another daemon meanwhile
+                    continue
+                if state == INCOMING:
+                    jobs.append(entry.name)
+                continue
+            with open(lease_file, 'a') as lease:
+                try:
+                    fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Its daemon still runs
+                    continue
+                # Unless another daemon requeued them meanwhile
+                if os.path.isdir(entry.path):
+                    for job in os.scandir(entry.path):
+                        if not job.is_dir():
+                            continue
+                        if self.retry(job.path, job.name) == INCOMING:
+                            jobs.append(job.name)
+                    shutil.rmtree(entry.path)
+                os.remove(lease_file)
+        return sorted(jobs)
+
+    def retry(self, job_dir: str, job: str) -> str:
+        """
+        Move a job whose process died back to incoming, or to failed
+        once it was started `DAEMON_MAX_ATTEMPTS` times.
+
+        Returns
+        -------
+        str
+            State the job was moved to.
+        """
+        attempts = _attempts(job_dir)
+        if attempts >= settings.DAEMON_MAX_ATTEMPTS:
+            console_logger.error(
+                f'Process running {job} died {attempts} times, failing it'
+            )
+            with open(os.path.join(job_dir, 'error.json'), 'w') as f:
+                json.dump(
+                    {
+                        'error': 'Process running the job died',
+                        'attempts': attempts,
+                    },
+                    f,
+                    indent=2,
+                )
+            os.rename(job_dir, self.dir(FAILED, job))
+            return FAILED
+        # Renaming keeps the time it came in, jobs are claimed oldest
+        # first and it would be claimed again right away
+        os.utime(job_dir)
+        os.rename(job_dir, self.dir(INCOMING, job))
+        return INCOMING
+
+    def _pid_file(self, job: str) -> str:
+        return self.dir(PROCESSING, f'{job}.pid')
+
+    def started(self, job: str) -> None:
+        """Record the process running a claimed job, see `lost`."""
+        job_dir = self.dir(PROCESSING, job)
+        attempts = _attempts(job_dir) + 1
+        with open(os.path.join(job_dir, ATTEMPTS), 'w') as f:
+            f.write(str(attempts))
+        with open(self._pid_file(job), 'w') as f:
+            f.write(str(os.getpid()))
+
+    def finished(self, job: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._pid_file(job))
+
+    def lost(self, job: str) -> bool:
+        """Whether the process running a claimed job died during it."""
+        try:
+            with open(self._pid_file(job)) as f:
+                pid = int(f.read())
+        except (FileNotFoundError, ValueError):
+            # Not started yet
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        return False
+
+
+def run_job(spool: Spool, job: str, db: Database) -> bool:
+    """
+    Generate proof of a claimed job and move it to done or failed.
+
+    Returns
+    -------
+    bool
+        Whether the proof was generated.
+    """
+    job_dir = spool.dir(PROCESSING, job)
+    try:
+        audio_files, telegram_id = extract_data(job_dir)
+        proof = Proof(db, audio_files, telegram_id)
+        with profiled(settings.PROOF_PROFILER, job_dir):
+            proof_response = proof.generate()
+    except Exception as e:
+        console_logger.error(f'Error during proof generation of {job}: {e}')
+        with open(os.path.join(job_dir, 'error.json'), 'w') as f:
+            json.dump(
+                {'error': str(e), 'traceback': traceback.format_exc()},
+                f,
+                indent=2,
+            )
+        spool.move(job, PROCESSING, FAILED)
+        return False
+
+    with open(os.path.join(job_dir, 'results.json'), 'w') as f:
+        json.dump(proof_response.model_dump(), f, indent=2)
+    with open(os.path.join(job_dir, 'metrics.json'), 'w') as f:
+        f.write(proof.metrics.model_dump_json(indent=2))
+    spool.move(job, PROCESSING, DONE)
+    console_logger.info(f'Proof of {job} generated: {proof_response}')
+    return True
+
+
+# Spool of a worker process, set by `_init_worker`
+_worker_spool: Spool | None = None
+
+
+def _init_worker(spool: Spool, workers: int) -> None:
+    global _worker_spool
+    # Connections inherited from the parent can't be shared
+    db.dispose(close=False)
+    _worker_spool = spool
+    # Workers are daemonic and can't fork their own pools, files
+    # of a job are evaluated one by one
+    settings.PROOF_WORKERS = 1
+    # Split CPUs between workers instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    # Signals are handled by the parent, which lets running jobs
+    # finish, handlers inherited from it are reset
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _run_job_in_worker(job: str) -> bool:
+    spool: Spool = _worker_spool  # type: ignore
+    spool.started(job)
+    try:
+        return run_job(spool, job, db)
+    finally:
+        spool.finished(job)
+
+
+def _running(
+    spool: Spool, pending: dict[str, AsyncResult]
+) -> dict[str, AsyncResult]:
+    """
+    Jobs still running, a job whose worker died never finishes,
+    it's retried, see `Spool.retry`. The pool replaces the worker.
+    """
+    running = {}
+    for job, result in pending.items():
+        if result.ready():
+            continue
+        if spool.lost(job):
+            console_logger.error(f'Worker of {job} died')
+            spool.finished(job)
+            spool.retry(spool.dir(PROCESSING, job), job)
+            continue
+        running[job] = result
+    return running
+
+
+def serve(spool: Spool, stop: threading.Event) -> None:
+    """Run jobs of the spool until `stop` is set."""
+    workers = settings.DAEMON_WORKERS or os.cpu_count() or 1
+    context = multiprocessing.get_context('fork')
+    # Leaving the pool terminates its idle workers, as lost jobs
+    # would keep `join` waiting for them
+    with context.Pool(
+        workers, initializer=_init_worker, initargs=(spool, workers)
+    ) as pool:
+        console_logger.info(
+            f'Serving jobs of {spool.path} with {workers} worker(s)'
+        )
+        pending: dict[str, AsyncResult] = {}
+        while not stop.is_set():
+            pending = _running(spool, pending)
+            # Don't claim more jobs than workers can take right away,
+            # so the rest stay in incoming for other daemons
+            for job in spool.claim(workers - len(pending)):
+                pending[job] = pool.apply_async(_run_job_in_worker, (job,))
+            stop.wait(settings.DAEMON_POLL_INTERVAL)
+
+        console_logger.info(f'Stopping, waiting for {len(pending)} job(s)')
+        while pending:
+            time.sleep(settings.DAEMON_POLL_INTERVAL)
+            pending = _running(spool, pending)
+
+
+def run() -> None:
+    db.init()
+    model_registry.preload()
+
+    spool = Spool(settings.SPOOL_DIR)
+    requeued = spool.requeue()
+    if requeued:
+        console_logger.info(f'Requeued interrupted jobs: {requeued}')
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    try:
+        serve(spool, stop)
+    finally:
+        spool.close()
+
+
+if __name__ == '__main__':
+    run()
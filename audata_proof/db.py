@@ -2,7 +2,7 @@ from contextlib import contextmanager
 from typing import Generator
 
 from loguru import logger as console_logger
-from sqlalchemy import create_engine
+from sqlalchemy import Connection, create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, sessionmaker
 
@@ -15,9 +15,12 @@ class Database:
         self._engine = None
         self._SessionLocal = None
 
-    def init(self) -> None:
+    def init(self, uri: str | None = None) -> None:
+        """Connect to `uri`, by default `settings.DB_URI`."""
         try:
-            self._engine = create_engine(settings.DB_URI, pool_pre_ping=True)
+            self._engine = create_engine(
+                uri or settings.DB_URI, pool_pre_ping=True
+            )
             # Temporary table creation for development purposes
             # In production use Alembic
             Base.metadata.create_all(self._engine)
@@ -28,6 +31,16 @@ class Database:
             console_logger.error(f'Database initialization failed: {e}')
             raise
 
+    def dispose(self, close: bool = True) -> None:
+        """
+        Drop pooled connections.
+
+        In a forked process use `close=False`, so connections
+        inherited from the parent process aren't closed for it.
+        """
+        if self._engine:
+            self._engine.dispose(close=close)
+
     @contextmanager
     def session(self) -> Generator[Session, None, None]:
         if not self._SessionLocal:
@@ -46,6 +59,22 @@ class Database:
         finally:
             session.close()
 
+    @contextmanager
+    def autocommit(self) -> Generator[Connection, None, None]:
+        """
+        Connection committing every statement on its own.
+
+        No BEGIN and COMMIT are sent, so a single atomic statement
+        costs one round-trip instead of three.
+        """
+        if not self._engine:
+            raise RuntimeError('Database not initialized. Call init() first.')
+
+        with self._engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT'
+        ) as connection:
+            yield connection
+
 
 # Global database instance
 db = Database()
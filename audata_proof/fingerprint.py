@@ -0,0 +1,256 @@
+import base64
+
+import numpy as np
+
+# Layout of chromaprint's compressed fingerprint format, see
+# https://github.com/acoustid/chromaprint/blob/master/src/fingerprint_compressor.cpp
+_HEADER_SIZE = 4
+_NORMAL_BITS = 3
+_EXCEPTION_BITS = 5
+_MAX_NORMAL_VALUE = (1 << _NORMAL_BITS) - 1
+
+# Byte order of sub-fingerprints stored in the database is fixed,
+# so stored values don't depend on the machine
+_PACKED_DTYPE = np.dtype('<u4')
+
+# Same matching parameters as `acoustid.compare_fingerprints` uses
+MAX_ALIGN_OFFSET = 120
+MAX_BIT_ERROR = 2
+
+# Sub-fingerprints are quantized to their upper bits before being used
+# as index keys, so that a couple of flipped low bits (which is what
+# re-encoding usually does) don't change the key
+INDEX_KEY_SHIFT = 12
+# Keys indexed per fingerprint, the ones with the smallest hashes,
+# so the index grows by a fixed amount of rows per contribution
+INDEX_KEYS = 64
+
+
+def _unpack(data: np.ndarray, bits: int, count: int) -> np.ndarray:
+    """Read `count` little-endian packed integers of `bits` width."""
+    stream = np.unpackbits(data, bitorder='little')[: count * bits]
+    weights = 1 << np.arange(bits, dtype=np.uint8)
+    return stream.reshape(count, bits) @ weights
+
+
+def _pack(values: np.ndarray, bits: int) -> bytes:
+    """Pack integers into a little-endian bit stream of `bits` width."""
+    shifts = np.arange(bits, dtype=np.uint8)
+    stream = ((values[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+    return np.packbits(stream, bitorder='little').tobytes()
+
+
+def decode_fingerprint(fprint: bytes | str) -> np.ndarray:
+    """
+    Decode a compressed chromaprint fingerprint into sub-fingerprints.
+
+    Pure NumPy counterpart of `chromaprint.decode_fingerprint`, so
+    it works without libchromaprint being installed.
+
+    Parameters
+    ----------
+    fprint : bytes | str
+        Base64 encoded fingerprint as returned by `fingerprint_file`.
+
+    Returns
+    -------
+    np.ndarray
+        Sub-fingerprints as uint32 array.
+
+    Raises
+    ------
+    ValueError
+        If the fingerprint is truncated or malformed.
+    """
+    if isinstance(fprint, str):
+        fprint = fprint.encode()
+    # Chromaprint uses url-safe base64 without padding
+    raw = base64.urlsafe_b64decode(fprint + b'=' * (-len(fprint) % 4))
+    if len(raw) < _HEADER_SIZE:
+        raise ValueError('Fingerprint is too short to contain a header')
+
+    size = int.from_bytes(raw[1:_HEADER_SIZE], 'big')
+    data = np.frombuffer(raw, dtype=np.uint8, offset=_HEADER_SIZE)
+    if size == 0:
+        return np.zeros(0, dtype=np.uint32)
+
+    # Every sub-fingerprint is terminated by a zero value, so the
+    # normal section ends right after the `size`-th zero
+    capacity = len(data) * 8 // _NORMAL_BITS
+    normal = _unpack(data, _NORMAL_BITS, capacity).astype(np.int64)
+    terminators = np.flatnonzero(normal == 0)
+    if len(terminators) < size:
+        raise ValueError('Fingerprint is truncated')
+    normal = normal[: terminators[size - 1] + 1]
+
+    exceptional = np.flatnonzero(normal == _MAX_NORMAL_VALUE)
+    if len(exceptional):
+        offset = -(-len(normal) * _NORMAL_BITS // 8)
+        rest = data[offset:]
+        if len(rest) * 8 < len(exceptional) * _EXCEPTION_BITS:
+            raise ValueError('Fingerprint is truncated')
+        normal[exceptional] += _unpack(rest, _EXCEPTION_BITS, len(exceptional))
+
+    # Values are deltas between positions of set bits, restarting
+    # after every terminator
+    frame = np.zeros(len(normal), dtype=np.int64)
+    frame[1:] = np.cumsum(normal == 0)[:-1]
+    starts = np.concatenate(([0], terminators[: size - 1] + 1))
+    positions = np.cumsum(normal)
+    positions -= np.concatenate(([0], positions[starts[1:] - 1]))[frame]
+
+    is_bit = normal != 0
+    xored = np.zeros(size, dtype=np.uint32)
+    np.bitwise_or.at(
+        xored,
+        frame[is_bit],
+        np.left_shift(1, positions[is_bit] - 1).astype(np.uint32),
+    )
+    # Consecutive sub-fingerprints are stored XOR-ed with each other
+    return np.bitwise_xor.accumulate(xored)
+
+
+def encode_fingerprint(frames: np.ndarray, algorithm: int = 1) -> bytes:
+    """
+    Encode sub-fingerprints into chromaprint's compressed format.
+
+    Inverse of `decode_fingerprint`, mostly useful to build
+    fingerprints without decoding any audio.
+    """
+    frames = np.asarray(frames, dtype=np.uint32)
+    xored = frames.copy()
+    xored[1:] ^= frames[:-1]
+
+    values = []
+    for x in xored.tolist():
+        bit, last_bit = 1, 0
+        while x:
+            if x & 1:
+                values.append(bit - last_bit)
+                last_bit = bit
+            x >>= 1
+            bit += 1
+        values.append(0)
+
+    values = np.asarray(values, dtype=np.uint8)
+    header = bytes([algorithm]) + len(frames).to_bytes(3, 'big')
+    normal = _pack(np.minimum(values, _MAX_NORMAL_VALUE), _NORMAL_BITS)
+    exceptional = values[values >= _MAX_NORMAL_VALUE] - _MAX_NORMAL_VALUE
+    raw = header + normal + _pack(exceptional, _EXCEPTION_BITS)
+    return base64.urlsafe_b64encode(raw).rstrip(b'=')
+
+
+def pack_fingerprint(frames: np.ndarray) -> bytes:
+    """Pack sub-fingerprints into bytes stored in the database."""
+    return np.asarray(frames, dtype=_PACKED_DTYPE).tobytes()
+
+
+def unpack_fingerprint(data: bytes | memoryview) -> np.ndarray:
+    """
+    Read sub-fingerprints packed by `pack_fingerprint`.
+
+    Returns a read-only view over `data` without copying it.
+    """
+    return np.frombuffer(data, dtype=_PACKED_DTYPE)
+
+
+def hash_keys(keys: np.ndarray) -> np.ndarray:
+    """
+    Mix index keys with the finalizer of MurmurHash3, a bijection
+    of uint32 values, so their order by hash is pseudo-random.
+    Keys are offset first, the finalizer alone keeps 0 in place.
+    """
+    h = np.asarray(keys, dtype=np.uint32) + np.uint32(0x9E3779B9)
+    h ^= h >> 16
+    h *= np.uint32(0x85EBCA6B)
+    h ^= h >> 13
+    h *= np.uint32(0xC2B2AE35)
+    h ^= h >> 16
+    return h
+
+
+def fingerprint_keys(
+    frames: np.ndarray, limit: int = INDEX_KEYS
+) -> np.ndarray:
+    """
+    Derive inverted index keys from sub-fingerprints.
+
+    Keys are the `limit` distinct quantized sub-fingerprint values
+    with the smallest hashes (a bottom-k min-hash sketch), ordered
+    by hash. Two recordings sharing a lot of quantized values share
+    a lot of these too, so they are good candidates for a full
+    comparison.
+    """
+    keys = np.unique(np.asarray(frames, dtype=np.uint32) >> INDEX_KEY_SHIFT)
+    order = np.argsort(hash_keys(keys), kind='stable')
+    return keys[order[:limit]]
+
+
+def stack_fingerprints(
+    fingerprints: list[np.ndarray],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stack decoded fingerprints of different lengths into one block.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Zero padded (amount, max length) uint32 block and the real
+        length of every fingerprint.
+    """
+    lengths = np.array([len(f) for f in fingerprints], dtype=np.int64)
+    block = np.zeros((len(fingerprints), lengths.max(initial=0)), np.uint32)
+    for row, fprint in zip(block, fingerprints):
+        row[: len(fprint)] = fprint
+    return block, lengths
+
+
+def compare_fingerprints_block(
+    query: np.ndarray, block: np.ndarray, lengths: np.ndarray
+) -> np.ndarray:
+    """
+    Score one decoded fingerprint against a block of candidates.
+
+    Vectorized equivalent of `acoustid.compare_fingerprints`: for
+    every alignment offset count sub-fingerprint pairs differing in
+    at most `MAX_BIT_ERROR` bits, the best offset's count divided by
+    the shorter fingerprint's length is the similarity score.
+
+    Parameters
+    ----------
+    query : np.ndarray
+        Decoded uint32 fingerprint.
+    block : np.ndarray
+        Candidates as returned by `stack_fingerprints`.
+    lengths : np.ndarray
+        Real lengths of candidates in the block.
+
+    Returns
+    -------
+    np.ndarray
+        Similarity score between 0.0 and 1.0 for every candidate.
+    """
+    query = np.asarray(query, dtype=np.uint32)
+    width = block.shape[1]
+    # Padding must never be counted as a match
+    valid = np.arange(width) < lengths[:, None]
+    best = np.zeros(len(block), dtype=np.int64)
+
+    # Offset is the position in query minus position in candidate
+    for offset in range(1 - MAX_ALIGN_OFFSET, MAX_ALIGN_OFFSET + 1):
+        start = max(0, offset)
+        stop = min(len(query), width + offset)
+        if stop <= start:
+            continue
+        candidates = slice(start - offset, stop - offset)
+        matches = (
+            np.bitwise_count(query[start:stop] ^ block[:, candidates])
+            <= MAX_BIT_ERROR
+        )
+        matches &= valid[:, candidates]
+        np.maximum(best, matches.sum(axis=1), out=best)
+
+    shortest = np.minimum(len(query), lengths)
+    return np.divide(
+        best, shortest, out=np.zeros(len(block)), where=shortest > 0
+    )
@@ -1,42 +1,69 @@
+from collections.abc import Callable, Iterator
+from functools import partial
 from hashlib import md5
-from typing import Literal
+from typing import Any, Literal
 
+import librosa
 import numpy as np
 import torch
-import librosa
-import yaml
-from acoustid import compare_fingerprints, fingerprint_file
 from loguru import logger as console_logger
 from speechmos import dnsmos
+from sqlalchemy import func, select
+from sqlalchemy.orm import Query, Session
 
+from audata_proof import metrics
+from audata_proof.audio import AudioAsset, frame_blocks
 from audata_proof.config import settings
 from audata_proof.db import Database
-from audata_proof.model.model import RawNet
-from audata_proof.schemas.db import Contributions, Users
-from audata_proof.utils import decode_db_fingerprint, pad, process_audio
+from audata_proof.fingerprint import (
+    decode_fingerprint,
+    fingerprint_keys,
+    pack_fingerprint,
+    unpack_fingerprint,
+)
+from audata_proof.model.registry import model_registry
+from audata_proof.scan import find_similar, parallel_scan, scan_workers
+from audata_proof.schemas.authenticity_report import AuthenticityReport
+from audata_proof.schemas.db import Contributions, FingerprintIndex
+from audata_proof.schemas.quality_report import QualityReport
+from audata_proof.snapshot import get_snapshot
+from audata_proof.utils import index_contribution, pad, upsert_user
 
 
 def check_uniqueness(
-    file_path: str,
+    audio: AudioAsset,
     db: Database,
     similarity_threshold: float = 0.8,
-    yield_per: int = 5,
+    yield_per: int = 1000,
+    use_index: bool = True,
+    min_shared_ratio: float = 0.1,
+    max_candidates: int = 100,
 ) -> Literal[0, 1]:
     """
-    Check fingerprint for uniqueness.
+    Check fingerprint for uniqueness, first by exact hash and then
+    by similarity.
 
     Parameters
     ----------
-    file_path : str
-        Path to the fingerprint file.
+    audio : AudioAsset
+        Decoded audio file.
     db: Database
         Database object.
     similarity_threshold : float, optional
         Threshold above which a fingerprint is considered too
         similar, by default it's 0.8.
     yield_per: int, optional
-        Amount of entities loaded into memory while comparing
-        fingerprints.
+        Amount of entities loaded into memory and compared
+        at once, by default 1000.
+    use_index: bool, optional
+        Compare only candidates found in the fingerprint index
+        instead of scanning every contribution, by default True.
+    min_shared_ratio: float, optional
+        Minimal share of the current fingerprint's index keys a
+        contribution must have to become a candidate, by default 0.1.
+    max_candidates: int, optional
+        Maximal amount of candidates compared, the ones sharing
+        the most keys are taken, by default 100.
 
     Returns
     -------
@@ -45,22 +72,45 @@ def check_uniqueness(
 
     Raises
     ------
-    TypeError
-        if type of fingerprints were incorrect while
-        comparing.
-    Exception
-        If there is an unexpected error occured.
+    ValueError
+        If the arguments are out of range.
     """
-    # Check the function's input
-    if not 0.0 <= similarity_threshold <= 1.0:
-        raise ValueError('similarity_threshold must be between 0.0 and 1.0')
-    if yield_per < 1:
-        raise ValueError('yield_per must be >= 1')
+    if not check_exact_duplicate(audio, db):
+        return 0
+    return check_similarity(
+        audio,
+        db,
+        similarity_threshold,
+        yield_per,
+        use_index,
+        min_shared_ratio,
+        max_candidates,
+    )
+
+
+def check_exact_duplicate(audio: AudioAsset, db: Database) -> Literal[0, 1]:
+    """
+    Check that no contribution has exactly the same fingerprint,
+    a single lookup by its hash.
 
-    # Get fingerprint, duration, and hash
-    current_duration, current_fprint = fingerprint_file(file_path)
+    Returns
+    -------
+    1 if there is none
+    0 if there is
+    """
+    # Get fingerprint and hash
+    _, current_fprint = audio.fingerprint
     current_fprint_hash = md5(str(current_fprint).encode()).hexdigest()
 
+    if settings.UNIQUENESS_SOURCE == 'snapshot':
+        if get_snapshot(db).has_hash(current_fprint_hash):
+            console_logger.info(
+                'Exact fingerprint match found in snapshot:\n'
+                f'Hash of current fingerprint: {current_fprint_hash}'
+            )
+            return 0
+        return 1
+
     with db.session() as session:
         # Check for exactly the same one, if more than one - raise exception
         duplicate = (
@@ -73,162 +123,960 @@ def check_uniqueness(
                 'Exact fingerprint match found:\n'
                 f'Current fingerprint: {current_fprint}\n'
                 f'Hash of current fingerprint: {current_fprint_hash}\n'
-                f'Fingerprint in DB: {decode_db_fingerprint(str(duplicate.fingerprint))}\n'
+                f'Contribution in DB: {duplicate.id}\n'
                 f'Hash of fingerprint in DB: {duplicate.fingerprint_hash}'
             )
             return 0
+    return 1
+
 
-        # Loop through db fingerprints and compare for similarity
-        # Use yield_per to avoid loading all db in memory
-        for contribution in session.query(Contributions).yield_per(yield_per):
-            # Decode db fingerprint
-            db_fprint = decode_db_fingerprint(str(contribution.fingerprint))
+def check_similarity(
+    audio: AudioAsset,
+    db: Database,
+    similarity_threshold: float = 0.8,
+    yield_per: int = 1000,
+    use_index: bool = True,
+    min_shared_ratio: float = 0.1,
+    max_candidates: int = 100,
+) -> Literal[0, 1]:
+    """
+    Check that no contribution has a similar fingerprint, arguments
+    are the same as of `check_uniqueness`.
+
+    Returns
+    -------
+    1 if there is none
+    0 if there is
 
+    Raises
+    ------
+    ValueError
+        If the arguments are out of range.
+    """
+    # Check the function's input
+    if not 0.0 <= similarity_threshold <= 1.0:
+        raise ValueError('similarity_threshold must be between 0.0 and 1.0')
+    if yield_per < 1:
+        raise ValueError('yield_per must be >= 1')
+    if not 0.0 <= min_shared_ratio <= 1.0:
+        raise ValueError('min_shared_ratio must be between 0.0 and 1.0')
+    if max_candidates < 1:
+        raise ValueError('max_candidates must be >= 1')
+
+    _, current_fprint = audio.fingerprint
+    current_frames = decode_fingerprint(current_fprint)
+
+    if settings.UNIQUENESS_SOURCE == 'snapshot':
+        return _check_similarity_in_snapshot(
+            current_frames,
+            db,
+            similarity_threshold,
+            yield_per,
+            use_index,
+            min_shared_ratio,
+            max_candidates,
+        )
+
+    if not use_index:
+        workers = scan_workers(settings.UNIQUENESS_SCAN_WORKERS)
+        if workers > 1:
             try:
-                # Provide arguments in format (duration, fingerprint)
-                # `similarity_score` is guaranteed to be between 0.0 and 1.0
-                similarity_score = compare_fingerprints(
-                    (current_duration, current_fprint),
-                    (contribution.duration, db_fprint),
-                )
-            except TypeError as e:
-                # If the exception is raised check types and values of
-                # variables that compare_fingerprints function gets
-                console_logger.error(
-                    f'Type error in comparison: {e}'
-                    f'Current one: {current_fprint}\n'
-                    f'Hash of current one: {current_fprint_hash}\n'
-                    f'Existing one: {db_fprint}\n'
-                    f'Hash of existing one: {db_fprint}\n'
+                match = parallel_scan(
+                    current_frames,
+                    db,
+                    similarity_threshold,
+                    yield_per,
+                    workers,
+                    settings.UNIQUENESS_SCAN_TIMEOUT,
                 )
-                raise
-            # For debugging purposes
-            except Exception as e:
-                console_logger.error(
-                    f'Unexpected error while comparing fingerprints: {e}'
-                    f'Current one: {current_fprint}\n'
-                    f'Hash of current one: {current_fprint_hash}\n'
-                    f'Existing one: {db_fprint}\n'
-                    f'Hash of existing one: {db_fprint}\n'
+            except RuntimeError as e:
+                console_logger.error(f'{e}, scanning serially')
+            else:
+                if match:
+                    console_logger.info(
+                        'Similar fingerprint found '
+                        f'(similarity score: {match[1]}):\n'
+                        f'Existing: {match[0]}\n'
+                    )
+                    return 0
+                return 1
+
+    with db.session() as session:
+        unique = _is_unique_in_session(
+            session,
+            current_frames,
+            similarity_threshold,
+            yield_per,
+            use_index,
+            min_shared_ratio,
+            max_candidates,
+        )
+    # All checks are passed
+    return 1 if unique else 0
+
+
+def _is_unique_in_session(
+    session: Session,
+    current_frames: np.ndarray,
+    similarity_threshold: float,
+    yield_per: int,
+    use_index: bool,
+    min_shared_ratio: float,
+    max_candidates: int,
+) -> bool:
+    """Scan contributions visible to the session for a similar one."""
+    contributions = session.query(Contributions)
+    if use_index:
+        candidate_ids = _candidate_ids(
+            session, current_frames, min_shared_ratio, max_candidates
+        )
+        contributions = contributions.filter(
+            Contributions.id.in_(candidate_ids.scalar_subquery())
+        )
+
+    # Compare db fingerprints for similarity block by block
+    # Use yield_per to avoid loading all db in memory
+    block = []
+    for contribution in contributions.yield_per(yield_per):
+        block.append(contribution)
+        if len(block) == yield_per:
+            if not _is_unique_contributions(
+                current_frames, block, similarity_threshold
+            ):
+                return False
+            block = []
+    if block and not _is_unique_contributions(
+        current_frames, block, similarity_threshold
+    ):
+        return False
+    return True
+
+
+def _candidate_ids(
+    session: Session,
+    current_frames: np.ndarray,
+    min_shared_ratio: float,
+    max_candidates: int,
+) -> Query:
+    """Ids of contributions sharing enough index keys, most shared first."""
+    keys = fingerprint_keys(current_frames)
+    shared = func.count(FingerprintIndex.key)
+    return (
+        session.query(FingerprintIndex.contribution_id)
+        .filter(FingerprintIndex.key.in_(keys.tolist()))
+        .group_by(FingerprintIndex.contribution_id)
+        .having(shared >= max(1, int(len(keys) * min_shared_ratio)))
+        .order_by(shared.desc())
+        .limit(max_candidates)
+    )
+
+
+def _check_similarity_in_snapshot(
+    current_frames: np.ndarray,
+    db: Database,
+    similarity_threshold: float,
+    yield_per: int,
+    use_index: bool,
+    min_shared_ratio: float,
+    max_candidates: int,
+) -> Literal[0, 1]:
+    """
+    `check_similarity` reading fingerprints from the local snapshot,
+    only candidate ids are queried if the index is used.
+    """
+    snapshot = get_snapshot(db)
+    if use_index:
+        with db.session() as session:
+            ids = [
+                contribution_id
+                for (contribution_id,) in _candidate_ids(
+                    session, current_frames, min_shared_ratio, max_candidates
                 )
-                raise
+            ]
+        rows = snapshot.rows(ids)
+    else:
+        rows = np.arange(len(snapshot))
+
+    for start in range(0, len(rows), yield_per):
+        block = rows[start : start + yield_per]
+        if not _is_unique_block(
+            current_frames,
+            [snapshot.fingerprint(row) for row in block],
+            similarity_threshold,
+            lambda i, block=block: (
+                snapshot.id(block[i]),
+                snapshot.entries['hash'][block[i]].decode(),
+            ),
+        ):
+            return 0
+    return 1
+
+
+def _is_unique_block(
+    current_frames: np.ndarray,
+    fingerprints: list[np.ndarray],
+    similarity_threshold: float,
+    describe: Callable[[int], tuple[Any, str]],
+) -> bool:
+    """
+    Compare a fingerprint with a block of fingerprints at once,
+    `describe` gives id and hash of a fingerprint for the log.
+    """
+    metrics.count('rows_scanned', len(fingerprints))
+    found = find_similar(current_frames, fingerprints, similarity_threshold)
+    if found:
+        most_similar, score = found
+        contribution_id, fingerprint_hash = describe(most_similar)
+        console_logger.info(
+            'Similar fingerprint found '
+            f'(similarity score: {score}):\n'
+            f'Existing: {contribution_id}\n'
+            f'Hash of existing: {fingerprint_hash}\n'
+        )
+        return False
+    return True
+
+
+def _is_unique_contributions(
+    current_frames: np.ndarray,
+    contributions: list[Contributions],
+    similarity_threshold: float,
+) -> bool:
+    """Compare a fingerprint with a block of contributions at once."""
+    return _is_unique_block(
+        current_frames,
+        [
+            unpack_fingerprint(contribution.fingerprint)  # type: ignore
+            for contribution in contributions
+        ],
+        similarity_threshold,
+        lambda i: (contributions[i].id, contributions[i].fingerprint_hash),
+    )
+
+
+def batch_duplicates(
+    fingerprints: list[tuple[float, bytes]],
+    similarity_threshold: float = 0.8,
+) -> list[int]:
+    """
+    Indices of fingerprints identical or similar to an earlier one
+    of the same batch, e.g. files of one proof.
+
+    Files of a batch are checked against contributions only, so
+    copies of a file uploaded together pass on their own.
+    """
+    duplicates: list[int] = []
+    if len(fingerprints) < 2:
+        return duplicates
+
+    hashes = set()
+    frames: list[np.ndarray] = []
+    for i, (_, fprint) in enumerate(fingerprints):
+        fprint_hash = md5(str(fprint).encode()).hexdigest()
+        if fprint_hash in hashes:
+            duplicates.append(i)
+            continue
+        current_frames = decode_fingerprint(fprint)
+        if frames and find_similar(
+            current_frames, frames, similarity_threshold
+        ):
+            duplicates.append(i)
+            continue
+        hashes.add(fprint_hash)
+        frames.append(current_frames)
+    return duplicates
+
+
+def register_contributions(
+    db: Database,
+    files: list[tuple[str, tuple[float, bytes]]],
+    similarity_threshold: float = 0.8,
+    yield_per: int = 1000,
+    min_shared_ratio: float = 0.1,
+    max_candidates: int = 100,
+) -> list[str]:
+    """
+    Record accepted files as contributions, all of them or none, if
+    a duplicate of any was registered since its uniqueness check.
+
+    Uniqueness is checked again (by hash and then by similarity of
+    indexed candidates) and contributions are inserted within one
+    transaction, which holds advisory locks of buckets derived from
+    the fingerprints, see `registration_locks`. Uploads of the same
+    audio wait for each other and the later one sees the earlier one,
+    unrelated uploads aren't serialized. Files aren't compared with
+    each other, see `batch_duplicates`.
+
+    Parameters
+    ----------
+    db : Database
+        Database object.
+    files : list[tuple[str, tuple[float, bytes]]]
+        Names of files, stored as their links, and their duration
+        and fingerprint, as `AudioAsset.fingerprint`.
+
+    Other arguments are the same as of `check_uniqueness`.
+
+    Returns
+    -------
+    Names of files with a registered duplicate, nothing was
+    registered unless it's empty
+    """
+    contributions = []
+    for name, (duration, fprint) in files:
+        fprint_hash = md5(str(fprint).encode()).hexdigest()
+        contributions.append(
+            (name, duration, fprint_hash, decode_fingerprint(fprint))
+        )
+    locks = sorted(
+        {
+            bucket
+            for _, _, fprint_hash, frames in contributions
+            for bucket in registration_locks(fprint_hash, frames)
+        }
+    )
+
+    with db.session() as session:
+        # Locks are released when the transaction ends
+        for bucket in locks:
+            session.execute(select(func.pg_advisory_xact_lock(*bucket)))
 
-            if similarity_score >= similarity_threshold:
+        duplicates = []
+        for name, _, fprint_hash, frames in contributions:
+            duplicate = (
+                session.query(Contributions.id)
+                .filter_by(fingerprint_hash=fprint_hash)
+                .first()
+            )
+            if duplicate or not _is_unique_in_session(
+                session,
+                frames,
+                similarity_threshold,
+                yield_per,
+                True,
+                min_shared_ratio,
+                max_candidates,
+            ):
                 console_logger.info(
-                    f'Similar fingerprint found (similarity score: {similarity_score}):\n'
-                    f'Current: {current_fprint}\n'
-                    f'Hash of current: {current_fprint_hash}\n'
-                    f'Existing: {db_fprint}\n'
-                    f'Hash of existing: {db_fprint}\n'
+                    f'Duplicate of {name} was registered meanwhile, '
+                    f'hash of its fingerprint: {fprint_hash}'
                 )
-                return 0
-    # All checks are passed
-    return 1
+                duplicates.append(name)
+        if duplicates:
+            return duplicates
+
+        for name, duration, fprint_hash, frames in contributions:
+            contribution = Contributions(
+                fingerprint=pack_fingerprint(frames),
+                fingerprint_length=len(frames),
+                fingerprint_hash=fprint_hash,
+                file_link=name,
+                # Fingerprint hashes are unique, so these are too
+                file_link_hash=md5(
+                    f'{name}:{fprint_hash}'.encode()
+                ).hexdigest(),
+                duration=duration,
+            )
+            session.add(contribution)
+            # Flush to get the id assigned before indexing
+            session.flush()
+            index_contribution(session, contribution.id, frames)
+            console_logger.info(f'Contribution {contribution.id} registered')
+    return []
+
+
+# Namespaces of advisory locks taken by `register_contributions`
+_HASH_LOCK = 1
+_KEY_LOCK = 2
+
+
+def registration_locks(
+    fprint_hash: str, frames: np.ndarray
+) -> list[tuple[int, int]]:
+    """
+    Advisory lock keys of a fingerprint, sorted, so transactions
+    taking several of them can't deadlock.
+
+    Identical fingerprints share the bucket of their hash. Similar
+    ones share most index keys, so they very likely share one of
+    the `settings.REGISTRATION_LOCK_KEYS` keys with the smallest
+    hashes (min-hash), while unrelated ones rarely do. Keys are
+    picked by hash, not by value, as small values are common.
+    """
+    # Both halves of a key are int4, signed in PostgreSQL
+    locks = [(_HASH_LOCK, int(fprint_hash[:8], 16) - 2**31)]
+    # Index keys are ordered by hash already
+    keys = fingerprint_keys(frames, settings.REGISTRATION_LOCK_KEYS)
+    locks.extend((_KEY_LOCK, int(key)) for key in keys)
+    return sorted(locks)
 
 
 def check_ownership(telegram_id: str, db: Database) -> Literal[0, 1]:
     """
     A user is considered to pass ownership test unless they have been banned.
-    If the user doesn't exist, they're initialized and granted ownership.
+    If the user doesn't exist, they're initialized and granted ownership,
+    both in a single round-trip, see `upsert_user`.
 
     Returns
     -------
         1 if user has not been banned
         0 if banned
     """
-    with db.session() as session:
-        user = (
-            session.query(Users).filter_by(telegram_id=str(telegram_id)).one()
-        )
+    return 0 if upsert_user(telegram_id, db) else 1
+
+
+def segment_audio(
+    y: np.ndarray,
+    segment_len: int,
+    hop_len: int,
+    min_tail_len: int = 0,
+) -> tuple[torch.Tensor, torch.Tensor | None]:
+    """
+    Split audio into segments of equal length.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        Audio samples.
+    segment_len : int
+        Length of every segment.
+    hop_len : int
+        Distance between starts of neighbouring segments, segments
+        overlap if it's less than `segment_len`.
+    min_tail_len : int, optional
+        Trailing remainder not covered by full segments is dropped
+        if it's shorter than that, by default 0.
 
-        return 0 if user.is_banned else 1  # type: ignore
+    Returns
+    -------
+    tuple[torch.Tensor, torch.Tensor | None]
+        (amount, segment_len) view over full segments without any
+        copying, and the padded tail segment if there is one. Audio
+        shorter than a segment is padded into a single segment.
+    """
+    if segment_len < 1 or hop_len < 1:
+        raise ValueError('segment_len and hop_len must be >= 1')
 
+    samples = torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32))
+    if len(samples) <= segment_len:
+        return torch.from_numpy(pad(samples.numpy(), segment_len))[None], None
 
-def check_authenticity(file_path: str) -> Literal[0, 1]:
-    with open(settings.path_to_yaml, 'r') as f:
-        config = yaml.safe_load(f)
+    segments = samples.unfold(0, segment_len, hop_len)
+    uncovered = len(samples) - (len(segments) - 1) * hop_len - segment_len
+    if uncovered == 0:
+        return segments, None
 
-    device = torch.device('cpu')
+    tail = samples[len(segments) * hop_len :]
+    if len(tail) < min_tail_len:
+        console_logger.debug(f'Trailing {uncovered} samples are dropped')
+        return segments, None
+    return segments, torch.from_numpy(pad(tail.numpy(), segment_len))
 
-    model = RawNet(config['model'], device=device)
-    model.load_state_dict(
-        torch.load(
-            settings.path_to_model, map_location='cpu', weights_only=False
+
+def segment_bounds(
+    length: int,
+    segment_len: int,
+    hop_len: int,
+    min_tail_len: int = 0,
+) -> tuple[int, int | None]:
+    """
+    Segments `segment_audio` splits `length` samples into, without
+    the samples, for audio which isn't held in memory.
+
+    Returns
+    -------
+    tuple[int, int | None]
+        Amount of full segments and start of the padded tail segment,
+        None if there is none. Audio shorter than a segment is a
+        tail starting at 0.
+    """
+    if segment_len < 1 or hop_len < 1:
+        raise ValueError('segment_len and hop_len must be >= 1')
+
+    if length <= segment_len:
+        return 0, 0
+    segments = (length - segment_len) // hop_len + 1
+    if length - (segments - 1) * hop_len - segment_len == 0:
+        return segments, None
+    if length - segments * hop_len < min_tail_len:
+        return segments, None
+    return segments, segments * hop_len
+
+
+def check_authenticity(
+    audio: AudioAsset,
+    backend: Literal['torch', 'onnx'] | None = None,
+) -> Literal[0, 1]:
+    """
+    Check if speech in audio is real or generated.
+
+    Parameters
+    ----------
+    audio : AudioAsset
+        Decoded audio file.
+    backend : Literal['torch', 'onnx'], optional
+        Inference backend of the RawNet model, by default
+        `settings.AUTHENTICITY_BACKEND`.
+
+    Returns
+    -------
+    1 if it's likely real
+    0 if likely fake
+    """
+    backend = backend or settings.AUTHENTICITY_BACKEND
+    if backend == 'torch':
+        infer = partial(_infer_torch, model_registry.get_rawnet())
+    elif backend == 'onnx':
+        infer = partial(_infer_onnx, model_registry.get_rawnet_onnx())
+    else:
+        raise ValueError(f'Unknown authenticity backend: {backend}')
+
+    if settings.AUTHENTICITY_DECISION == 'sequential':
+        report = sequential_authenticity(audio, infer)
+        console_logger.info(
+            f'Authenticity {report.probability:.3f} ± {report.margin:.3f}, '
+            f'{report.evaluated} of {report.segments} segments evaluated'
         )
+        final_prob = report.probability
+    else:
+        final_prob = authenticity_probability(audio, infer)
+    console_logger.info(
+        f'{"Likely Real" if final_prob > 0.5 else "Likely Fake"}, '
+        f'score: {final_prob}'
+    )
+    return 1 if final_prob > 0.5 else 0
+
+
+def _authenticity_segments(
+    audio: AudioAsset,
+) -> tuple[torch.Tensor, torch.Tensor | None]:
+    """Segments RawNet evaluates, see `segment_audio`."""
+    return segment_audio(
+        audio.resampled(24000),
+        settings.AUTHENTICITY_SEGMENT_LEN,
+        settings.AUTHENTICITY_HOP_LEN,
+        settings.AUTHENTICITY_MIN_TAIL_LEN,
+    )
+
+
+def _authenticity_bounds(audio: AudioAsset) -> tuple[int, int | None]:
+    """Segments RawNet evaluates, see `segment_bounds`."""
+    return segment_bounds(
+        audio.resampled_length(24000),
+        settings.AUTHENTICITY_SEGMENT_LEN,
+        settings.AUTHENTICITY_HOP_LEN,
+        settings.AUTHENTICITY_MIN_TAIL_LEN,
     )
-    model.eval()
-    model = model.to(device)
 
-    y, _ = process_audio(file_path)
 
-    segments = []
-    max_len = 96000
-    total_len = len(y)
+def _stream_authenticity_batches(audio: AudioAsset) -> Iterator[torch.Tensor]:
+    """
+    Batches of `_authenticity_segments`, in order, cut from audio
+    decoded block by block, so at most a batch is held at once.
+    """
+    segment_len = settings.AUTHENTICITY_SEGMENT_LEN
+    segments, tail_start = _authenticity_bounds(audio)
+    frames = frame_blocks(
+        audio.stream(24000), segment_len, settings.AUTHENTICITY_HOP_LEN
+    )
+    batch = []
+    for index, frame in enumerate(frames):
+        if index == segments:
+            # Frame after the full ones starts at the tail
+            if tail_start is not None:
+                batch.append(torch.from_numpy(pad(frame, segment_len)))
+            break
+        batch.append(torch.from_numpy(frame))
+        if len(batch) == settings.AUTHENTICITY_BATCH_SIZE:
+            yield torch.stack(batch)
+            batch = []
+    if batch:
+        yield torch.stack(batch)
+
 
-    if total_len <= max_len:
-        y_pad = pad(y, max_len)
-        segments.append(torch.tensor(y_pad, dtype=torch.float32))
+def _authenticity_segment(
+    audio: AudioAsset, index: int, bounds: tuple[int, int | None]
+) -> torch.Tensor:
+    """Segment at `index` in `_authenticity_segments`, decoded alone."""
+    segment_len = settings.AUTHENTICITY_SEGMENT_LEN
+    segments, tail_start = bounds
+    if index < segments:
+        start = index * settings.AUTHENTICITY_HOP_LEN
     else:
-        num_chunks = total_len // max_len
-        for i in range(num_chunks):
-            seg = y[i * max_len : (i + 1) * max_len]
-            segments.append(
-                torch.tensor(pad(seg, max_len), dtype=torch.float32)
-            )
+        start = tail_start or 0
+    samples = audio.excerpt(start, segment_len, 24000)
+    return torch.from_numpy(pad(samples, segment_len))
+
+
+def authenticity_probability(
+    audio: AudioAsset, infer: Callable[[torch.Tensor], np.ndarray]
+) -> float:
+    """Mean probability of audio segments being real."""
+    if audio.streaming:
+        batches: Iterator[torch.Tensor] | list[torch.Tensor]
+        batches = _stream_authenticity_batches(audio)
+    else:
+        segments, tail = _authenticity_segments(audio)
+        batches = list(torch.split(segments, settings.AUTHENTICITY_BATCH_SIZE))
+        if tail is not None:
+            # Only the batch with the tail is copied
+            if len(batches[-1]) < settings.AUTHENTICITY_BATCH_SIZE:
+                batches[-1] = torch.cat([batches[-1], tail[None]])
+            else:
+                batches.append(tail[None])
 
-    model.eval()
     probs = []
+    for batch in batches:
+        probs.extend(infer(batch).tolist())
+        metrics.count('segments_inferred', len(batch))
+
+    return float(np.mean(probs))
+
+
+def spread_order(n: int) -> np.ndarray:
+    """
+    Indices from 0 to `n` in bit-reversed order, so that any prefix
+    of them is spread evenly over the whole range.
+    """
+    bits = max(1, (n - 1).bit_length())
+    order = np.arange(2**bits)
+    reversed_order = np.zeros_like(order)
+    for _ in range(bits):
+        reversed_order = (reversed_order << 1) | (order & 1)
+        order >>= 1
+    return reversed_order[reversed_order < n]
+
+
+def sequential_authenticity(
+    audio: AudioAsset,
+    infer: Callable[[torch.Tensor], np.ndarray],
+    min_segments: int | None = None,
+    max_segments: int | None = None,
+    error_rate: float | None = None,
+) -> AuthenticityReport:
+    """
+    Decide if audio is real without evaluating every segment.
+
+    Segments are evaluated batch by batch in `spread_order`. After
+    each batch the mean probability gets a Hoeffding-Serfling bound
+    (probabilities are within [0, 1], segments are drawn without
+    replacement), evaluation stops once the bound is on one side of
+    0.5, or once the mean of all segments can't cross 0.5 whatever
+    the rest of them are. The bound is checked after every batch,
+    so `error_rate` is split evenly between the checks and the
+    verdict differs from the mean one with at most that probability.
+    When audio is streamed, only segments which are evaluated are
+    decoded.
+
+    Parameters
+    ----------
+    audio : AudioAsset
+        Decoded audio file.
+    infer : Callable[[torch.Tensor], np.ndarray]
+        Probabilities of a batch of segments being real.
+    min_segments : int, optional
+        Segments evaluated before the bound is trusted, by default
+        `settings.AUTHENTICITY_MIN_SEGMENTS`.
+    max_segments : int, optional
+        Segments evaluated at most, 0 is no limit, by default
+        `settings.AUTHENTICITY_MAX_SEGMENTS`.
+    error_rate : float, optional
+        Probability of any of the bounds missing the mean of all
+        segments, by default `settings.AUTHENTICITY_ERROR_RATE`.
+
+    Raises
+    ------
+    ValueError
+        If the arguments are out of range.
+    """
+    if min_segments is None:
+        min_segments = settings.AUTHENTICITY_MIN_SEGMENTS
+    if max_segments is None:
+        max_segments = settings.AUTHENTICITY_MAX_SEGMENTS
+    if error_rate is None:
+        error_rate = settings.AUTHENTICITY_ERROR_RATE
+    if min_segments < 1:
+        raise ValueError('min_segments must be >= 1')
+    if max_segments < 0:
+        raise ValueError('max_segments must be >= 0')
+    if not 0.0 < error_rate < 1.0:
+        raise ValueError('error_rate must be between 0.0 and 1.0')
+
+    if audio.streaming:
+        # Segments are decoded one by one, only the evaluated ones
+        bounds = _authenticity_bounds(audio)
+        total = bounds[0] + (bounds[1] is not None)
+
+        def segment(index: int) -> torch.Tensor:
+            return _authenticity_segment(audio, index, bounds)
+
+    else:
+        segments, tail = _authenticity_segments(audio)
+        # Index after the last full segment is the tail
+        total = len(segments) + (tail is not None)
+
+        def segment(index: int) -> torch.Tensor:
+            return segments[index] if index < len(segments) else tail
+
+    order = spread_order(total)
+    if max_segments:
+        order = order[:max_segments]
+
+    batch_size = settings.AUTHENTICITY_BATCH_SIZE
+    # Segments evaluated whenever the bound is checked, it isn't
+    # before `min_segments` nor once every segment is evaluated
+    looks = sum(
+        min_segments <= min(end, len(order)) < total
+        for end in range(batch_size, len(order) + batch_size, batch_size)
+    )
+    # Union bound over the checks
+    look_error_rate = error_rate / max(1, looks)
+
+    total_prob = 0.0
+    evaluated = 0
+    margin = 0.0
+    for start in range(0, len(order), batch_size):
+        batch = order[start : start + batch_size]
+        # Only segments of the batch are copied
+        rows = [segment(i) for i in batch]
+        total_prob += float(np.sum(infer(torch.stack(rows))))  # type: ignore
+        metrics.count('segments_inferred', len(batch))
+        evaluated += len(batch)
+        if evaluated == total:
+            margin = 0.0
+            break
+
+        mean = total_prob / evaluated
+        margin = float(
+            np.sqrt(
+                (1 - (evaluated - 1) / total)
+                * np.log(2 / look_error_rate)
+                / (2 * evaluated)
+            )
+        )
+        # Mean of all segments if the rest are all fake or all real
+        if total_prob / total > 0.5:
+            break
+        if (total_prob + total - evaluated) / total <= 0.5:
+            break
+        if evaluated >= min_segments and not (
+            mean - margin <= 0.5 < mean + margin
+        ):
+            break
+
+    return AuthenticityReport(
+        probability=total_prob / evaluated,
+        segments=total,
+        evaluated=evaluated,
+        margin=margin,
+    )
+
+
+def _infer_torch(model: torch.nn.Module, batch: torch.Tensor) -> np.ndarray:
+    """Probabilities of segments in the batch being real."""
     with torch.no_grad():
-        for segment in segments:
-            input_tensor = segment.unsqueeze(0).to(device)
-            output = model(input_tensor)
-            if isinstance(output, tuple):
-                output = output[0]
-            softmax_out = torch.softmax(output, dim=1)[0][1].item()
-            probs.append(softmax_out)
-
-    final_prob = float(np.mean(probs))
-    print('Likely Real' if final_prob > 0.5 else 'Likely Fake')
-    print(f'Score: {final_prob}')
-    return 1 if final_prob > 0.5 else 0
+        output = model(batch)
+    if isinstance(output, tuple):
+        output = output[0]
+    return torch.softmax(output, dim=1)[:, 1].numpy()
 
 
+def _infer_onnx(session, batch: torch.Tensor) -> np.ndarray:
+    """Probabilities of segments in the batch being real."""
+    (output,) = session.run(
+        None, {'audio': np.ascontiguousarray(batch.numpy())}
+    )
+    # Output is log softmax, so exp gives probabilities
+    return np.exp(output[:, 1])
 
 
 class Quality:
-    def __init__(self, target_sr=16000, max_duration=120.0) -> None:
+    """
+    DNSMOS P.835 quality of speech.
+
+    DNSMOS scores windows of `dnsmos.INPUT_LENGTH` seconds with a hop
+    of one second, file score is the mean over windows. Windows are
+    scored in batches, either all of them or, with
+    `settings.QUALITY_WINDOWS` set to 'sampled', a stratified sample
+    covering at most `max_duration` seconds, so cost of long files
+    is bounded.
+
+    Scores match `dnsmos.run` on clips up to 16 seconds. It skips
+    windows starting between 7 and 23 seconds, due to rounding of
+    window bounds, these are scored here.
+
+    Streamed audio longer than a window is decoded twice block by
+    block, see `stream_p835_metrics`, so it's never held entirely.
+    """
+
+    def __init__(
+        self,
+        target_sr=16000,
+        max_duration: float | None = None,
+        batch_size: int | None = None,
+    ) -> None:
         self.target_sr = target_sr
-        self.max_duration = max_duration
+        self.max_duration = max_duration or settings.QUALITY_MAX_DURATION
+        self.batch_size = batch_size or settings.QUALITY_BATCH_SIZE
+        # Report of the file checked last, see `check_quality`
+        self.report: QualityReport | None = None
 
-    def load_audio(self, file_path: str):
-        amplitudes, _ = librosa.load(
-            file_path, sr=self.target_sr
-        )  # for dnsmos we need sr=16000
+    def load_audio(self, audio: AudioAsset):
+        # for dnsmos we need sr=16000
+        amplitudes = audio.resampled(self.target_sr)
         signal = librosa.util.normalize(amplitudes)
 
         return signal
 
-    def get_p835_metrics(self, amplitudes):
-        result = dnsmos.run(amplitudes, sr=self.target_sr)
-        del result["p808_mos"]  # delete P.808 metric # type: ignore
+    def get_windows(self, signal: np.ndarray) -> np.ndarray:
+        """
+        Windows DNSMOS would score, as a strided view of shape
+        (windows, window_len).
+        """
+        window_len = int(dnsmos.INPUT_LENGTH * self.target_sr)
+        # Short audio is repeated, exactly as `dnsmos.run` does
+        while len(signal) < window_len:
+            signal = np.append(signal, signal)
+        windows = (
+            int(np.floor(len(signal) / self.target_sr) - dnsmos.INPUT_LENGTH)
+            + 1
+        )
+        return np.lib.stride_tricks.as_strided(
+            signal,
+            shape=(windows, window_len),
+            strides=(self.target_sr * signal.strides[0], signal.strides[0]),
+            writeable=False,
+        )
+
+    def sample_windows(self, windows: int) -> np.ndarray:
+        """
+        Indices of windows to score within the budget.
+
+        Windows are split into equal strata and one window is drawn
+        from each, seeded so a file always gets the same score.
+        """
+        budget = max(1, int(self.max_duration // dnsmos.INPUT_LENGTH))
+        if settings.QUALITY_WINDOWS == 'all' or windows <= budget:
+            return np.arange(windows)
 
-        mos_mean = np.mean([float(i) for i in result.values()]) * 2 / 10 #type: ignore
+        rng = np.random.default_rng(settings.QUALITY_SEED)
+        bounds = np.linspace(0, windows, budget + 1).astype(int)
+        return rng.integers(bounds[:-1], bounds[1:])
 
-        return mos_mean
+    def get_p835_metrics(self, windows: np.ndarray) -> np.ndarray:
+        """SIG, BAK and OVRL MOS of every window, shape (windows, 3)."""
+        model = model_registry.get_dnsmos()
+        mos = []
+        for start in range(0, len(windows), self.batch_size):
+            batch = windows[start : start + self.batch_size]
+            metrics.count('windows_scored', len(batch))
+            raw = model.onnx_sess.run(
+                None, {'input_1': np.ascontiguousarray(batch, np.float32)}
+            )[0]
+            mos.append(
+                np.column_stack(
+                    model.get_polyfit_val(*raw.T, is_personalized_MOS=False)
+                )
+            )
+        return np.concatenate(mos)
+
+    def stream_p835_metrics(
+        self, audio: AudioAsset
+    ) -> tuple[np.ndarray, int, int]:
+        """
+        `get_p835_metrics` of windows `evaluate` scores, cut from
+        audio decoded block by block. The first pass finds the peak
+        `load_audio` normalizes by, so at most a batch of windows
+        is held at once.
+
+        Returns
+        -------
+        tuple[np.ndarray, int, int]
+            Metrics of scored windows, amount of windows and of
+            scored ones.
+        """
+        window_len = int(dnsmos.INPUT_LENGTH * self.target_sr)
+        length = audio.resampled_length(self.target_sr)
+        windows = (
+            int(np.floor(length / self.target_sr) - dnsmos.INPUT_LENGTH) + 1
+        )
+        indices = set(self.sample_windows(windows).tolist())
+
+        peak = max(
+            np.abs(block).max(initial=0)
+            for block in audio.stream(self.target_sr)
+        )
+        # Silence is left as is, as `librosa.util.normalize` does
+        if peak < np.finfo(np.float32).tiny:
+            peak = np.float32(1.0)
+
+        signal = (block / peak for block in audio.stream(self.target_sr))
+        mos, batch = [], []
+        for index, window in enumerate(
+            frame_blocks(signal, window_len, self.target_sr)
+        ):
+            if index == windows or len(window) < window_len:
+                break
+            if index in indices:
+                batch.append(window)
+            if len(batch) == self.batch_size:
+                mos.append(self.get_p835_metrics(np.stack(batch)))
+                batch = []
+        if batch:
+            mos.append(self.get_p835_metrics(np.stack(batch)))
+        return np.concatenate(mos), windows, len(indices)
 
     def get_duration_score(self, duration, max_duration=120.0):
         duration_score = min(duration / max_duration, 1.0)
 
         return duration_score
 
-    def check_quality(self, file_path):
-        try:
-            y = self.load_audio(file_path)
+    def evaluate(self, audio: AudioAsset) -> QualityReport:
+        window_len = int(dnsmos.INPUT_LENGTH * self.target_sr)
+        if (
+            audio.streaming
+            and audio.resampled_length(self.target_sr) >= window_len
+        ):
+            mos, windows, evaluated = self.stream_p835_metrics(audio)
+        else:
+            # Audio shorter than a window is repeated to fill it,
+            # so it's loaded entirely, even when streamed
+            frames = self.get_windows(self.load_audio(audio))
+            indices = self.sample_windows(len(frames))
+            if len(indices) < len(frames):
+                # Copies only the sampled windows
+                mos = self.get_p835_metrics(frames[indices])
+            else:
+                mos = self.get_p835_metrics(frames)
+            windows, evaluated = len(frames), len(indices)
+        sig, bak, ovrl = mos.T
 
-        except FileNotFoundError:  # if filename is incorrect or file not found
-            console_logger.error("File not found!")
-            return
+        # Score of every window, the file score is their mean
+        scores = (sig + bak + ovrl) / 3 * 2 / 10
+        margin = 0.0
+        if evaluated < windows and evaluated > 1:
+            # Finite population correction, sampled windows overlap
+            # less than all of them
+            correction = 1 - evaluated / windows
+            stderr = np.std(scores, ddof=1) / np.sqrt(evaluated)
+            margin = float(1.96 * stderr * np.sqrt(correction))
 
-        sig_score = self.get_p835_metrics(y)
+        return QualityReport(
+            score=float(np.mean(scores)),
+            sig_mos=float(np.mean(sig)),
+            bak_mos=float(np.mean(bak)),
+            ovrl_mos=float(np.mean(ovrl)),
+            windows=windows,
+            evaluated=evaluated,
+            margin=margin,
+        )
+
+    def check_quality(self, audio: AudioAsset):
+        """Score of the file, its whole report is kept in `report`."""
+        report = self.report = self.evaluate(audio)
+        console_logger.info(
+            f'Quality {report.score:.3f} ± {report.margin:.3f}, '
+            f'{report.evaluated} of {report.windows} windows scored'
+        )
 
-        return sig_score
+        return report.score
@@ -0,0 +1,102 @@
+import cProfile
+import os
+import resource
+import sys
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Literal
+
+from loguru import logger as console_logger
+
+from audata_proof.schemas.proof_metrics import StageMetrics
+
+# Stage being measured in the current thread, see `count`
+_current_stage: ContextVar[StageMetrics | None] = ContextVar(
+    'current_stage', default=None
+)
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def measure(name: str, into: dict[str, StageMetrics]) -> Iterator[None]:
+    """Record metrics of the enclosed stage as `into[name]`."""
+    metrics = StageMetrics()
+    token = _current_stage.set(metrics)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        metrics.wall_time = time.perf_counter() - wall_start
+        metrics.cpu_time = time.process_time() - cpu_start
+        metrics.peak_rss = _peak_rss()
+        _current_stage.reset(token)
+        into[name] = metrics
+
+
+def measured(
+    name: str, stage: Callable, into: dict[str, StageMetrics]
+) -> Callable:
+    """`stage` recording its metrics as `into[name]` whenever it runs."""
+
+    @wraps(stage)
+    def wrapper(*args, **kwargs):
+        with measure(name, into):
+            return stage(*args, **kwargs)
+
+    return wrapper
+
+
+def count(counter: str, amount: int) -> None:
+    """Add to a counter of the stage being measured, if any."""
+    metrics = _current_stage.get()
+    if metrics is not None:
+        metrics.counters[counter] = metrics.counters.get(counter, 0) + amount
+
+
+@contextmanager
+def profiled(
+    profiler: Literal['none', 'cprofile', 'torch'], output_dir: str
+) -> Iterator[None]:
+    """
+    Profile the enclosed code, see `settings.PROOF_PROFILER`.
+
+    cProfile stats are written to `profile.prof`, open them with
+    `python -m pstats` or snakeviz. Torch profiler writes a Chrome
+    trace to `profile.json`. Only the current process is profiled,
+    not workers evaluating files, see `settings.PROOF_WORKERS`.
+    """
+    if profiler == 'none':
+        yield
+        return
+
+    if profiler == 'cprofile':
+        path = os.path.join(output_dir, 'profile.prof')
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+    elif profiler == 'torch':
+        import torch.profiler
+
+        path = os.path.join(output_dir, 'profile.json')
+        with torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            record_shapes=True,
+        ) as profile:
+            yield
+        profile.export_chrome_trace(path)
+    else:
+        raise ValueError(f'Unknown profiler: {profiler}')
+    console_logger.info(f'Profile written to {path}')
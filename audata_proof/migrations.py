@@ -0,0 +1,105 @@
+from loguru import logger as console_logger
+from sqlalchemy import text
+
+from audata_proof.db import Database, db
+from audata_proof.fingerprint import decode_fingerprint, pack_fingerprint
+from audata_proof.utils import (
+    backfill_fingerprint_index,
+    decode_db_fingerprint,
+    index_contribution,
+)
+
+
+def migrate_fingerprints_to_binary(db: Database, batch_size: int = 1000):
+    """
+    Migrate `contributions.fingerprint` from text to packed binary.
+
+    Old rows hold hex of the compressed fingerprint in a text column,
+    they're decoded into a temporary bytea column batch by batch, so
+    an interrupted migration can be simply run again. Every batch is
+    added to the fingerprint index in the same transaction. After all
+    rows are converted the old column is replaced with the new one.
+    """
+    with db.session() as session:
+        data_type = session.execute(
+            text(
+                'SELECT data_type FROM information_schema.columns '
+                "WHERE table_name = 'contributions' "
+                "AND column_name = 'fingerprint'"
+            )
+        ).scalar_one()
+        if data_type == 'bytea':
+            console_logger.info('Fingerprints are already stored as binary')
+            return
+
+        session.execute(
+            text(
+                'ALTER TABLE contributions '
+                'ADD COLUMN IF NOT EXISTS fingerprint_packed BYTEA, '
+                'ADD COLUMN IF NOT EXISTS fingerprint_length INTEGER'
+            )
+        )
+
+    amount = 0
+    while True:
+        # Commit every batch to keep progress if interrupted
+        with db.session() as session:
+            rows = session.execute(
+                text(
+                    'SELECT id, fingerprint FROM contributions '
+                    'WHERE fingerprint_packed IS NULL LIMIT :limit'
+                ),
+                {'limit': batch_size},
+            ).all()
+            if not rows:
+                break
+
+            values = []
+            for contribution_id, fprint in rows:
+                frames = decode_fingerprint(decode_db_fingerprint(fprint))
+                values.append(
+                    {
+                        'id': contribution_id,
+                        'packed': pack_fingerprint(frames),
+                        'length': len(frames),
+                    }
+                )
+                index_contribution(session, contribution_id, frames)
+            session.execute(
+                text(
+                    'UPDATE contributions '
+                    'SET fingerprint_packed = :packed, '
+                    'fingerprint_length = :length '
+                    'WHERE id = :id'
+                ),
+                values,
+            )
+        amount += len(rows)
+        console_logger.info(f'Fingerprints migrated: {amount}')
+
+    with db.session() as session:
+        session.execute(
+            text('ALTER TABLE contributions DROP COLUMN fingerprint')
+        )
+        session.execute(
+            text(
+                'ALTER TABLE contributions '
+                'RENAME COLUMN fingerprint_packed TO fingerprint'
+            )
+        )
+        session.execute(
+            text(
+                'ALTER TABLE contributions '
+                'ALTER COLUMN fingerprint SET NOT NULL, '
+                'ALTER COLUMN fingerprint_length SET NOT NULL'
+            )
+        )
+    console_logger.info('Fingerprint storage migration complete')
+
+
+if __name__ == '__main__':
+    db.init()
+    migrate_fingerprints_to_binary(db)
+    # Contributions stored before the index existed are invisible
+    # to uniqueness checks until they're indexed
+    backfill_fingerprint_index(db)
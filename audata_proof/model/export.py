@@ -0,0 +1,56 @@
+import torch
+import torch.nn as nn
+from loguru import logger as console_logger
+
+from audata_proof.config import settings
+from audata_proof.model.model import RawNet
+from audata_proof.model.registry import load_rawnet
+
+
+class RawNetBinary(nn.Module):
+    """RawNet returning only the binary (real/fake) head."""
+
+    def __init__(self, model: RawNet) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        output_binary, _ = self.model(x)
+        return output_binary
+
+
+def export_onnx(
+    model: RawNet,
+    path: str,
+    segment_len: int = 96000,
+    opset_version: int = 17,
+) -> None:
+    """
+    Export RawNet's binary head into an ONNX graph.
+
+    Graph takes `audio` of shape (batch, segment_len) and returns
+    log probabilities `binary` of shape (batch, 2), batch size is
+    dynamic. Exporting requires `onnx` of the dev dependencies.
+    """
+    # Export traces the model, it must be in eval mode or batch
+    # norms would be exported with batch statistics
+    wrapper = RawNetBinary(model).eval()
+    torch.onnx.export(
+        wrapper,
+        (torch.zeros(1, segment_len),),
+        path,
+        input_names=['audio'],
+        output_names=['binary'],
+        dynamic_axes={'audio': {0: 'batch'}, 'binary': {0: 'batch'}},
+        opset_version=opset_version,
+        dynamo=False,
+    )
+    console_logger.info(f'RawNet exported to {path}')
+
+
+if __name__ == '__main__':
+    export_onnx(
+        load_rawnet(),
+        settings.path_to_onnx_model,
+        settings.AUTHENTICITY_SEGMENT_LEN,
+    )
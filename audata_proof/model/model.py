@@ -68,33 +68,32 @@ class SincConv(nn.Module):
         self.hsupp = torch.arange(
             -(self.kernel_size - 1) / 2, (self.kernel_size - 1) / 2 + 1
         )
-        self.band_pass = torch.zeros(self.out_channels, self.kernel_size)
-
-    def forward(self, x):
-        for i in range(len(self.mel) - 1):
-            fmin = self.mel[i]
-            fmax = self.mel[i + 1]
-            hHigh = (2 * fmax / self.sample_rate) * np.sinc(
-                2 * fmax * self.hsupp / self.sample_rate
-            )
-            hLow = (2 * fmin / self.sample_rate) * np.sinc(
-                2 * fmin * self.hsupp / self.sample_rate
-            )
-            hideal = hHigh - hLow
-
-            self.band_pass[i, :] = Tensor(
-                np.hamming(self.kernel_size)
-            ) * Tensor(hideal)
-
-        band_pass_filter = self.band_pass.to(self.device)
+        # Filters are fixed, so they're built once. Buffer follows the
+        # module's device but isn't saved, so existing checkpoints load
+        self.register_buffer(
+            'band_pass', self._build_band_pass(), persistent=False
+        )
 
-        self.filters = (band_pass_filter).view(
-            self.out_channels, 1, self.kernel_size
+    def _build_band_pass(self):
+        # Computed for all filters at once with the same dtypes
+        # the per-filter computation used, so filters are identical
+        fmin = self.mel[:-1, None]
+        fmax = self.mel[1:, None]
+        hsupp = self.hsupp[None, :]
+        hHigh = (2 * fmax / self.sample_rate) * np.sinc(
+            torch.from_numpy(2 * fmax).float() * hsupp / self.sample_rate
+        )
+        hLow = (2 * fmin / self.sample_rate) * np.sinc(
+            torch.from_numpy(2 * fmin).float() * hsupp / self.sample_rate
         )
+        hideal = hHigh - hLow
 
+        return Tensor(np.hamming(self.kernel_size)) * Tensor(hideal)
+
+    def forward(self, x):
         return F.conv1d(
             x,
-            self.filters,
+            self.band_pass.view(self.out_channels, 1, self.kernel_size),
             stride=self.stride,
             padding=self.padding,
             dilation=self.dilation,
@@ -330,7 +329,9 @@ class RawNet(nn.Module):
         x = self.bn_before_gru(x)
         x = self.selu(x)
         x = x.permute(0, 2, 1)  # (batch, filt, time) >> (batch, time, filt)
-        self.gru.flatten_parameters()
+        # Quantized GRU has no parameters to flatten
+        if isinstance(self.gru, nn.GRU):
+            self.gru.flatten_parameters()
         x, _ = self.gru(x)
         x = x[:, -1, :]
 
@@ -0,0 +1,93 @@
+import json
+import sys
+from functools import partial
+
+import numpy as np
+import torch.nn as nn
+from loguru import logger as console_logger
+from pydantic import BaseModel
+
+from audata_proof.audio import AudioAsset
+from audata_proof.handlers import _infer_torch, authenticity_probability
+from audata_proof.model.registry import load_rawnet, load_rawnet_int8
+
+
+class QuantizationReport(BaseModel):
+    """
+    Comparison of fp32 and int8 RawNet on labeled samples.
+
+    files: Amount of compared files.
+    flipped: Files whose real/fake decision differs between models.
+    max_prob_diff: Largest difference of real probabilities.
+    mean_prob_diff: Mean difference of real probabilities.
+    fp32_accuracy: Share of correct fp32 decisions.
+    int8_accuracy: Share of correct int8 decisions.
+    """
+
+    files: int
+    flipped: list[str]
+    max_prob_diff: float
+    mean_prob_diff: float
+    fp32_accuracy: float
+    int8_accuracy: float
+
+    def passes(self, max_accuracy_drop: float = 0.0) -> bool:
+        """Int8 model must not flip verdicts or lose accuracy."""
+        return (
+            not self.flipped
+            and self.fp32_accuracy - self.int8_accuracy <= max_accuracy_drop
+        )
+
+
+def compare_precisions(
+    samples: dict[str, int], fp32: nn.Module, int8: nn.Module
+) -> QuantizationReport:
+    """
+    Compare fp32 and int8 models on labeled audio files.
+
+    Parameters
+    ----------
+    samples : dict[str, int]
+        Paths of audio files and their labels, 1 for real speech
+        and 0 for fake one.
+    fp32 : nn.Module
+        Original model.
+    int8 : nn.Module
+        Quantized model.
+    """
+    fp32_probs, int8_probs, labels, flipped = [], [], [], []
+    for path, label in samples.items():
+        audio = AudioAsset(path)
+        fp32_prob = authenticity_probability(
+            audio, partial(_infer_torch, fp32)
+        )
+        int8_prob = authenticity_probability(
+            audio, partial(_infer_torch, int8)
+        )
+        if (fp32_prob > 0.5) != (int8_prob > 0.5):
+            flipped.append(path)
+        fp32_probs.append(fp32_prob)
+        int8_probs.append(int8_prob)
+        labels.append(label)
+
+    diff = np.abs(np.subtract(fp32_probs, int8_probs))
+    labels = np.array(labels)
+    return QuantizationReport(
+        files=len(samples),
+        flipped=flipped,
+        max_prob_diff=float(diff.max(initial=0.0)),
+        mean_prob_diff=float(diff.mean()) if len(diff) else 0.0,
+        fp32_accuracy=float(np.mean((np.array(fp32_probs) > 0.5) == labels)),
+        int8_accuracy=float(np.mean((np.array(int8_probs) > 0.5) == labels)),
+    )
+
+
+if __name__ == '__main__':
+    # Usage: python -m audata_proof.model.quantization labels.json
+    # where labels.json maps audio paths to labels (1 real, 0 fake)
+    with open(sys.argv[1], 'r') as f:
+        samples = json.load(f)
+
+    report = compare_precisions(samples, load_rawnet(), load_rawnet_int8())
+    console_logger.info(f'Quantization report: {report.model_dump_json()}')
+    sys.exit(0 if report.passes() else 1)
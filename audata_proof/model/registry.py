@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+import onnxruntime as ort
+import torch
+import torch.nn as nn
+import yaml
+from loguru import logger as console_logger
+from speechmos import dnsmos
+
+from audata_proof.config import settings
+from audata_proof.model.model import RawNet
+
+
+def load_rawnet() -> RawNet:
+    with open(settings.path_to_yaml, 'r') as f:
+        config = yaml.safe_load(f)
+
+    device = torch.device('cpu')
+
+    model = RawNet(config['model'], device=device)
+    model.load_state_dict(
+        torch.load(
+            settings.path_to_model, map_location='cpu', weights_only=False
+        )
+    )
+    model.eval()
+    # Model is only used for inference
+    model.requires_grad_(False)
+    return model.to(device)
+
+
+def load_rawnet_int8() -> nn.Module:
+    """
+    RawNet with GRU and Linear layers quantized to int8.
+
+    Weights are stored as int8 and activations are quantized
+    dynamically, convolutions stay in fp32.
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        load_rawnet(), {nn.GRU, nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def load_rawnet_onnx() -> ort.InferenceSession:
+    options = ort.SessionOptions()
+    options.graph_optimization_level = (
+        ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    )
+    options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS
+    return ort.InferenceSession(
+        settings.path_to_onnx_model,
+        sess_options=options,
+        providers=['CPUExecutionProvider'],
+    )
+
+
+def load_dnsmos() -> dnsmos.DNSMOS:
+    """DNSMOS P.835 and P.808 models shipped with `speechmos`."""
+    models_dir = os.path.join(
+        os.path.dirname(dnsmos.__file__), 'dnsmos_models'
+    )
+    return dnsmos.DNSMOS(
+        os.path.join(models_dir, 'sig_bak_ovr.onnx'),
+        os.path.join(models_dir, 'model_v8.onnx'),
+    )
+
+
+# Models used for authenticity checks by backend and precision
+AUTHENTICITY_MODELS = {
+    ('torch', 'fp32'): 'rawnet',
+    ('torch', 'int8'): 'rawnet_int8',
+    ('onnx', 'fp32'): 'rawnet_onnx',
+}
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    Every model is loaded once on first use (or on `preload`) and
+    the same warm instance is handed out afterwards.
+    """
+
+    def __init__(self) -> None:
+        self._loaders: dict[str, Callable[[], Any]] = {
+            'rawnet': load_rawnet,
+            'rawnet_int8': load_rawnet_int8,
+            'rawnet_onnx': load_rawnet_onnx,
+            'dnsmos': load_dnsmos,
+        }
+        self._models: dict[str, Any] = {}
+        # Seconds spent loading every model
+        self.load_times: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Any:
+        if name not in self._models:
+            with self._lock:
+                # Other thread might have loaded it while waiting
+                if name not in self._models:
+                    start = time.perf_counter()
+                    self._models[name] = self._loaders[name]()
+                    self.load_times[name] = time.perf_counter() - start
+                    console_logger.info(
+                        f'Model {name} loaded in {self.load_times[name]:.2f}s'
+                    )
+        return self._models[name]
+
+    def get_rawnet(self) -> nn.Module:
+        """RawNet of precision set by `settings.AUTHENTICITY_PRECISION`."""
+        if settings.AUTHENTICITY_PRECISION == 'int8':
+            return self.get('rawnet_int8')
+        return self.get('rawnet')
+
+    def get_rawnet_onnx(self) -> ort.InferenceSession:
+        return self.get('rawnet_onnx')
+
+    def get_dnsmos(self) -> dnsmos.DNSMOS:
+        return self.get('dnsmos')
+
+    def preload(self, *names: str) -> dict[str, float]:
+        """
+        Load models upfront, if no names are given the ones used
+        by the configured backends are loaded.
+
+        Returns
+        -------
+        dict[str, float]
+            Load time in seconds of every requested model.
+        """
+        names = names or (
+            AUTHENTICITY_MODELS[
+                settings.AUTHENTICITY_BACKEND, settings.AUTHENTICITY_PRECISION
+            ],
+            'dnsmos',
+        )
+        for name in names:
+            self.get(name)
+        return {name: self.load_times[name] for name in names}
+
+
+# Global model registry
+model_registry = ModelRegistry()
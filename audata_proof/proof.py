@@ -1,16 +1,43 @@
+import multiprocessing
+import os
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing.pool import Pool
+from typing import Any
+
+import numpy as np
+import torch
 from loguru import logger as console_logger
 
 from audata_proof import handlers
+from audata_proof.audio import AudioAsset
 from audata_proof.config import settings
 from audata_proof.db import Database
+from audata_proof.metrics import measure, measured
+from audata_proof.model.registry import model_registry
+from audata_proof.schemas.proof_metrics import ProofMetrics, StageMetrics
 from audata_proof.schemas.proof_response import ProofResponse
+from audata_proof.snapshot import get_snapshot
+from audata_proof.utils import ArchiveMember
+
+# Scores every file gets
+FILE_SCORES = ('uniqueness', 'authenticity', 'quality')
 
 
 class Proof:
-    def __init__(self, db: Database, file_path: str, telegram_id: str):
+    def __init__(
+        self,
+        db: Database,
+        audio_files: dict[str, str | bytes | ArchiveMember],
+        telegram_id: str,
+    ):
         self.db = db
-        # It is expected that only one file is provided for now
-        self.file_path = file_path
+        # Paths, contents or archive members of files by name, see
+        # `extract_data`
+        self.audio_files = audio_files
         self.telegram_id = telegram_id
 
         self.proof_response = ProofResponse(dlp_id=settings.DLP_ID)
@@ -25,37 +52,317 @@ class Proof:
         # Additional (public) properties to include in the proof about the data
         self.proof_response.attributes = {}
 
-    def generate(self) -> ProofResponse:
-        """Generate proof"""
+        # Resources used by stages, see `audata_proof.metrics`
+        self.metrics = ProofMetrics()
 
-        console_logger.info('Starting proof generation')
+    def generate(self) -> ProofResponse:
+        """Generate proof, metrics of its stages are kept in `metrics`"""
+        with measure('generate', self.metrics.stages):
+            self._generate()
+        if settings.PROOF_METRICS_IN_RESPONSE:
+            self.proof_response.attributes['metrics'] = (
+                self.metrics.model_dump()
+            )
+        return self.proof_response
 
-        self.proof_response.ownership = handlers.check_ownership(
-            self.telegram_id, self.db
+    def _generate(self) -> None:
+        console_logger.info(
+            f'Starting proof generation for {len(self.audio_files)} file(s)'
         )
 
-        self.proof_response.uniqueness = handlers.check_uniqueness(
-            self.file_path, self.db
-        )
+        if settings.UNIQUENESS_SOURCE == 'snapshot':
+            # Forked workers inherit the synced snapshot
+            with measure('snapshot_sync', self.metrics.stages):
+                get_snapshot(self.db, sync=True)
 
-        self.proof_response.authenticity = handlers.check_authenticity(
-            self.file_path,
+        ownership = measured(
+            'ownership',
+            partial(handlers.check_ownership, self.telegram_id, self.db),
+            self.metrics.stages,
         )
+        if settings.PROOF_EARLY_EXIT:
+            # Files of a banned user are not evaluated at all
+            scores = {'ownership': ownership(), 'files': []}
+            if scores['ownership'] == 1:
+                with self._file_workers() as pool:
+                    scores['files'] = self._evaluate_files(pool)
+        else:
+            # Workers are forked before stage threads start
+            with self._file_workers() as pool:
+                scores = run_stages(
+                    {
+                        'ownership': ownership,
+                        'files': partial(self._evaluate_files, pool),
+                    }
+                )
+        files = scores['files']
+        fingerprints = []
+        for file in files:
+            self.metrics.files[file['file']] = file.pop('metrics')
+            fingerprints.append(file.pop('fingerprint'))
 
-        quality_evaluator = handlers.Quality()
-        self.proof_response.quality = quality_evaluator.check_quality(self.file_path) #type: ignore
+        # Copies of a file uploaded together are one contribution
+        for i in handlers.batch_duplicates(fingerprints):
+            _mark_duplicate(files[i])
 
-        # Check validity
-        self.proof_response.valid = (
-            self.proof_response.ownership == 1
-            and self.proof_response.uniqueness == 1
-            and self.proof_response.authenticity == 1
-            and (self.proof_response.quality > 0.5)
+        # Check validity, every file must be valid
+        self.proof_response.ownership = scores['ownership']
+        self.proof_response.valid = self.proof_response.ownership == 1 and all(
+            file['valid'] for file in files
         )
+        # Files of a proof are registered only if it's valid, at once
+        if settings.REGISTER_CONTRIBUTIONS and self.proof_response.valid:
+            with measure('register', self.metrics.stages):
+                self._register(files, fingerprints)
+
+        # Every file gets its own scores, proof scores are their means
+        self.proof_response.attributes['files'] = files
+        if files:
+            self.proof_response.uniqueness = _mean(files, 'uniqueness')
+            self.proof_response.authenticity = _mean(files, 'authenticity')
+            self.proof_response.quality = _mean(files, 'quality')
+        else:
+            self.proof_response.attributes['skipped'] = list(FILE_SCORES)
 
         # Additional metadata about the proof, written onchain
         self.proof_response.metadata = {
             'dlp_id': settings.DLP_ID,
         }
 
-        return self.proof_response
+    def _register(
+        self,
+        files: list[dict[str, Any]],
+        fingerprints: list[tuple[float, bytes]],
+    ) -> None:
+        """
+        Register files as contributions, a file whose duplicate got
+        registered since its uniqueness check isn't unique anymore,
+        so the proof isn't valid and none of them is registered.
+        """
+        duplicates = handlers.register_contributions(
+            self.db,
+            [
+                (file['file'], fprint)
+                for file, fprint in zip(files, fingerprints)
+            ],
+        )
+        for file in files:
+            if file['file'] in duplicates:
+                _mark_duplicate(file)
+        if duplicates:
+            self.proof_response.valid = False
+
+    @contextmanager
+    def _file_workers(self) -> Iterator[Pool | None]:
+        """
+        Pool evaluating files in parallel if there are several, None
+        to evaluate them in this process.
+
+        Models are loaded right before workers are forked, so they're
+        shared with them copy-on-write. Files evaluated in this process
+        load models on first use, after the cheaper stages, so a proof
+        failing them early doesn't load any. Workers are never forked
+        from a thread other than the main one, as they might inherit
+        locks held by other threads.
+        """
+        workers = min(
+            len(self.audio_files),
+            settings.PROOF_WORKERS or os.cpu_count() or 1,
+        )
+        if workers > 1 and (
+            threading.current_thread() is not threading.main_thread()
+        ):
+            console_logger.debug('Proof runs in a worker thread, no workers')
+            workers = 1
+        if workers <= 1:
+            yield None
+            return
+
+        with measure('load_models', self.metrics.stages):
+            model_registry.preload()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(
+            workers, initializer=_init_worker, initargs=(self.db, workers)
+        ) as pool:
+            yield pool
+
+    def _evaluate_files(self, pool: Pool | None) -> list[dict[str, Any]]:
+        """Evaluate every file, on workers of `pool` if it's given."""
+        if pool is None:
+            return [
+                evaluate_file(self.db, name, source)
+                for name, source in self.audio_files.items()
+            ]
+        return pool.starmap(_evaluate_file_in_worker, self.audio_files.items())
+
+
+def evaluate_file(
+    db: Database, name: str, source: str | bytes | ArchiveMember
+) -> dict[str, Any]:
+    """
+    Run stages of a proof which are specific to a file.
+
+    With `settings.PROOF_EARLY_EXIT` stages run from the cheapest to
+    the most expensive one and stop at the first failed one, names
+    of scores left out are listed in `skipped`, their value is 0.
+    How many DNSMOS windows were scored and the margin of the score,
+    0 unless windows were sampled, are under `quality_report` if
+    quality was checked. Metrics of every stage are under `metrics`
+    and the fingerprint, registered if the proof is valid, is under
+    `fingerprint`.
+    """
+    metrics: dict[str, StageMetrics] = {}
+    # Decode the file once, all handlers share it
+    with measure('decode', metrics):
+        if isinstance(source, ArchiveMember):
+            source = source.read()
+        audio = AudioAsset(source, name)
+    # Every mode starts with uniqueness, which needs the fingerprint
+    with measure('fingerprint', metrics):
+        fingerprint = audio.fingerprint
+    quality_evaluator = handlers.Quality()
+    if settings.PROOF_EARLY_EXIT:
+        scores, skipped = _run_until_failed(
+            [
+                (
+                    'uniqueness',
+                    measured(
+                        'exact_duplicate',
+                        partial(handlers.check_exact_duplicate, audio, db),
+                        metrics,
+                    ),
+                ),
+                (
+                    'uniqueness',
+                    measured(
+                        'similarity',
+                        partial(
+                            handlers.check_similarity,
+                            audio,
+                            db,
+                            use_index=settings.UNIQUENESS_USE_INDEX,
+                        ),
+                        metrics,
+                    ),
+                ),
+                (
+                    'authenticity',
+                    measured(
+                        'authenticity',
+                        partial(handlers.check_authenticity, audio),
+                        metrics,
+                    ),
+                ),
+                (
+                    'quality',
+                    measured(
+                        'quality',
+                        partial(quality_evaluator.check_quality, audio),
+                        metrics,
+                    ),
+                ),
+            ]
+        )
+    else:
+        stages = {
+            'uniqueness': partial(
+                handlers.check_uniqueness,
+                audio,
+                db,
+                use_index=settings.UNIQUENESS_USE_INDEX,
+            ),
+            'authenticity': partial(handlers.check_authenticity, audio),
+            'quality': partial(quality_evaluator.check_quality, audio),
+        }
+        scores = run_stages(
+            {
+                score: measured(score, stage, metrics)
+                for score, stage in stages.items()
+            }
+        )
+        skipped = []
+    scores['valid'] = all(
+        _passes(score, scores[score]) for score in FILE_SCORES
+    )
+    if quality_evaluator.report is not None:
+        # Tells sampled quality scores from ones of every window
+        scores['quality_report'] = quality_evaluator.report.model_dump(
+            include={'windows', 'evaluated', 'margin'}
+        )
+    return {
+        'file': name,
+        **scores,
+        'skipped': skipped,
+        'metrics': metrics,
+        'fingerprint': fingerprint,
+    }
+
+
+def _run_until_failed(
+    stages: list[tuple[str, Callable]],
+) -> tuple[dict[str, Any], list[str]]:
+    """Run stages in order until one fails, return scores and skipped."""
+    scores = dict.fromkeys(FILE_SCORES, 0)
+    for i, (score, stage) in enumerate(stages):
+        scores[score] = stage()
+        if not _passes(score, scores[score]):
+            left = {name for name, _ in stages[i + 1 :]} - {score}
+            skipped = [name for name in FILE_SCORES if name in left]
+            console_logger.info(f'{score} check failed, skipping {skipped}')
+            return scores, skipped
+    return scores, []
+
+
+def _passes(score: str, value: float) -> bool:
+    """Whether a file score is good enough for the file to be valid."""
+    return value > 0.5 if score == 'quality' else value == 1
+
+
+def run_stages(stages: dict[str, Callable]) -> dict[str, Any]:
+    """
+    Run independent proof stages, see `settings.PROOF_EXECUTOR`.
+
+    With threads every stage gets its own thread, the slow ones
+    (db round-trips, torch and ONNX Runtime inference, NumPy
+    fingerprint comparison) release the GIL, so they overlap.
+    Results are the same in either mode.
+    """
+    if settings.PROOF_EXECUTOR == 'sequential':
+        return {name: stage() for name, stage in stages.items()}
+
+    with ThreadPoolExecutor(
+        max_workers=len(stages), thread_name_prefix='proof'
+    ) as executor:
+        futures = {
+            name: executor.submit(stage) for name, stage in stages.items()
+        }
+        # Re-raises the first exception of a stage, if any
+        return {name: future.result() for name, future in futures.items()}
+
+
+# Database of a worker process, set by `_init_worker`
+_worker_db: Database | None = None
+
+
+def _init_worker(db: Database, workers: int) -> None:
+    global _worker_db
+    # Connections inherited from the parent can't be shared
+    db.dispose(close=False)
+    _worker_db = db
+    # Split CPUs between workers instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def _evaluate_file_in_worker(
+    name: str, source: str | bytes | ArchiveMember
+) -> dict[str, Any]:
+    return evaluate_file(_worker_db, name, source)  # type: ignore
+
+
+def _mark_duplicate(file: dict[str, Any]) -> None:
+    file['uniqueness'] = 0
+    file['valid'] = False
+
+
+def _mean(files: list[dict[str, Any]], score: str) -> float:
+    return float(np.mean([file[score] for file in files]))
@@ -0,0 +1,210 @@
+"""
+Similarity scan of contributions split into shards by id.
+
+Every shard is scanned by its own process with its own database
+connection, the first process finding a similar fingerprint sets a
+shared event, so the others stop after the block they're comparing.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from uuid import UUID
+
+import numpy as np
+from loguru import logger as console_logger
+
+from audata_proof import metrics
+from audata_proof.db import Database
+from audata_proof.fingerprint import (
+    compare_fingerprints_block,
+    stack_fingerprints,
+    unpack_fingerprint,
+)
+from audata_proof.schemas.db import Contributions
+from audata_proof.snapshot import _batches
+
+# Seconds between checks of shard processes while waiting for them
+_POLL_INTERVAL = 1.0
+
+
+def find_similar(
+    current_frames: np.ndarray,
+    fingerprints: list[np.ndarray],
+    similarity_threshold: float,
+) -> tuple[int, float] | None:
+    """Index and score of the most similar fingerprint above threshold."""
+    block, lengths = stack_fingerprints(fingerprints)
+    # Scores are guaranteed to be between 0.0 and 1.0
+    scores = compare_fingerprints_block(current_frames, block, lengths)
+
+    most_similar = int(np.argmax(scores))
+    if scores[most_similar] >= similarity_threshold:
+        return most_similar, float(scores[most_similar])
+    return None
+
+
+def shard_bounds(shards: int) -> list[tuple[UUID, UUID | None]]:
+    """
+    Split the space of ids into equal ranges, ids are random uuid4,
+    so every range holds about the same amount of contributions.
+    The last range has no upper bound.
+    """
+    starts = [UUID(int=(i << 128) // shards) for i in range(shards)]
+    return list(zip(starts, [*starts[1:], None]))
+
+
+def _scan_shard(
+    db: Database,
+    current_frames: np.ndarray,
+    bounds: tuple[UUID, UUID | None],
+    similarity_threshold: float,
+    yield_per: int,
+    cancel,
+    results,
+) -> None:
+    """Scan a shard, put (match, rows scanned, error) into `results`."""
+    match, scanned = None, 0
+    try:
+        # Connections inherited from the parent can't be shared
+        db.dispose(close=False)
+        lower, upper = bounds
+        with db.session() as session:
+            query = session.query(
+                Contributions.id, Contributions.fingerprint
+            ).filter(Contributions.id >= lower)
+            if upper is not None:
+                query = query.filter(Contributions.id < upper)
+
+            for block in _batches(query.yield_per(yield_per), yield_per):
+                if cancel.is_set():
+                    break
+                scanned += len(block)
+                match = _find_in_rows(
+                    current_frames, block, similarity_threshold
+                )
+                if match:
+                    break
+    except Exception as e:
+        # Parent waits for every shard, so it must get something,
+        # errors are sent as text, not all of them can be pickled
+        results.put((None, scanned, repr(e)))
+        return
+    results.put((match, scanned, None))
+
+
+def _find_in_rows(
+    current_frames: np.ndarray, rows: list, similarity_threshold: float
+) -> tuple[UUID, float] | None:
+    found = find_similar(
+        current_frames,
+        [unpack_fingerprint(row.fingerprint) for row in rows],
+        similarity_threshold,
+    )
+    if found is None:
+        return None
+    index, score = found
+    return rows[index].id, score
+
+
+def parallel_scan(
+    current_frames: np.ndarray,
+    db: Database,
+    similarity_threshold: float,
+    yield_per: int,
+    workers: int,
+    timeout: float | None = None,
+) -> tuple[UUID, float] | None:
+    """
+    Scan every contribution on `workers` processes, see the module.
+
+    Returns
+    -------
+    tuple[UUID, float] | None
+        Id and similarity score of the first similar contribution
+        found, None if there is none.
+
+    Raises
+    ------
+    RuntimeError
+        If a shard failed, its process died or the scan took more
+        than `timeout` seconds. Processes still running are killed.
+    """
+    context = multiprocessing.get_context('fork')
+    cancel = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_scan_shard,
+            args=(
+                db,
+                current_frames,
+                bounds,
+                similarity_threshold,
+                yield_per,
+                cancel,
+                results,
+            ),
+            daemon=True,
+        )
+        for bounds in shard_bounds(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    match, errors, reported = None, [], 0
+    # Every shard reports once, the rest stop soon after a match
+    while reported < len(processes) and not errors:
+        try:
+            result, scanned, error = results.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            # A killed process never reports, one which reported
+            # exits cleanly
+            died = [
+                process.exitcode
+                for process in processes
+                if process.exitcode not in (None, 0)
+            ]
+            if died:
+                errors.append(f'shard process died, exit codes {died}')
+            elif deadline is not None and time.monotonic() > deadline:
+                errors.append(f'timed out after {timeout} s')
+            continue
+        reported += 1
+        metrics.count('rows_scanned', scanned)
+        if error is not None:
+            errors.append(error)
+        elif result is not None and match is None:
+            match = result
+            cancel.set()
+
+    if errors:
+        cancel.set()
+        for process in processes:
+            process.kill()
+    for process in processes:
+        process.join()
+
+    if errors:
+        raise RuntimeError(f'Shard scan failed: {errors}')
+    return match
+
+
+def scan_workers(workers: int) -> int:
+    """
+    Processes to scan with, 0 is the amount of CPUs. Daemonic
+    processes, e.g. workers of `Proof`, can't fork, they scan alone.
+    Neither do threads other than the main one, e.g. of
+    `proof.run_stages`, as a process forked from them might inherit
+    locks held by other threads.
+    """
+    if multiprocessing.current_process().daemon:
+        console_logger.debug('Scanning in a daemonic process, no shards')
+        return 1
+    if threading.current_thread() is not threading.main_thread():
+        console_logger.debug('Scanning in a worker thread, no shards')
+        return 1
+    return workers or os.cpu_count() or 1
@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+
+class AuthenticityReport(BaseModel):
+    """
+    RawNet verdict of a file decided sequentially over its segments.
+
+    probability: Mean probability of evaluated segments being real.
+    segments: Amount of segments of the file.
+    evaluated: Amount of segments actually evaluated.
+    margin: Half-width of the confidence bound of the probability,
+        0 if every segment was evaluated.
+    """
+
+    probability: float
+    segments: int
+    evaluated: int
+    margin: float
@@ -6,7 +6,9 @@ from sqlalchemy import (
     Column,
     DateTime,
     Float,
+    ForeignKey,
     Integer,
+    LargeBinary,
     String,
     Text,
     func,
@@ -19,7 +21,7 @@ Base = declarative_base()
 class Users(Base):
     __tablename__ = 'users'
 
-    id = Column(UUID, default=uuid4(), primary_key=True)
+    id = Column(UUID, default=uuid4, primary_key=True)
     # Count failed authenticity checks to ban users who exceed limit
     failed_authenticity_count = Column(Integer, default=0)
     is_banned = Column(Boolean, default=False)
@@ -51,10 +53,28 @@ class Contributions(Base):
     # in database because if we add parameter "unique=True"
     # here, the value will be too long to be handled as unique
     # by PostgreSQL.
-    # Also, when a fingerprint is stored in PostgreSQL it's converted
-    # into raw bytes, so it's required to decode them before using
-    fingerprint = Column(Text, nullable=False)
+    # Fingerprint is stored decoded, as raw packed little-endian
+    # uint32 sub-fingerprints, so it's read back without any
+    # decoding, see `audata_proof.fingerprint.unpack_fingerprint`
+    fingerprint = Column(LargeBinary, nullable=False)
+    # Amount of sub-fingerprints in the fingerprint
+    fingerprint_length = Column(Integer, nullable=False)
     # Store hash for fast uniquness lookups.
     fingerprint_hash = Column(
         String(32), unique=True, nullable=False
     )  # 32 chars for md5
+
+
+class FingerprintIndex(Base):
+    __tablename__ = 'fingerprint_index'
+
+    # Inverted index of quantized sub-fingerprints, so uniqueness
+    # checks only compare contributions sharing enough keys instead
+    # of scanning the whole contributions table.
+    # Composite primary key doubles as a lookup index by key
+    key = Column(Integer, primary_key=True)
+    contribution_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey('contributions.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+
+
+class StageMetrics(BaseModel):
+    """
+    Resources used by a stage of a proof.
+
+    wall_time: Seconds the stage took.
+    cpu_time: CPU seconds of the process while the stage ran,
+        includes concurrent stages and intra-op threads.
+    peak_rss: Peak resident memory of the process in bytes by the
+        end of the stage.
+    counters: Amount of work done, e.g. rows scanned or segments
+        inferred.
+    """
+
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    peak_rss: int = 0
+    counters: dict[str, int] = {}
+
+
+class ProofMetrics(BaseModel):
+    """
+    Metrics of a proof, written to metrics.json in `OUTPUT_DIR`, or
+    next to results.json in the job directory of the daemon.
+
+    stages: Metrics of stages of the whole proof.
+    files: Metrics of stages specific to every file, by file name.
+    """
+
+    stages: dict[str, StageMetrics] = {}
+    files: dict[str, dict[str, StageMetrics]] = {}
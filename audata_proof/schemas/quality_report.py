@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+
+
+class QualityReport(BaseModel):
+    """
+    DNSMOS quality of a file aggregated over its windows.
+
+    score: Mean P.835 score (SIG, BAK and OVRL) scaled to [0, 1].
+    sig_mos: Mean signal quality MOS.
+    bak_mos: Mean background noise MOS.
+    ovrl_mos: Mean overall quality MOS.
+    windows: Amount of windows of the file.
+    evaluated: Amount of windows actually scored.
+    margin: Half-width of 95% confidence interval of the score,
+        0 if every window was scored.
+    """
+
+    score: float
+    sig_mos: float
+    bak_mos: float
+    ovrl_mos: float
+    windows: int
+    evaluated: int
+    margin: float
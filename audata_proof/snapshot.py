@@ -0,0 +1,314 @@
+"""
+Local snapshot of fingerprints of contributions.
+
+Uniqueness checks read fingerprints from memory-mapped files instead
+of streaming them from the database on every proof, only rows added
+since the last sync are queried. The snapshot lives in a directory::
+
+    entries.bin  Fixed-size records of contributions, `ENTRY_DTYPE`
+    frames.bin   Packed sub-fingerprints of all of them, back to back
+    meta.json    Amounts of valid entries and frames and the watermark
+
+Both data files are append-only, `meta.json` is replaced atomically
+after appended data is synced to disk, so anything past its amounts
+is a leftover of an interrupted sync and is dropped. Syncs of
+different processes are serialized with a lock file.
+
+Contributions are assumed to be never deleted or changed, remove the
+directory to rebuild the snapshot otherwise.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO
+from uuid import UUID
+
+import numpy as np
+from loguru import logger as console_logger
+
+from audata_proof.config import settings
+from audata_proof.db import Database
+from audata_proof.schemas.db import Contributions
+
+ENTRY_DTYPE = np.dtype(
+    [
+        ('id', 'S16'),
+        ('uploaded_at', '<f8'),
+        ('duration', '<f8'),
+        ('offset', '<u8'),
+        ('length', '<u4'),
+        ('hash', 'S32'),
+    ]
+)
+# Same layout as fingerprints stored in the database, see
+# `audata_proof.fingerprint.pack_fingerprint`
+FRAME_DTYPE = np.dtype('<u4')
+
+
+class FingerprintSnapshot:
+    """
+    Memory-mapped fingerprints of contributions, synced incrementally.
+
+    Rows are found by contribution id and fingerprint hash through
+    sorted copies of these columns, so lookups are binary searches
+    and memory used by the snapshot is a few dozen bytes per row.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.entries = np.empty(0, ENTRY_DTYPE)
+        self.frames = np.empty(0, FRAME_DTYPE)
+        # Latest `uploaded_at` in the snapshot, as a POSIX timestamp
+        self.watermark: float | None = None
+        self._ids = np.empty(0, 'S16')
+        self._id_rows = np.empty(0, np.int64)
+        self._hashes = np.empty(0, 'S32')
+        # Handlers might sync concurrently, see `proof.run_stages`
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._file('meta.json'), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'entries': 0, 'frames': 0, 'watermark': None}
+
+    def _memmap(self, name: str, dtype: np.dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype)
+        return np.memmap(self._file(name), dtype, mode='r', shape=(count,))
+
+    def _load(self) -> None:
+        """
+        Map entries and frames written by the latest sync, rows added
+        since the last call are merged into the sorted columns.
+        """
+        meta = self._read_meta()
+        self.watermark = meta['watermark']
+        known = len(self.entries)
+        if meta['entries'] == known:
+            return
+        if meta['entries'] < known:
+            # The directory was rebuilt meanwhile
+            known = 0
+            self._ids = np.empty(0, 'S16')
+            self._id_rows = np.empty(0, np.int64)
+            self._hashes = np.empty(0, 'S32')
+        self.entries = self._memmap(
+            'entries.bin', ENTRY_DTYPE, meta['entries']
+        )
+        self.frames = self._memmap('frames.bin', FRAME_DTYPE, meta['frames'])
+
+        added = self.entries[known:]
+        order = np.argsort(added['id'])
+        ids = added['id'][order]
+        positions = np.searchsorted(self._ids, ids)
+        self._ids = np.insert(self._ids, positions, ids)
+        self._id_rows = np.insert(self._id_rows, positions, order + known)
+        hashes = np.sort(added['hash'])
+        self._hashes = np.insert(
+            self._hashes, np.searchsorted(self._hashes, hashes), hashes
+        )
+
+    @staticmethod
+    def _contains(
+        values: np.ndarray, keys: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Positions of keys in sorted values and whether they are there."""
+        positions = np.searchsorted(values, keys)
+        found = np.zeros(len(keys), dtype=bool)
+        inside = positions < len(values)
+        found[inside] = values[positions[inside]] == keys[inside]
+        return positions, found
+
+    def has_hash(self, fingerprint_hash: str) -> bool:
+        keys = np.array([fingerprint_hash.encode()], dtype='S32')
+        return bool(self._contains(self._hashes, keys)[1][0])
+
+    def rows(self, ids: list[UUID]) -> np.ndarray:
+        """Rows of contributions with these ids, unknown ids are skipped."""
+        keys = np.array([i.bytes for i in ids], dtype='S16')
+        positions, found = self._contains(self._ids, keys)
+        return self._id_rows[positions[found]]
+
+    def fingerprint(self, row: int) -> np.ndarray:
+        """Sub-fingerprints of a row, a view over mapped pages."""
+        offset = int(self.entries['offset'][row])
+        length = int(self.entries['length'][row])
+        return self.frames[offset : offset + length]
+
+    def id(self, row: int) -> UUID:
+        # Fixed-size bytes lose trailing zero bytes when read back
+        return UUID(bytes=bytes(self.entries['id'][row]).ljust(16, b'\0'))
+
+    def sync(self, db: Database, yield_per: int = 1000) -> int:
+        """
+        Append contributions uploaded since the watermark.
+
+        Rows are appended to the data files block by block as they
+        are fetched, so memory used doesn't depend on their amount.
+
+        `uploaded_at` is the time a transaction started, so a row
+        might be committed after rows with later timestamps, rows
+        within `settings.SNAPSHOT_SYNC_LAG` seconds before the
+        watermark are queried again and the known ones are skipped.
+
+        Returns
+        -------
+        int
+            Amount of appended contributions.
+        """
+        with self._lock, open(self._file('sync.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Other processes might have synced meanwhile
+            self._load()
+            meta = self._read_meta()
+            appended = 0
+            offset = meta['frames']
+            watermark = self.watermark
+
+            with (
+                db.session() as session,
+                self._open_data(
+                    'entries.bin', meta['entries'] * ENTRY_DTYPE.itemsize
+                ) as entries_file,
+                self._open_data(
+                    'frames.bin', meta['frames'] * FRAME_DTYPE.itemsize
+                ) as frames_file,
+            ):
+                query = session.query(
+                    Contributions.id,
+                    Contributions.uploaded_at,
+                    Contributions.duration,
+                    Contributions.fingerprint,
+                    Contributions.fingerprint_hash,
+                )
+                if self.watermark is not None:
+                    since = datetime.fromtimestamp(
+                        self.watermark, timezone.utc
+                    ) - timedelta(seconds=settings.SNAPSHOT_SYNC_LAG)
+                    query = query.filter(Contributions.uploaded_at >= since)
+                query = query.order_by(
+                    Contributions.uploaded_at, Contributions.id
+                )
+
+                for rows in _batches(query.yield_per(yield_per), yield_per):
+                    entries, frames = self._block(rows, offset)
+                    if not len(entries):
+                        continue
+                    entries_file.write(entries.tobytes())
+                    frames_file.write(frames.tobytes())
+                    appended += len(entries)
+                    offset += len(frames)
+                    watermark = max(
+                        watermark or 0.0, entries['uploaded_at'].max()
+                    )
+
+            if not appended:
+                return 0
+
+            self._write_meta(
+                {
+                    'entries': meta['entries'] + appended,
+                    'frames': offset,
+                    'watermark': float(watermark),
+                }
+            )
+            self._load()
+        console_logger.info(
+            f'Fingerprint snapshot synced, {appended} appended, '
+            f'{len(self)} in total'
+        )
+        return appended
+
+    def _block(self, rows: list, offset: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Entries and frames of rows not in the snapshot yet, frames
+        start at `offset` of frames.bin.
+        """
+        ids = np.array([row.id.bytes for row in rows], dtype='S16')
+        _, known = self._contains(self._ids, ids)
+        rows = [row for row, skip in zip(rows, known) if not skip]
+        entries = np.empty(len(rows), ENTRY_DTYPE)
+        fingerprints = [
+            np.frombuffer(row.fingerprint, FRAME_DTYPE) for row in rows
+        ]
+        lengths = np.array([len(f) for f in fingerprints], dtype=np.uint64)
+        entries['id'] = [row.id.bytes for row in rows]
+        entries['uploaded_at'] = [row.uploaded_at.timestamp() for row in rows]
+        entries['duration'] = [row.duration for row in rows]
+        entries['offset'] = offset + np.cumsum(lengths) - lengths
+        entries['length'] = lengths
+        entries['hash'] = [row.fingerprint_hash.encode() for row in rows]
+        frames = (
+            np.concatenate(fingerprints)
+            if fingerprints
+            else np.empty(0, FRAME_DTYPE)
+        )
+        return entries, frames
+
+    @contextmanager
+    def _open_data(self, name: str, valid_size: int) -> Iterator[BinaryIO]:
+        """Data file to append to, synced to disk once it's closed."""
+        with open(self._file(name), 'ab') as f:
+            # Drop leftovers of an interrupted sync
+            f.truncate(valid_size)
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_meta(self, meta: dict) -> None:
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file('meta.json'))
+
+
+def _batches(rows: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Snapshot of the process, see `get_snapshot`
+_snapshot: FingerprintSnapshot | None = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(db: Database, sync: bool = False) -> FingerprintSnapshot:
+    """
+    Snapshot at `settings.SNAPSHOT_DIR`, synced with the database
+    on first access or if `sync` is set. Proofs sync it once before
+    their files are checked, so checks don't sync it on their own.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = FingerprintSnapshot(
+                settings.SNAPSHOT_DIR
+                or os.path.join(settings.USE_SEALING, 'fingerprints')
+            )
+            sync = True
+    if sync:
+        _snapshot.sync(db)
+    return _snapshot
@@ -0,0 +1,59 @@
+import importlib
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+# Heavy dependencies of a proof, in order they are first needed
+HEAVY_MODULES = (
+    'sqlalchemy',
+    'numpy',
+    'acoustid',
+    'librosa',
+    'torch',
+    'onnxruntime',
+    'speechmos',
+)
+
+
+class StartupProfile:
+    """
+    Wall time of startup stages of a one-shot run, reported with
+    `python -m audata_proof --startup-profile`.
+
+    Stages are timed whether or not profiling is enabled, it only
+    decides whether heavy modules are imported one by one, so their
+    import time is attributed to them, and whether it's reported.
+    For a full tree of imports use `python -X importtime`.
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        # Seconds spent in every stage, in order they were run
+        self.times: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = time.perf_counter() - start
+
+    def import_modules(self, names: Iterable[str] = HEAVY_MODULES) -> None:
+        """Import modules not imported yet, each as its own stage."""
+        if not self.enabled:
+            return
+        for name in names:
+            if name not in sys.modules:
+                with self.stage(f'import {name}'):
+                    importlib.import_module(name)
+
+    def report(self) -> str:
+        width = max((len(name) for name in self.times), default=0)
+        lines = [
+            f'{name:<{width}}  {seconds:8.3f}s'
+            for name, seconds in self.times.items()
+        ]
+        lines.append(f'{"total":<{width}}  {sum(self.times.values()):8.3f}s')
+        return '\n'.join(lines)
@@ -2,45 +2,97 @@ import json
 import os
 import zipfile
 from binascii import Error as BinasciiError
-from hashlib import md5
+from collections.abc import Iterator
 
-import librosa
 import numpy as np
-from acoustid import fingerprint_file
 from loguru import logger as console_logger
+from sqlalchemy import literal_column, select
+from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlalchemy.orm import Session
 
 from audata_proof.config import settings
 from audata_proof.db import Database, db
-from audata_proof.schemas.db import Contributions, Users
+from audata_proof.fingerprint import fingerprint_keys, unpack_fingerprint
+from audata_proof.schemas.db import Contributions, FingerprintIndex, Users
 
 
 def seed_db_with_fprints(amount: int):
-    """Seed database with fingerprints for testing purposes."""
+    """
+    Seed database with fingerprints for testing purposes, see
+    `audata_proof.corpus` to import larger corpora.
+    """
+    from audata_proof.corpus import import_corpus
+
     db.init()
-    for i in range(amount):
-        input_file_path: str = os.path.join(
-            settings.INPUT_DIR, os.listdir(settings.INPUT_DIR)[i]
-        )
-        duration, current_fprint = fingerprint_file(input_file_path)
-        new_contribution = Contributions(
-            fingerprint=current_fprint,
-            fingerprint_hash=md5(str(current_fprint).encode()).hexdigest(),
-            file_link=f'https://broken_link{i}.org',
-            file_link_hash=md5(
-                f'https://broken_link{i}.org'.encode()
-            ).hexdigest(),
-            duration=duration,
-        )
-        with db.session() as session:
-            session.add(new_contribution)
-            session.commit()
+    amount = import_corpus(db, settings.INPUT_DIR, limit=amount)
     console_logger.info(
         'Database was successfully seeded '
         f'with amount of entities equal to: {amount}'
     )
 
 
+def index_contribution(
+    session: Session, contribution_id, frames: np.ndarray
+) -> None:
+    """
+    Add index keys of a contribution's fingerprint to the inverted index.
+
+    Has to be called whenever a contribution is stored, otherwise it
+    won't be found by the uniqueness check.
+    """
+    keys = fingerprint_keys(frames)
+    session.bulk_insert_mappings(
+        FingerprintIndex,  # type: ignore
+        [
+            {'key': int(key), 'contribution_id': contribution_id}
+            for key in keys
+        ],
+    )
+
+
+def backfill_fingerprint_index(db: Database, batch_size: int = 1000) -> int:
+    """
+    Index contributions which were stored before the index existed.
+
+    Contributions are walked in order of ids and every batch is
+    committed on its own, so an interrupted backfill is resumed by
+    running it again.
+
+    Returns
+    -------
+    int
+        Amount of indexed contributions.
+    """
+    amount, last_id = 0, None
+    while True:
+        with db.session() as session:
+            indexed = select(FingerprintIndex.contribution_id).where(
+                FingerprintIndex.contribution_id == Contributions.id
+            )
+            query = session.query(
+                Contributions.id, Contributions.fingerprint
+            ).filter(~indexed.exists())
+            if last_id is not None:
+                query = query.filter(Contributions.id > last_id)
+            rows = query.order_by(Contributions.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            for contribution_id, fingerprint in rows:
+                index_contribution(
+                    session, contribution_id, unpack_fingerprint(fingerprint)
+                )
+            last_id = rows[-1].id
+        amount += len(rows)
+        console_logger.info(f'Fingerprint index backfilled: {amount}')
+    return amount
+
+
 def decode_db_fingerprint(fprint: str):
+    """
+    Decode a fingerprint stored in the legacy text column, which holds
+    hex of the compressed fingerprint, see `audata_proof.migrations`.
+    """
     try:
         # Decode db fingerprint to be correctly utilized by the comparison func
         db_fingerprint = bytes.fromhex(str(fprint)[2:])
@@ -50,22 +102,139 @@ def decode_db_fingerprint(fprint: str):
     return db_fingerprint
 
 
-def unzip_dir(dir) -> None:
+# Chunk size archive members are read with
+_ARCHIVE_CHUNK_SIZE = 1 << 16
+
+
+def _is_wanted(filename: str) -> bool:
+    return filename == 'account.json' or filename.lower().endswith('.ogg')
+
+
+class ArchiveMember:
     """
-    If the input directory contains any zip files, extract them
+    Member of a zip archive, read in memory only when it's needed,
+    e.g. by the worker evaluating it, see `iter_archive`.
     """
-    for input_filename in os.listdir(dir):
-        input_file = os.path.join(dir, input_filename)
 
-        if zipfile.is_zipfile(input_file):
-            with zipfile.ZipFile(input_file, 'r') as zip_ref:
-                zip_ref.extractall(dir)
+    def __init__(self, path: str, filename: str) -> None:
+        self.path = path
+        self.filename = filename
+
+    def __repr__(self) -> str:
+        return f'ArchiveMember({self.path!r}, {self.filename!r})'
+
+    def read(self) -> bytes:
+        """
+        Decompress the member, it's limited by
+        `settings.ARCHIVE_MAX_MEMBER_SIZE` whatever its header says.
+        """
+        content = bytearray()
+        with (
+            zipfile.ZipFile(self.path, 'r') as archive,
+            archive.open(self.filename) as member,
+        ):
+            while chunk := member.read(_ARCHIVE_CHUNK_SIZE):
+                content += chunk
+                _check_member_size(self.path, self.filename, len(content))
+        return bytes(content)
 
 
-def extract_data(dir) -> tuple:
-    ogg_files = []
+def iter_archive(path: str) -> Iterator[tuple[str, ArchiveMember]]:
+    """
+    Find `.ogg` members and `account.json` of a zip archive.
+
+    Nothing is extracted to disk, members are read in memory when
+    they're used. Limits of `settings.ARCHIVE_*` are checked against
+    declared sizes of all members upfront and against bytes actually
+    decompressed while reading, so forged headers don't help zip
+    bombs. Members are told apart by base name, so it must be unique.
+
+    Yields
+    ------
+    tuple[str, ArchiveMember]
+        Base name of every member and the member.
+
+    Raises
+    ------
+    ValueError
+        If the archive exceeds any of the limits, or several members
+        have the same base name.
+    """
+    with zipfile.ZipFile(path, 'r') as archive:
+        members = [
+            info
+            for info in archive.infolist()
+            if not info.is_dir()
+            and _is_wanted(os.path.basename(info.filename))
+        ]
+    if len(members) > settings.ARCHIVE_MAX_MEMBERS:
+        raise ValueError(
+            f'Archive {path} has {len(members)} members, '
+            f'at most {settings.ARCHIVE_MAX_MEMBERS} are allowed'
+        )
+    names = set()
+    for info in members:
+        name = os.path.basename(info.filename)
+        if name in names:
+            raise ValueError(f'Archive {path} has several members {name}')
+        names.add(name)
+        _check_member_size(path, info.filename, info.file_size)
+        ratio = info.file_size / max(info.compress_size, 1)
+        if ratio > settings.ARCHIVE_MAX_RATIO:
+            raise ValueError(
+                f'Member {info.filename} of {path} has compression '
+                f'ratio {ratio:.0f}, at most '
+                f'{settings.ARCHIVE_MAX_RATIO} is allowed'
+            )
+    # Members aren't decompressed past their declared sizes
+    if sum(info.file_size for info in members) > (
+        settings.ARCHIVE_MAX_TOTAL_SIZE
+    ):
+        raise ValueError(
+            f'Archive {path} exceeds {settings.ARCHIVE_MAX_TOTAL_SIZE} bytes'
+        )
+
+    for info in members:
+        yield (
+            os.path.basename(info.filename),
+            ArchiveMember(path, info.filename),
+        )
+
+
+def _check_member_size(path: str, filename: str, size: int) -> None:
+    if size > settings.ARCHIVE_MAX_MEMBER_SIZE:
+        raise ValueError(
+            f'Member {filename} of {path} exceeds '
+            f'{settings.ARCHIVE_MAX_MEMBER_SIZE} bytes'
+        )
+
+
+def extract_data(dir) -> tuple[dict[str, str | ArchiveMember], str]:
+    """
+    Collect audio files and telegram id of the user from input dir.
+
+    Zip archives are read in memory with `iter_archive`.
+
+    Returns
+    -------
+    tuple[dict[str, str | ArchiveMember], str]
+        Audio files by name, either paths or members of archives,
+        and telegram id.
+
+    Raises
+    ------
+    ValueError
+        If several audio files have the same name.
+    """
+    audio_files: dict[str, str | ArchiveMember] = {}
     user_telegram_id = None
 
+    def add(name: str, source: str | ArchiveMember) -> None:
+        # Files are told apart by name, e.g. in attributes of the proof
+        if name in audio_files:
+            raise ValueError(f'Several audio files are named {name}')
+        audio_files[name] = source
+
     for filename in os.listdir(dir):
         file_path = os.path.join(dir, filename)
         ext = os.path.splitext(filename)[1].lower()
@@ -76,37 +245,60 @@ def extract_data(dir) -> tuple:
                 user_telegram_id = data.get('telegram_id')
 
         elif ext == '.ogg':
-            ogg_files.append(file_path)
+            add(filename, file_path)
+
+        elif zipfile.is_zipfile(file_path):
+            for name, member in iter_archive(file_path):
+                if name == 'account.json':
+                    user_telegram_id = json.loads(member.read()).get(
+                        'telegram_id'
+                    )
+                else:
+                    add(name, member)
 
-    if not user_telegram_id or not ogg_files:
+    if not user_telegram_id or not audio_files:
         console_logger.error(f'Missing or corrupted files in directory {dir}')
         raise AttributeError()
 
-    return ogg_files, user_telegram_id
+    return audio_files, user_telegram_id
 
 
-def check_user(telegram_id: str, db: Database) -> None:
+def upsert_user_statement(telegram_id: str) -> Insert:
     """
-    Check if a user with this id exists, if not, create one.
+    Insert a user unless one with this id exists, returning whether
+    the user is banned and whether they were just created.
     """
-    with db.session() as session:
-        user = (
-            session.query(Users)
-            .filter_by(telegram_id=str(telegram_id))
-            .one_or_none()
-        )
+    statement = insert(Users).values(telegram_id=str(telegram_id))
+    return statement.on_conflict_do_update(
+        index_elements=[Users.telegram_id],
+        # No-op update, so the existing row is returned too
+        set_={'telegram_id': statement.excluded.telegram_id},
+    ).returning(
+        Users.is_banned,
+        # Only rows inserted by the statement have no xmax
+        literal_column('xmax = 0').label('created'),
+    )
+
 
-        if not user:
-            create_new_user(telegram_id, db)
+def upsert_user(telegram_id: str, db: Database) -> bool:
+    """
+    Make sure a user with this id exists in a single round-trip.
 
+    Concurrent proofs of a new user don't race on the unique
+    telegram id, one of them inserts the user and others get it.
 
-def create_new_user(telegram_id: str, db: Database) -> None:
-    telegram_id = str(telegram_id)
-    new_user = Users(telegram_id=telegram_id)
-    with db.session() as session:
-        session.add(new_user)
-        session.commit()
-    console_logger.info(f'New user with id {telegram_id} created')
+    Returns
+    -------
+    bool
+        Whether the user is banned.
+    """
+    with db.autocommit() as connection:
+        is_banned, created = connection.execute(
+            upsert_user_statement(telegram_id)
+        ).one()
+    if created:
+        console_logger.info(f'New user with id {telegram_id} created')
+    return bool(is_banned)
 
 
 def pad(y, max_len=96000):
@@ -120,9 +312,8 @@ def pad(y, max_len=96000):
 
 
 def process_audio(audio_path):
-    y, sr = librosa.load(audio_path, sr=None)
-
-    if sr != 24000:
-        y = librosa.resample(y, orig_sr=sr, target_sr=24000)
+    # Deferred, so reading inputs doesn't import librosa
+    from audata_proof.audio import AudioAsset
 
-    return y, sr
+    audio = AudioAsset(audio_path)
+    return audio.resampled(24000), audio.sample_rate
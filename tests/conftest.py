@@ -0,0 +1,27 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+from audata_proof.db import Database
+from audata_proof.schemas.db import Base
+
+
+@pytest.fixture
+def test_db():
+    """
+    Database at `TEST_DB_URI`, with tables recreated for every test,
+    so never point it to a database holding anything of value.
+    Tests using it are skipped if it isn't set.
+    """
+    uri = os.environ.get('TEST_DB_URI')
+    if not uri:
+        pytest.skip('TEST_DB_URI is not set')
+    engine = create_engine(uri)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+    database = Database()
+    database.init(uri)
+    yield database
+    database.dispose()
@@ -0,0 +1,90 @@
+import acoustid
+import librosa
+import numpy as np
+
+from audata_proof.audio import AudioAsset, frame_blocks
+
+audio_path = 'demo/input/ai6.ogg'
+
+
+def test_resampled_matches_librosa_load():
+    audio = AudioAsset(audio_path)
+    for sample_rate in (24000, 16000):
+        expected, _ = librosa.load(audio_path, sr=sample_rate)
+        np.testing.assert_array_equal(audio.resampled(sample_rate), expected)
+    # Views are cached
+    assert audio.resampled(16000) is audio.resampled(16000)
+
+
+def test_pcm_blocks():
+    audio = AudioAsset(audio_path)
+    pcm = b''.join(audio.pcm_blocks(block_size=1000))
+    assert len(pcm) == audio.samples.size * 2
+
+
+def test_stream_matches_resampled():
+    audio = AudioAsset(audio_path)
+    streamed = AudioAsset(audio_path, streaming=True)
+    assert streamed.streaming
+    assert streamed.frames == audio.frames
+    assert streamed.sample_rate == audio.sample_rate
+    for sample_rate in (24000, 16000):
+        blocks = list(streamed.stream(sample_rate, block_len=10000))
+        assert len(blocks) > 1
+        joined = np.concatenate(blocks)
+        assert len(joined) == streamed.resampled_length(sample_rate)
+        np.testing.assert_allclose(
+            joined, audio.resampled(sample_rate), atol=1e-3
+        )
+    # PCM is read from the file as is
+    assert b''.join(streamed.pcm_blocks()) == b''.join(audio.pcm_blocks())
+
+
+def test_excerpt():
+    audio = AudioAsset(audio_path)
+    streamed = AudioAsset(audio_path, streaming=True)
+    expected = audio.resampled(24000)
+    for start in (0, 48000, len(expected) - 1000):
+        np.testing.assert_allclose(
+            streamed.excerpt(start, 24000, 24000),
+            expected[start : start + 24000],
+            atol=1e-3,
+        )
+
+
+def test_frame_blocks():
+    y = np.arange(100, dtype=np.float32)
+    blocks = np.array_split(y, 7)
+
+    *frames, rest = frame_blocks(blocks, frame_len=20, hop_len=10)
+    assert len(frames) == 9
+    np.testing.assert_array_equal(frames[3], y[30:50])
+    np.testing.assert_array_equal(rest, y[90:])
+
+    # Frames hop over samples between them
+    *frames, rest = frame_blocks(blocks, frame_len=20, hop_len=30)
+    assert [frame[0] for frame in frames] == [0, 30, 60]
+    np.testing.assert_array_equal(rest, y[90:])
+
+
+def test_fingerprint_decodes_only_its_length():
+    audio = AudioAsset(audio_path)
+    pcm = b''.join(audio.pcm_blocks(block_size=1000, max_length=1.5))
+    assert len(pcm) == int(1.5 * audio.sample_rate) * audio.channels * 2
+    # Nothing but the fingerprinted part was decoded
+    assert 'samples' not in audio.__dict__
+    assert pcm == b''.join(AudioAsset(audio_path).pcm_blocks())[: len(pcm)]
+
+
+def test_fingerprint_fpcalc_suffix(monkeypatch):
+    paths = []
+    monkeypatch.setattr(acoustid, 'have_chromaprint', False)
+    monkeypatch.setattr(
+        acoustid, 'fingerprint_file', lambda path: paths.append(path)
+    )
+    with open(audio_path, 'rb') as f:
+        audio = AudioAsset(f.read(), 'upload/ai6.ogg')
+    assert audio.fingerprint is None
+
+    assert paths[0].endswith('.ogg')
+    assert 'upload' not in paths[0]
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+
+from audata_proof import benchmark
+from audata_proof.audio import AudioAsset
+from audata_proof.benchmark import (
+    BENCHMARK_USER,
+    BenchmarkReport,
+    StageTiming,
+    compare,
+    is_local_url,
+    run_benchmarks,
+    synthetic_speech,
+    synthetic_wav,
+    time_stage,
+)
+from audata_proof.config import settings
+from audata_proof.schemas.db import Contributions, FingerprintIndex, Users
+
+
+def test_synthetic_speech_is_reproducible():
+    y = synthetic_speech(2.0, sample_rate=16000, seed=1)
+    assert y.shape == (32000,)
+    assert y.dtype == np.float32
+    assert np.abs(y).max() <= 0.5
+    np.testing.assert_array_equal(y, synthetic_speech(2.0, 16000, seed=1))
+    assert not np.array_equal(y, synthetic_speech(2.0, 16000, seed=2))
+
+
+def test_synthetic_wav_is_decoded():
+    audio = AudioAsset(synthetic_wav(1.5), 'synthetic.wav')
+    assert audio.sample_rate == 16000
+    assert audio.duration == 1.5
+
+
+def test_time_stage():
+    calls = []
+    timing = time_stage(calls.append, setup=lambda: len(calls), repeat=3)
+    assert timing.repeat == 3
+    # Warm-up run isn't timed
+    assert calls == [0, 1, 2, 3]
+    assert 0 <= timing.min <= timing.median
+
+
+def _report(**medians):
+    return BenchmarkReport(
+        parameters={},
+        environment={},
+        stages={
+            name: StageTiming(median=median, min=median, mean=median, repeat=1)
+            for name, median in medians.items()
+        },
+    )
+
+
+def test_compare():
+    baseline = _report(decode=1.0, quality=2.0)
+    report = _report(decode=1.1, quality=3.0, new=1.0)
+    assert compare(report, baseline, tolerance=0.2) == ['quality']
+    assert compare(report, baseline, tolerance=0.6) == []
+
+
+def test_is_local_url():
+    assert is_local_url('postgresql+psycopg://user@localhost/bench')
+    assert is_local_url('postgresql+psycopg://user@/bench?host=/tmp')
+    assert not is_local_url('postgresql+psycopg://user@db.example.com/db')
+
+
+def test_run_benchmarks_cleans_up(monkeypatch, test_db):
+    time_stages = benchmark._time_stages
+    during = {}
+
+    def spy(*args):
+        with test_db.session() as session:
+            during['seeded'] = session.query(Contributions).count()
+        during['register'] = settings.REGISTER_CONTRIBUTIONS
+        return time_stages(*args)
+
+    monkeypatch.setattr(benchmark, '_time_stages', spy)
+    report = run_benchmarks(
+        os.environ['TEST_DB_URI'],
+        duration=1.0,
+        corpus=30,
+        repeat=1,
+        stages=['decode_db_fingerprint'],
+    )
+    assert list(report.stages) == ['decode_db_fingerprint']
+    assert during == {'seeded': 30, 'register': False}
+    assert settings.REGISTER_CONTRIBUTIONS is True
+
+    # Seeded rows are gone, and no user was left behind
+    with test_db.session() as session:
+        assert session.query(Contributions).count() == 0
+        assert session.query(FingerprintIndex).count() == 0
+        assert (
+            session.query(Users).filter_by(telegram_id=BENCHMARK_USER).count()
+            == 0
+        )
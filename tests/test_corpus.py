@@ -0,0 +1,81 @@
+import os
+import zipfile
+from uuid import uuid4
+
+import numpy as np
+
+from audata_proof import corpus
+from audata_proof.corpus import import_corpus, iter_sources
+from audata_proof.fingerprint import fingerprint_keys, pack_fingerprint
+from audata_proof.schemas.db import Contributions
+
+
+def test_iter_sources_directory(tmp_path):
+    (tmp_path / 'b').mkdir()
+    for name in ('b/2.ogg', '1.WAV', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+
+    assert list(iter_sources(str(tmp_path))) == [
+        ('1.WAV', str(tmp_path / '1.WAV'), None),
+        ('b/2.ogg', str(tmp_path / 'b/2.ogg'), None),
+    ]
+
+
+def test_iter_sources_archive(tmp_path):
+    path = str(tmp_path / 'corpus.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('corpus/b.ogg', b'')
+        archive.writestr('corpus/a.mp3', b'')
+        archive.writestr('corpus/account.json', b'{}')
+
+    assert list(iter_sources(path)) == [
+        ('corpus/a.mp3', path, 'corpus/a.mp3'),
+        ('corpus/b.ogg', path, 'corpus/b.ogg'),
+    ]
+
+
+def _stub_fingerprint(source):
+    """Fingerprints dup_* files alike and fails bad.ogg."""
+    link = source[0]
+    # Records the call in a directory, forked workers inherit the variable
+    open(os.path.join(os.environ['STUB_CALLS'], link), 'w').close()
+    if link == 'bad.ogg':
+        return link, None
+    frames = np.arange(100, dtype=np.uint32)
+    return link, {
+        'id': uuid4(),
+        'fingerprint': pack_fingerprint(frames),
+        'fingerprint_length': len(frames),
+        'fingerprint_hash': 'dup' if link.startswith('dup') else link,
+        'file_link': link,
+        'file_link_hash': corpus.link_hash(link),
+        'duration': 1.0,
+        'keys': fingerprint_keys(frames).tolist(),
+    }
+
+
+def test_import_corpus_resumes_skipped(monkeypatch, tmp_path, test_db):
+    files = tmp_path / 'corpus'
+    files.mkdir()
+    for name in ('a.ogg', 'bad.ogg', 'dup_1.ogg', 'dup_2.ogg'):
+        (files / name).write_bytes(b'')
+    state = str(tmp_path / 'state')
+    monkeypatch.setattr(corpus, '_fingerprint_source', _stub_fingerprint)
+
+    calls = tmp_path / 'calls'
+    calls.mkdir()
+    monkeypatch.setenv('STUB_CALLS', str(calls))
+    imported = import_corpus(test_db, str(files), 2, 2, state=state)
+
+    assert imported == 2
+    assert len(list(calls.iterdir())) == 4
+    assert sorted(corpus.read_state(state)) == ['bad.ogg', 'dup_2.ogg']
+    with test_db.session() as session:
+        assert session.query(Contributions).count() == 2
+
+    # Nothing is left to fingerprint on a rerun
+    calls = tmp_path / 'rerun'
+    calls.mkdir()
+    monkeypatch.setenv('STUB_CALLS', str(calls))
+    assert import_corpus(test_db, str(files), 2, 2, state=state) == 0
+    assert list(calls.iterdir()) == []
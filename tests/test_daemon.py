@@ -0,0 +1,150 @@
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+from types import SimpleNamespace
+
+import pytest
+
+from audata_proof import daemon
+from audata_proof.config import settings
+from audata_proof.db import Database
+from audata_proof.proof import Proof
+from audata_proof.schemas.proof_response import ProofResponse
+
+
+def _add_job(spool, job):
+    path = os.path.join(spool.path, 'upload', job)
+    os.makedirs(path)
+    shutil.copy('demo/input/ai6.ogg', path)
+    with open(os.path.join(path, 'account.json'), 'w') as f:
+        json.dump({'telegram_id': '42'}, f)
+    os.rename(path, spool.dir(daemon.INCOMING, job))
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = daemon.Spool(str(tmp_path))
+    yield spool
+    spool.close()
+
+
+def test_claim_and_requeue(spool):
+    for job in ('a', 'b', 'c'):
+        _add_job(spool, job)
+
+    claimed = spool.claim(2)
+    assert len(claimed) == 2
+    assert sorted(os.listdir(spool.dir(daemon.PROCESSING))) == sorted(claimed)
+    assert len(os.listdir(spool.dir(daemon.INCOMING))) == 1
+
+    # Jobs of a daemon still running are left alone
+    other = daemon.Spool(spool.path)
+    assert other.requeue() == []
+    assert spool.requeue() == []
+
+    spool.close()
+    assert other.requeue() == sorted(claimed)
+    assert sorted(os.listdir(spool.dir(daemon.INCOMING))) == ['a', 'b', 'c']
+    # Directory and lock of the daemon which is gone are removed
+    assert sorted(
+        os.listdir(os.path.join(spool.path, daemon.PROCESSING))
+    ) == sorted([other.owner, f'{other.owner}.lock'])
+    other.close()
+
+
+def test_requeue_legacy_jobs(spool):
+    # Claimed by a daemon keeping jobs right in processing
+    os.makedirs(os.path.join(spool.path, daemon.PROCESSING, 'a'))
+    assert spool.requeue() == ['a']
+    assert os.listdir(spool.dir(daemon.INCOMING)) == ['a']
+
+
+def test_claim_skips_jobs_claimed_meanwhile(monkeypatch, spool):
+    for job in ('a', 'b'):
+        _add_job(spool, job)
+    entries = list(os.scandir(spool.dir(daemon.INCOMING)))
+    # Claimed by another daemon after being listed
+    os.rename(
+        spool.dir(daemon.INCOMING, 'a'), os.path.join(spool.path, 'taken')
+    )
+    monkeypatch.setattr(daemon.os, 'scandir', lambda path: iter(entries))
+
+    assert spool.claim(2) == ['b']
+
+
+def test_lost_job_requeued(spool):
+    _add_job(spool, 'a')
+    (job,) = spool.claim(1)
+    result = SimpleNamespace(ready=lambda: False)
+
+    # Queued, or running in a live worker
+    assert daemon._running(spool, {job: result}) == {job: result}
+    spool.started(job)
+    assert daemon._running(spool, {job: result}) == {job: result}
+
+    worker = multiprocessing.get_context('fork').Process(
+        target=spool.started, args=(job,)
+    )
+    worker.start()
+    worker.join()
+    assert daemon._running(spool, {job: result}) == {}
+    assert os.listdir(spool.dir(daemon.INCOMING)) == ['a']
+    assert os.listdir(spool.dir(daemon.PROCESSING)) == []
+
+
+def _crash(spool, job):
+    spool.started(job)
+    # As if killed out of memory
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_crashing_job_failed(monkeypatch, spool):
+    monkeypatch.setattr(settings, 'DAEMON_MAX_ATTEMPTS', 2)
+    for job in ('a', 'b'):
+        _add_job(spool, job)
+    result = SimpleNamespace(ready=lambda: False)
+
+    def crash(job):
+        worker = multiprocessing.get_context('fork').Process(
+            target=_crash, args=(spool, job)
+        )
+        worker.start()
+        worker.join()
+        assert worker.exitcode == -signal.SIGKILL
+        assert daemon._running(spool, {job: result}) == {}
+
+    assert spool.claim(1) == ['a']
+    crash('a')
+    # Requeued behind the job waiting meanwhile
+    assert spool.claim(1) == ['b']
+    assert spool.claim(1) == ['a']
+    crash('a')
+
+    assert os.listdir(spool.dir(daemon.FAILED)) == ['a']
+    with open(os.path.join(spool.dir(daemon.FAILED, 'a'), 'error.json')) as f:
+        assert json.load(f)['attempts'] == 2
+
+
+def test_run_job(monkeypatch, spool):
+    monkeypatch.setattr(
+        Proof, 'generate', lambda self: ProofResponse(dlp_id=1, valid=True)
+    )
+    _add_job(spool, 'a')
+    (job,) = spool.claim(1)
+
+    assert daemon.run_job(spool, job, Database())
+    with open(os.path.join(spool.dir(daemon.DONE, job), 'results.json')) as f:
+        assert json.load(f)['valid'] is True
+
+
+def test_run_job_failed(spool):
+    os.makedirs(spool.dir(daemon.INCOMING, 'empty'))
+    (job,) = spool.claim(1)
+
+    # No input files
+    assert not daemon.run_job(spool, job, Database())
+    assert os.path.exists(
+        os.path.join(spool.dir(daemon.FAILED, job), 'error.json')
+    )
@@ -0,0 +1,86 @@
+import ast
+
+import numpy as np
+from acoustid import _match_fingerprints
+
+from audata_proof.fingerprint import (
+    INDEX_KEY_SHIFT,
+    INDEX_KEYS,
+    compare_fingerprints_block,
+    decode_fingerprint,
+    encode_fingerprint,
+    fingerprint_keys,
+    pack_fingerprint,
+    stack_fingerprints,
+    unpack_fingerprint,
+)
+from tests import fprint_strings
+
+fprint = ast.literal_eval(fprint_strings.expected)
+
+
+def test_decode_fingerprint():
+    frames = decode_fingerprint(fprint)
+    assert frames.dtype == np.uint32
+    assert len(frames) == 611
+
+
+def test_encode_fingerprint_roundtrip():
+    assert encode_fingerprint(decode_fingerprint(fprint)) == fprint
+
+    frames = np.random.default_rng(0).integers(0, 2**32, 1000, dtype=np.uint32)
+    np.testing.assert_array_equal(
+        decode_fingerprint(encode_fingerprint(frames)), frames
+    )
+
+
+def test_fingerprint_keys():
+    frames = decode_fingerprint(fprint)
+    keys = fingerprint_keys(frames)
+    assert len(np.unique(keys)) == len(keys)
+    assert keys.max() < 2 ** (32 - INDEX_KEY_SHIFT)
+    assert len(keys) == INDEX_KEYS
+
+    # Flipping low bits doesn't change keys
+    flipped = frames ^ np.uint32(0b101)
+    np.testing.assert_array_equal(fingerprint_keys(flipped), keys)
+
+    # A part of the recording keeps most keys of the whole one
+    shared = np.intersect1d(fingerprint_keys(frames[100:500]), keys)
+    assert len(shared) >= INDEX_KEYS // 2
+    # Smaller sketches are prefixes of larger ones
+    np.testing.assert_array_equal(fingerprint_keys(frames, 8), keys[:8])
+
+
+def test_compare_fingerprints_block():
+    rng = np.random.default_rng(0)
+    query = decode_fingerprint(fprint)
+
+    # Shifted copy with some flipped bits, unrelated ones and an empty one
+    similar = query[40:400].copy()
+    flips = rng.integers(0, 32, len(similar[::3]), dtype=np.uint32)
+    similar[::3] ^= np.uint32(1) << flips
+    unrelated = rng.integers(0, 2**32, 500, dtype=np.uint32)
+    candidates = [similar, unrelated, query[:10], np.zeros(0, np.uint32)]
+
+    block, lengths = stack_fingerprints(candidates)
+    scores = compare_fingerprints_block(query, block, lengths)
+
+    expected = [
+        _match_fingerprints(query.tolist(), candidate.tolist())
+        for candidate in candidates[:-1]
+    ]
+    np.testing.assert_allclose(scores[:-1], expected)
+    assert scores[0] == 1.0
+    assert scores[-1] == 0.0
+
+
+def test_pack_fingerprint():
+    frames = decode_fingerprint(fprint)
+    packed = pack_fingerprint(frames)
+    assert len(packed) == 4 * len(frames)
+
+    unpacked = unpack_fingerprint(packed)
+    np.testing.assert_array_equal(unpacked, frames)
+    # Unpacking is a view over stored bytes
+    assert not unpacked.flags.owndata
@@ -0,0 +1,347 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from types import SimpleNamespace
+from uuid import uuid4
+
+import numpy as np
+import pytest
+from speechmos import dnsmos
+
+from audata_proof import handlers
+from audata_proof.audio import AudioAsset
+from audata_proof.config import settings
+from audata_proof.fingerprint import (
+    encode_fingerprint,
+    hash_keys,
+    pack_fingerprint,
+)
+from audata_proof.handlers import (
+    Quality,
+    authenticity_probability,
+    batch_duplicates,
+    check_similarity,
+    check_uniqueness,
+    register_contributions,
+    registration_locks,
+    segment_audio,
+    segment_bounds,
+    sequential_authenticity,
+    spread_order,
+)
+from audata_proof.schemas.db import Contributions
+from audata_proof.utils import backfill_fingerprint_index, index_contribution
+
+audio_path = 'demo/input/ai6.ogg'
+
+
+def test_segment_audio_short():
+    y = np.arange(10, dtype=np.float32)
+    segments, tail = segment_audio(y, segment_len=25, hop_len=25)
+    assert tail is None
+    assert segments.shape == (1, 25)
+    # Short audio is padded by repeating it
+    np.testing.assert_array_equal(segments[0, 10:20], y)
+
+
+def test_segment_audio_is_view():
+    y = np.arange(100, dtype=np.float32)
+    segments, tail = segment_audio(y, segment_len=20, hop_len=20)
+    assert tail is None
+    assert segments.shape == (5, 20)
+    # Segments share memory with the audio
+    assert segments.untyped_storage().data_ptr() == y.ctypes.data
+    np.testing.assert_array_equal(segments[3], y[60:80])
+
+
+def test_segment_audio_overlap_and_tail():
+    y = np.arange(105, dtype=np.float32)
+    segments, tail = segment_audio(y, segment_len=20, hop_len=10)
+    assert segments.shape == (9, 20)
+    np.testing.assert_array_equal(segments[1], y[10:30])
+    # Tail starts where the next segment would and is padded
+    np.testing.assert_array_equal(tail[:15], y[90:])
+    np.testing.assert_array_equal(tail[15:], y[90:95])
+
+    _, tail = segment_audio(y, segment_len=20, hop_len=10, min_tail_len=16)
+    assert tail is None
+
+
+def test_segment_audio_invalid():
+    with pytest.raises(ValueError):
+        segment_audio(np.zeros(10, np.float32), segment_len=0, hop_len=1)
+
+
+def _quality_score(result: dict) -> float:
+    return np.mean([result[m] for m in ('sig_mos', 'bak_mos', 'ovrl_mos')]) / 5
+
+
+@pytest.mark.parametrize('duration', [3, 12])
+def test_quality_matches_dnsmos(duration):
+    quality = Quality()
+    y = quality.load_audio(AudioAsset(audio_path))[: duration * 16000]
+
+    mos = quality.get_p835_metrics(quality.get_windows(y))
+
+    expected = _quality_score(dnsmos.run(y, sr=16000))
+    assert np.mean(mos) / 5 == pytest.approx(expected, abs=1e-6)
+
+
+def test_quality_windows_sampled(monkeypatch):
+    monkeypatch.setattr(settings, 'QUALITY_WINDOWS', 'sampled')
+    quality = Quality(max_duration=30)
+    # 10 minutes of audio have 591 windows, budget is 3 of them
+    indices = quality.sample_windows(591)
+    assert len(indices) == 3
+    # One window from every stratum
+    assert list(indices // 197) == [0, 1, 2]
+    np.testing.assert_array_equal(quality.sample_windows(591), indices)
+    # Short files are scored entirely
+    np.testing.assert_array_equal(quality.sample_windows(2), [0, 1])
+
+    report = quality.evaluate(AudioAsset(audio_path))
+    assert report.windows == 24
+    assert report.evaluated == 3
+    assert report.margin > 0
+
+
+def test_spread_order():
+    np.testing.assert_array_equal(spread_order(8), [0, 4, 2, 6, 1, 5, 3, 7])
+    np.testing.assert_array_equal(spread_order(5), [0, 4, 2, 1, 3])
+    np.testing.assert_array_equal(spread_order(1), [0])
+
+
+@pytest.fixture
+def short_segments(monkeypatch):
+    """One second segments, so the file has about 30 of them."""
+    monkeypatch.setattr(settings, 'AUTHENTICITY_SEGMENT_LEN', 24000)
+    monkeypatch.setattr(settings, 'AUTHENTICITY_HOP_LEN', 24000)
+    monkeypatch.setattr(settings, 'AUTHENTICITY_BATCH_SIZE', 4)
+
+
+def test_sequential_authenticity_stops_early(short_segments):
+    audio = AudioAsset(audio_path)
+    report = sequential_authenticity(
+        audio, lambda batch: np.full(len(batch), 0.99), min_segments=4
+    )
+    assert report.evaluated < report.segments
+    assert report.probability == pytest.approx(0.99)
+    assert report.probability - report.margin > 0.5
+
+    # Error rate is split between the checks after every batch of 4
+    looks = len(range(4, report.segments, 4))
+    n = report.evaluated
+    assert report.margin == pytest.approx(
+        np.sqrt(
+            (1 - (n - 1) / report.segments)
+            * np.log(2 * looks / settings.AUTHENTICITY_ERROR_RATE)
+            / (2 * n)
+        )
+    )
+
+
+def test_sequential_authenticity_undecided(short_segments):
+    audio = AudioAsset(audio_path)
+
+    def infer(batch):
+        return np.full(len(batch), 0.5)
+
+    report = sequential_authenticity(audio, infer, min_segments=4)
+    # Verdict is never certain, so every segment is evaluated
+    assert report.evaluated == report.segments
+    assert report.margin == 0
+    assert report.probability == authenticity_probability(audio, infer)
+
+    report = sequential_authenticity(
+        audio, infer, min_segments=4, max_segments=6
+    )
+    assert report.evaluated == 6
+
+
+def test_registration_locks(monkeypatch):
+    monkeypatch.setattr(settings, 'REGISTRATION_LOCK_KEYS', 2)
+    keys = np.arange(100, dtype=np.uint32)
+    frames = np.repeat(keys << 12, 2)
+
+    locks = registration_locks('f' * 32, frames)
+    # Hash bucket and two index keys with the smallest hashes, not
+    # the smallest keys, in lock order
+    expected = sorted(keys[np.argsort(hash_keys(keys))[:2]].tolist())
+    assert expected != [0, 1]
+    assert locks == [(1, 2**31 - 1), *((2, key) for key in expected)]
+    assert registration_locks('0' * 32, frames)[0] == (1, -(2**31))
+    # Part of the same recording takes the same key locks
+    assert registration_locks('0' * 32, frames[20:])[1:] == locks[1:]
+
+
+@pytest.mark.parametrize(
+    'length,segment_len,hop_len,min_tail_len',
+    [
+        (10, 25, 25, 0),
+        (25, 25, 25, 0),
+        (100, 20, 20, 0),
+        (100, 20, 10, 0),
+        (105, 20, 10, 0),
+        (105, 20, 10, 16),
+        (107, 20, 20, 5),
+    ],
+)
+def test_segment_bounds(length, segment_len, hop_len, min_tail_len):
+    y = np.arange(length, dtype=np.float32)
+    segments, tail = segment_audio(y, segment_len, hop_len, min_tail_len)
+    count, tail_start = segment_bounds(
+        length, segment_len, hop_len, min_tail_len
+    )
+    if length <= segment_len:
+        # Short audio is a tail, padded the same way
+        assert (count, tail_start) == (0, 0)
+        return
+    assert count == len(segments)
+    if tail is None:
+        assert tail_start is None
+    else:
+        rest = length - tail_start
+        np.testing.assert_array_equal(tail[:rest], y[tail_start:])
+
+
+def test_streamed_authenticity(short_segments):
+    audio = AudioAsset(audio_path)
+    streamed = AudioAsset(audio_path, streaming=True)
+
+    def infer(batch):
+        # Depends on the samples, so segments must match
+        return batch.abs().mean(dim=1).numpy()
+
+    assert authenticity_probability(streamed, infer) == pytest.approx(
+        authenticity_probability(audio, infer), abs=1e-4
+    )
+    expected = sequential_authenticity(audio, infer, min_segments=4)
+    report = sequential_authenticity(streamed, infer, min_segments=4)
+    assert report.segments == expected.segments
+    assert report.evaluated == expected.evaluated
+
+
+def test_streamed_quality(monkeypatch):
+    monkeypatch.setattr(settings, 'QUALITY_WINDOWS', 'sampled')
+    quality = Quality(max_duration=30)
+    expected = quality.evaluate(AudioAsset(audio_path))
+    report = quality.evaluate(AudioAsset(audio_path, streaming=True))
+    assert report.windows == expected.windows
+    assert report.evaluated == expected.evaluated
+    assert report.score == pytest.approx(expected.score, abs=1e-3)
+
+
+def _fingerprinted(frames, duration=30.0):
+    """Stands for `AudioAsset` in handlers reading only its fingerprint."""
+    return SimpleNamespace(fingerprint=(duration, encode_fingerprint(frames)))
+
+
+def _contribution(db, frames, index=True):
+    audio = _fingerprinted(frames)
+    with db.session() as session:
+        contribution = Contributions(
+            fingerprint=pack_fingerprint(frames),
+            fingerprint_length=len(frames),
+            fingerprint_hash=md5(
+                str(audio.fingerprint[1]).encode()
+            ).hexdigest(),
+            file_link=str(uuid4()),
+            file_link_hash=uuid4().hex,
+            duration=30.0,
+        )
+        session.add(contribution)
+        session.flush()
+        if index:
+            index_contribution(session, contribution.id, frames)
+        return contribution.id
+
+
+def test_check_uniqueness_indexed(test_db):
+    rng = np.random.default_rng(0)
+    existing = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    legacy = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    _contribution(test_db, existing)
+    # Stored before the index existed
+    _contribution(test_db, legacy, index=False)
+    for _ in range(50):
+        _contribution(test_db, rng.integers(0, 2**32, 500, dtype=np.uint32))
+
+    # Re-encoded part of it, shifted and with flipped low bits
+    similar = existing[100:700] ^ np.uint32(0b11)
+    new = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+
+    assert check_uniqueness(_fingerprinted(existing), test_db) == 0
+    assert check_uniqueness(_fingerprinted(similar), test_db) == 0
+    assert check_uniqueness(_fingerprinted(new), test_db) == 1
+    # Not a candidate until the index is backfilled
+    assert check_uniqueness(_fingerprinted(legacy[1:]), test_db) == 1
+    assert backfill_fingerprint_index(test_db, batch_size=7) == 1
+    assert check_uniqueness(_fingerprinted(legacy[1:]), test_db) == 0
+    assert backfill_fingerprint_index(test_db) == 0
+
+
+def test_batch_duplicates():
+    rng = np.random.default_rng(0)
+    first, second = rng.integers(0, 2**32, (2, 500), dtype=np.uint32)
+    fingerprints = [
+        _fingerprinted(frames).fingerprint
+        for frames in (first, second, first, first[50:] ^ np.uint32(1))
+    ]
+    assert batch_duplicates(fingerprints) == [2, 3]
+    assert batch_duplicates(fingerprints[:2]) == []
+
+
+def test_register_contributions_concurrently(test_db):
+    rng = np.random.default_rng(0)
+    existing = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    _contribution(test_db, existing)
+    # Re-encoded copies of the same new audio, uploaded at once
+    new = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    copies = [new[i : 900 + i] ^ np.uint32(i % 2) for i in range(8)]
+
+    barrier = threading.Barrier(len(copies))
+
+    def register(i):
+        barrier.wait()
+        return register_contributions(
+            test_db, [(f'copy{i}', _fingerprinted(copies[i]).fingerprint)]
+        )
+
+    with ThreadPoolExecutor(len(copies)) as executor:
+        results = list(executor.map(register, range(len(copies))))
+    # Exactly one of them is registered, the others see it
+    assert sorted(map(len, results)) == [0] + [1] * (len(copies) - 1)
+
+    # Nothing of a batch is registered if any file is a duplicate
+    other = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    assert register_contributions(
+        test_db,
+        [
+            ('other', _fingerprinted(other).fingerprint),
+            ('existing', _fingerprinted(existing[1:]).fingerprint),
+        ],
+    ) == ['existing']
+    assert check_uniqueness(_fingerprinted(other), test_db) == 1
+    assert (
+        register_contributions(
+            test_db, [('other', _fingerprinted(other).fingerprint)]
+        )
+        == []
+    )
+    with test_db.session() as session:
+        assert session.query(Contributions).count() == 3
+
+
+def test_check_similarity_after_failed_scan(monkeypatch, test_db):
+    rng = np.random.default_rng(0)
+    existing = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    _contribution(test_db, existing)
+
+    def parallel_scan(*args):
+        raise RuntimeError('Shard scan failed')
+
+    monkeypatch.setattr(settings, 'UNIQUENESS_SCAN_WORKERS', 2)
+    monkeypatch.setattr(handlers, 'parallel_scan', parallel_scan)
+    # Scanned serially instead
+    similar = _fingerprinted(existing[1:])
+    assert check_similarity(similar, test_db, use_index=False) == 0
@@ -0,0 +1,38 @@
+import threading
+
+from audata_proof.metrics import count, measure, measured
+
+
+def test_measure_counts():
+    stages = {}
+    with measure('outer', stages):
+        count('rows_scanned', 2)
+        with measure('inner', stages):
+            count('rows_scanned', 3)
+        count('rows_scanned', 1)
+    # Counters outside of any stage are dropped
+    count('rows_scanned', 100)
+
+    assert stages['outer'].counters == {'rows_scanned': 3}
+    assert stages['inner'].counters == {'rows_scanned': 3}
+    assert stages['outer'].wall_time >= stages['inner'].wall_time
+
+
+def test_measured_in_threads():
+    stages = {}
+
+    def stage(amount):
+        count('segments_inferred', amount)
+        return amount
+
+    threads = [
+        threading.Thread(target=measured(name, stage, stages), args=(amount,))
+        for name, amount in (('a', 1), ('b', 2))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stages['a'].counters == {'segments_inferred': 1}
+    assert stages['b'].counters == {'segments_inferred': 2}
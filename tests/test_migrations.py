@@ -0,0 +1,60 @@
+from uuid import uuid4
+
+import numpy as np
+from sqlalchemy import func, text
+
+from audata_proof.fingerprint import (
+    INDEX_KEYS,
+    encode_fingerprint,
+    unpack_fingerprint,
+)
+from audata_proof.migrations import migrate_fingerprints_to_binary
+from audata_proof.schemas.db import Contributions, FingerprintIndex
+from audata_proof.utils import backfill_fingerprint_index
+
+
+def test_migrate_fingerprints_to_binary(test_db):
+    rng = np.random.default_rng(0)
+    fingerprints = [
+        rng.integers(0, 2**32, 1000, dtype=np.uint32) for _ in range(5)
+    ]
+    with test_db.session() as session:
+        # Schema of databases storing fingerprints as text
+        session.execute(text('DROP TABLE fingerprint_index, contributions'))
+        session.execute(
+            text(
+                'CREATE TABLE contributions ('
+                'id UUID PRIMARY KEY, duration FLOAT NOT NULL, '
+                'uploaded_at TIMESTAMPTZ DEFAULT now(), '
+                'file_link TEXT NOT NULL, '
+                'file_link_hash VARCHAR(32) UNIQUE NOT NULL, '
+                'fingerprint TEXT NOT NULL, '
+                'fingerprint_hash VARCHAR(32) UNIQUE NOT NULL)'
+            )
+        )
+        for frames in fingerprints:
+            session.execute(
+                text(
+                    'INSERT INTO contributions VALUES '
+                    "(:id, 1.0, now(), 'link', :hash, :fprint, :hash)"
+                ),
+                {
+                    'id': uuid4(),
+                    'hash': uuid4().hex,
+                    'fprint': '\\x' + encode_fingerprint(frames).hex(),
+                },
+            )
+    FingerprintIndex.__table__.create(test_db._engine)
+
+    migrate_fingerprints_to_binary(test_db, batch_size=2)
+
+    with test_db.session() as session:
+        stored = [
+            unpack_fingerprint(fingerprint)
+            for (fingerprint,) in session.query(Contributions.fingerprint)
+        ]
+        indexed = session.query(func.count(FingerprintIndex.key)).scalar()
+    assert sorted(map(bytes, stored)) == sorted(map(bytes, fingerprints))
+    # Converted rows are indexed too
+    assert indexed == len(fingerprints) * INDEX_KEYS
+    assert backfill_fingerprint_index(test_db) == 0
@@ -0,0 +1,78 @@
+import copy
+
+import numpy as np
+import torch
+import yaml
+from torch import Tensor
+
+from audata_proof.config import settings
+from audata_proof.model.model import RawNet, SincConv
+
+
+def build_band_pass_per_filter(sinc_conv):
+    """Filters built one by one as SincConv used to in every forward."""
+    band_pass = torch.zeros(sinc_conv.out_channels, sinc_conv.kernel_size)
+    for i in range(len(sinc_conv.mel) - 1):
+        fmin = sinc_conv.mel[i]
+        fmax = sinc_conv.mel[i + 1]
+        hHigh = (2 * fmax / sinc_conv.sample_rate) * np.sinc(
+            2 * fmax * sinc_conv.hsupp / sinc_conv.sample_rate
+        )
+        hLow = (2 * fmin / sinc_conv.sample_rate) * np.sinc(
+            2 * fmin * sinc_conv.hsupp / sinc_conv.sample_rate
+        )
+        hideal = hHigh - hLow
+        band_pass[i, :] = Tensor(np.hamming(sinc_conv.kernel_size)) * Tensor(
+            hideal
+        )
+    return band_pass
+
+
+def test_sinc_conv_band_pass():
+    sinc_conv = SincConv(device='cpu', out_channels=20, kernel_size=1024)
+    assert torch.equal(
+        sinc_conv.band_pass, build_band_pass_per_filter(sinc_conv)
+    )
+    # Filters aren't part of checkpoints
+    assert 'band_pass' not in sinc_conv.state_dict()
+    assert 'band_pass' in dict(sinc_conv.named_buffers())
+
+
+def test_onnx_export_parity(tmp_path):
+    import onnxruntime as ort
+
+    from audata_proof import handlers
+    from audata_proof.audio import AudioAsset
+    from audata_proof.model.export import export_onnx
+
+    torch.manual_seed(0)
+    with open(settings.path_to_yaml) as f:
+        config = yaml.safe_load(f)
+    model = RawNet(config['model'], device='cpu').eval()
+    export_onnx(model, str(tmp_path / 'model.onnx'))
+    session = ort.InferenceSession(str(tmp_path / 'model.onnx'))
+
+    y = AudioAsset('demo/input/ai6.ogg').resampled(24000)
+    segments, _ = handlers.segment_audio(y, 96000, 96000)
+    np.testing.assert_allclose(
+        handlers._infer_onnx(session, segments),
+        handlers._infer_torch(model, segments),
+        atol=1e-4,
+    )
+
+
+def test_compare_precisions():
+    from audata_proof.model.quantization import compare_precisions
+
+    torch.manual_seed(0)
+    with open(settings.path_to_yaml) as f:
+        config = yaml.safe_load(f)
+    fp32 = RawNet(config['model'], device='cpu').eval()
+    int8 = torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(fp32), {torch.nn.GRU, torch.nn.Linear}, torch.qint8
+    )
+
+    report = compare_precisions({'demo/input/ai6.ogg': 1}, fp32, int8)
+    assert report.files == 1
+    assert report.max_prob_diff < 0.05
+    assert report.passes() == (not report.flipped)
@@ -0,0 +1,286 @@
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from audata_proof import handlers
+from audata_proof.audio import AudioAsset
+from audata_proof.config import settings
+from audata_proof.db import Database
+from audata_proof.fingerprint import encode_fingerprint
+from audata_proof.model.registry import model_registry
+from audata_proof.proof import Proof
+from audata_proof.schemas.quality_report import QualityReport
+from audata_proof.utils import iter_archive
+
+audio_path = 'demo/input/ai6.ogg'
+check_quality = handlers.Quality.check_quality
+
+
+@pytest.fixture
+def stub_handlers(monkeypatch):
+    """Replace handlers with stubs recording threads they run in."""
+    threads = {}
+
+    def stub(name, score):
+        def handler(*args, **kwargs):
+            threads[name] = threading.current_thread().name
+            return score
+
+        return handler
+
+    monkeypatch.setattr(
+        AudioAsset, 'fingerprint', (0.0, encode_fingerprint(np.arange(100)))
+    )
+    monkeypatch.setattr(handlers, 'check_ownership', stub('ownership', 1))
+    monkeypatch.setattr(
+        handlers, 'register_contributions', stub('register', [])
+    )
+    monkeypatch.setattr(handlers, 'check_uniqueness', stub('uniqueness', 1))
+    monkeypatch.setattr(
+        handlers, 'check_exact_duplicate', stub('exact_duplicate', 1)
+    )
+    monkeypatch.setattr(handlers, 'check_similarity', stub('similarity', 1))
+    monkeypatch.setattr(
+        handlers, 'check_authenticity', stub('authenticity', 0)
+    )
+    monkeypatch.setattr(
+        handlers.Quality, 'check_quality', stub('quality', 0.7)
+    )
+    monkeypatch.setattr(model_registry, 'preload', stub('preload', {}))
+    return threads
+
+
+@pytest.mark.parametrize('executor', ['sequential', 'threads'])
+def test_generate(monkeypatch, stub_handlers, executor):
+    monkeypatch.setattr(settings, 'PROOF_EXECUTOR', executor)
+    proof_response = Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+
+    assert proof_response.ownership == 1
+    assert proof_response.uniqueness == 1
+    assert proof_response.authenticity == 0
+    assert proof_response.quality == 0.7
+    assert proof_response.valid is False
+
+    # Models are loaded on first use by the file evaluated here
+    assert 'preload' not in stub_handlers
+    main_thread = threading.main_thread().name
+    in_main_thread = [t == main_thread for t in stub_handlers.values()]
+    assert all(in_main_thread) == (executor == 'sequential')
+
+
+def test_generate_many_files(monkeypatch, stub_handlers):
+    monkeypatch.setattr(settings, 'PROOF_WORKERS', 2)
+    # Only the first file is authentic
+    monkeypatch.setattr(
+        handlers,
+        'check_authenticity',
+        lambda audio: int(audio.name == 'ai6.ogg'),
+    )
+
+    # Files read from archives are passed as contents
+    with open(audio_path, 'rb') as f:
+        content = f.read()
+
+    proof_response = Proof(
+        Database(), {'ai6.ogg': audio_path, 'other.ogg': content}, '1'
+    ).generate()
+
+    # Evaluated by forked workers, sharing models loaded before
+    assert 'uniqueness' not in stub_handlers
+    assert 'preload' in stub_handlers
+    files = proof_response.attributes['files']
+    assert [file['file'] for file in files] == ['ai6.ogg', 'other.ogg']
+    assert [file['valid'] for file in files] == [True, False]
+    assert proof_response.authenticity == 0.5
+    assert proof_response.quality == 0.7
+    assert proof_response.valid is False
+
+
+@pytest.mark.parametrize('executor', ['sequential', 'threads'])
+def test_generate_many_files_in_thread(monkeypatch, stub_handlers, executor):
+    monkeypatch.setattr(settings, 'PROOF_EXECUTOR', executor)
+    monkeypatch.setattr(settings, 'PROOF_WORKERS', 2)
+    proof = Proof(
+        Database(), {'ai6.ogg': audio_path, 'other.ogg': audio_path}, '1'
+    )
+    with ThreadPoolExecutor(1) as executor:
+        proof_response = executor.submit(proof.generate).result()
+
+    # No workers are forked from a thread, files are evaluated here
+    assert 'uniqueness' in stub_handlers
+    assert len(proof_response.attributes['files']) == 2
+
+
+def test_generate_early_exit(monkeypatch, stub_handlers):
+    monkeypatch.setattr(settings, 'PROOF_EARLY_EXIT', True)
+    proof_response = Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+
+    # Authenticity fails, so quality is not checked
+    assert 'quality' not in stub_handlers
+    assert 'uniqueness' not in stub_handlers
+    assert proof_response.uniqueness == 1
+    assert proof_response.quality == 0
+    assert proof_response.valid is False
+    (file,) = proof_response.attributes['files']
+    assert file['skipped'] == ['quality']
+    assert 'quality_report' not in file
+
+
+@pytest.mark.parametrize('early_exit', [False, True])
+def test_generate_without_index(monkeypatch, stub_handlers, early_exit):
+    monkeypatch.setattr(settings, 'PROOF_EARLY_EXIT', early_exit)
+    monkeypatch.setattr(settings, 'UNIQUENESS_USE_INDEX', False)
+    calls = []
+
+    def check(*args, use_index=True):
+        calls.append(use_index)
+        return 1
+
+    monkeypatch.setattr(handlers, 'check_uniqueness', check)
+    monkeypatch.setattr(handlers, 'check_similarity', check)
+    Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+
+    # Every contribution is scanned, in shards if configured
+    assert calls == [False]
+
+
+def test_generate_quality_report(monkeypatch, stub_handlers):
+    report = QualityReport(
+        score=0.7,
+        sig_mos=3.5,
+        bak_mos=3.5,
+        ovrl_mos=3.5,
+        windows=100,
+        evaluated=20,
+        margin=0.05,
+    )
+    monkeypatch.setattr(handlers.Quality, 'check_quality', check_quality)
+    monkeypatch.setattr(
+        handlers.Quality, 'evaluate', lambda self, audio: report
+    )
+    proof_response = Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+
+    (file,) = proof_response.attributes['files']
+    assert file['quality'] == 0.7
+    # Windows were sampled
+    assert file['quality_report'] == {
+        'windows': 100,
+        'evaluated': 20,
+        'margin': 0.05,
+    }
+
+
+def test_generate_early_exit_banned(monkeypatch, stub_handlers):
+    monkeypatch.setattr(settings, 'PROOF_EARLY_EXIT', True)
+    monkeypatch.setattr(handlers, 'check_ownership', lambda *args: 0)
+    proof_response = Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+
+    # Files of a banned user are not even checked
+    assert stub_handlers == {}
+    assert proof_response.valid is False
+    assert proof_response.attributes['files'] == []
+    assert proof_response.attributes['skipped'] == [
+        'uniqueness',
+        'authenticity',
+        'quality',
+    ]
+
+
+def test_generate_metrics(monkeypatch, stub_handlers):
+    monkeypatch.setattr(settings, 'PROOF_METRICS_IN_RESPONSE', True)
+    # Only valid proofs are registered
+    monkeypatch.setattr(handlers, 'check_authenticity', lambda *args: 1)
+    proof = Proof(Database(), {'ai6.ogg': audio_path}, '1')
+    proof_response = proof.generate()
+
+    assert set(proof.metrics.stages) == {
+        'generate',
+        'ownership',
+        'register',
+    }
+    file_metrics = proof.metrics.files['ai6.ogg']
+    assert set(file_metrics) == {
+        'decode',
+        'fingerprint',
+        'uniqueness',
+        'authenticity',
+        'quality',
+    }
+    assert file_metrics['decode'].wall_time > 0
+    assert file_metrics['decode'].peak_rss > 0
+    # Metrics aren't mixed into scores of files
+    assert 'metrics' not in proof_response.attributes['files'][0]
+    assert proof_response.attributes['metrics'] == proof.metrics.model_dump()
+
+
+def test_generate_registers_valid_files(monkeypatch, stub_handlers):
+    monkeypatch.setattr(handlers, 'check_authenticity', lambda *args: 1)
+    proof_response = Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+    assert 'register' in stub_handlers
+    assert proof_response.valid is True
+
+
+def test_generate_duplicate_registered_meanwhile(monkeypatch, stub_handlers):
+    monkeypatch.setattr(handlers, 'check_authenticity', lambda *args: 1)
+    monkeypatch.setattr(
+        handlers, 'register_contributions', lambda *args: ['ai6.ogg']
+    )
+    proof_response = Proof(Database(), {'ai6.ogg': audio_path}, '1').generate()
+
+    assert proof_response.uniqueness == 0
+    assert proof_response.valid is False
+
+
+def test_generate_registers_only_valid_proofs(monkeypatch, stub_handlers):
+    # Only the first file is authentic
+    monkeypatch.setattr(
+        handlers,
+        'check_authenticity',
+        lambda audio: int(audio.name == 'ai6.ogg'),
+    )
+    monkeypatch.setattr(
+        AudioAsset,
+        'fingerprint',
+        property(
+            lambda audio: (
+                0.0,
+                encode_fingerprint(np.arange(100) + len(audio.name) * 1000),
+            )
+        ),
+    )
+    proof_response = Proof(
+        Database(), {'ai6.ogg': audio_path, 'other.ogg': audio_path}, '1'
+    ).generate()
+
+    files = proof_response.attributes['files']
+    assert [file['valid'] for file in files] == [True, False]
+    assert proof_response.valid is False
+    # The valid file isn't registered either
+    assert 'register' not in stub_handlers
+
+
+def test_generate_duplicates_in_proof(monkeypatch, stub_handlers):
+    monkeypatch.setattr(handlers, 'check_authenticity', lambda *args: 1)
+    proof_response = Proof(
+        Database(), {'ai6.ogg': audio_path, 'copy.ogg': audio_path}, '1'
+    ).generate()
+
+    files = proof_response.attributes['files']
+    assert [file['uniqueness'] for file in files] == [1, 0]
+    assert proof_response.uniqueness == 0.5
+    assert proof_response.valid is False
+    assert 'register' not in stub_handlers
+
+
+def test_generate_archive_member(monkeypatch, stub_handlers, tmp_path):
+    path = tmp_path / 'upload.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.write(audio_path, 'upload/ai6.ogg')
+    ((name, member),) = iter_archive(str(path))
+
+    proof_response = Proof(Database(), {name: member}, '1').generate()
+    assert proof_response.attributes['files'][0]['file'] == 'ai6.ogg'
+    assert proof_response.quality == 0.7
@@ -0,0 +1,32 @@
+import pytest
+from pydantic import ValidationError
+
+from audata_proof.config import Settings
+from audata_proof.model.registry import AUTHENTICITY_MODELS, ModelRegistry
+
+
+def test_model_is_loaded_once():
+    calls = []
+    registry = ModelRegistry()
+    registry._loaders = {'dummy': lambda: calls.append(1) or object()}
+
+    model = registry.get('dummy')
+    assert registry.get('dummy') is model
+    assert calls == [1]
+
+    load_times = registry.preload('dummy')
+    assert list(load_times) == ['dummy']
+    assert calls == [1]
+
+
+def test_authenticity_model_settings(monkeypatch):
+    monkeypatch.setenv('ENV_', 'local')
+    for backend, precision in AUTHENTICITY_MODELS:
+        settings = Settings(
+            AUTHENTICITY_BACKEND=backend, AUTHENTICITY_PRECISION=precision
+        )
+        assert settings.AUTHENTICITY_PRECISION == precision
+
+    # No model to load
+    with pytest.raises(ValidationError, match='only supported with'):
+        Settings(AUTHENTICITY_BACKEND='onnx', AUTHENTICITY_PRECISION='int8')
@@ -0,0 +1,91 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID, uuid4
+
+import numpy as np
+import pytest
+
+from audata_proof import scan
+from audata_proof.fingerprint import pack_fingerprint
+from audata_proof.scan import (
+    find_similar,
+    parallel_scan,
+    scan_workers,
+    shard_bounds,
+)
+from audata_proof.schemas.db import Contributions
+
+
+def test_shard_bounds():
+    bounds = shard_bounds(4)
+    assert bounds[0] == (UUID(int=0), UUID(int=1 << 126))
+    assert bounds[-1] == (UUID(int=3 << 126), None)
+    # Ranges are adjacent
+    for (_, upper), (lower, _) in zip(bounds, bounds[1:]):
+        assert upper == lower
+    assert shard_bounds(1) == [(UUID(int=0), None)]
+
+
+def test_find_similar():
+    rng = np.random.default_rng(0)
+    query = rng.integers(0, 2**32, size=200, dtype=np.uint32)
+    other = rng.integers(0, 2**32, size=200, dtype=np.uint32)
+
+    assert find_similar(query, [other], 0.8) is None
+    index, score = find_similar(query, [other, query[10:150]], 0.8)
+    assert index == 1
+    assert score == 1.0
+
+
+def _add_contributions(db, fingerprints):
+    with db.session() as session:
+        for frames in fingerprints:
+            session.add(
+                Contributions(
+                    fingerprint=pack_fingerprint(frames),
+                    fingerprint_length=len(frames),
+                    fingerprint_hash=uuid4().hex,
+                    file_link=str(uuid4()),
+                    file_link_hash=uuid4().hex,
+                    duration=30.0,
+                )
+            )
+
+
+def test_parallel_scan(test_db):
+    rng = np.random.default_rng(0)
+    fingerprints = rng.integers(0, 2**32, (40, 300), dtype=np.uint32)
+    _add_contributions(test_db, fingerprints)
+    with test_db.session() as session:
+        ids = [row.id for row in session.query(Contributions.id)]
+    # Random ids spread over every shard
+    assert len({id_.int >> 126 for id_ in ids}) == 4
+
+    match = parallel_scan(fingerprints[7][20:], test_db, 0.8, 3, 4, 60.0)
+    assert match is not None and match[0] in ids and match[1] == 1.0
+    new = rng.integers(0, 2**32, 300, dtype=np.uint32)
+    assert parallel_scan(new, test_db, 0.8, 3, 4, 60.0) is None
+
+
+@pytest.mark.parametrize('failure', ['died', 'timed out'])
+def test_parallel_scan_failed(monkeypatch, test_db, failure):
+    def scan_shard(*args):
+        if failure == 'died':
+            os._exit(1)
+        time.sleep(60)
+
+    monkeypatch.setattr(scan, '_POLL_INTERVAL', 0.1)
+    monkeypatch.setattr(scan, '_scan_shard', scan_shard)
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match=failure):
+        parallel_scan(np.arange(10, dtype=np.uint32), test_db, 0.8, 3, 2, 1.0)
+    # Processes left are killed, not waited for
+    assert time.monotonic() - started < 10
+
+
+def test_scan_workers_in_thread():
+    assert scan_workers(4) == 4
+    # Worker threads don't fork
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(scan_workers, 4).result() == 1
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from uuid import UUID, uuid4
+
+import numpy as np
+
+from audata_proof import snapshot as snapshot_module
+from audata_proof.config import settings
+from audata_proof.fingerprint import pack_fingerprint
+from audata_proof.snapshot import FingerprintSnapshot, get_snapshot
+
+
+class FakeDatabase:
+    """Returns every contribution on any query, ignoring filters."""
+
+    def __init__(self):
+        self.contributions = []
+
+    def add(self, frames, uploaded_at, contribution_id=None):
+        self.contributions.append(
+            SimpleNamespace(
+                id=contribution_id or uuid4(),
+                uploaded_at=datetime.fromtimestamp(uploaded_at, timezone.utc),
+                duration=len(frames) * 0.124,
+                fingerprint=pack_fingerprint(frames),
+                fingerprint_hash=f'{len(self.contributions):032x}',
+            )
+        )
+        return self.contributions[-1]
+
+    @contextmanager
+    def session(self):
+        query = SimpleNamespace()
+        query.filter = query.order_by = lambda *args: query
+        query.yield_per = lambda amount: iter(self.contributions)
+        yield SimpleNamespace(query=lambda *columns: query)
+
+
+def test_snapshot_sync(tmp_path):
+    db = FakeDatabase()
+    first = db.add(np.arange(5, dtype=np.uint32), 100.0)
+    snapshot = FingerprintSnapshot(str(tmp_path))
+
+    assert snapshot.sync(db) == 1
+    # Known contributions are skipped
+    assert snapshot.sync(db) == 0
+    # Trailing zero bytes of ids survive
+    last = db.add(
+        np.arange(3, dtype=np.uint32), 200.0, UUID(bytes=b'\1' + bytes(15))
+    )
+    assert snapshot.sync(db) == 1
+
+    assert len(snapshot) == 2
+    assert snapshot.watermark == 200.0
+    (row,) = snapshot.rows([last.id, uuid4()])
+    assert snapshot.id(row) == last.id
+    np.testing.assert_array_equal(snapshot.fingerprint(row), np.arange(3))
+    assert snapshot.has_hash(first.fingerprint_hash)
+    assert not snapshot.has_hash('f' * 32)
+
+
+def test_snapshot_reopened(tmp_path):
+    db = FakeDatabase()
+    contribution = db.add(np.arange(4, dtype=np.uint32), 100.0)
+    FingerprintSnapshot(str(tmp_path)).sync(db)
+
+    # Leftovers of an interrupted sync are ignored
+    with open(tmp_path / 'frames.bin', 'ab') as f:
+        f.write(b'garbage')
+    snapshot = FingerprintSnapshot(str(tmp_path))
+    assert len(snapshot) == 1
+    (row,) = snapshot.rows([contribution.id])
+    np.testing.assert_array_equal(snapshot.fingerprint(row), np.arange(4))
+
+    db.add(np.arange(2, dtype=np.uint32), 150.0)
+    assert snapshot.sync(db) == 1
+    np.testing.assert_array_equal(
+        snapshot.fingerprint(snapshot.rows([db.contributions[1].id])[0]),
+        np.arange(2),
+    )
+
+
+def test_snapshot_sync_in_blocks(tmp_path):
+    db = FakeDatabase()
+    snapshot = FingerprintSnapshot(str(tmp_path))
+    for i in range(5):
+        db.add(np.arange(i + 1, dtype=np.uint32), 100.0 + i)
+    assert snapshot.sync(db, yield_per=2) == 5
+    for i in range(5, 12):
+        db.add(np.arange(i + 1, dtype=np.uint32), 100.0 + i)
+    assert snapshot.sync(db, yield_per=3) == 7
+
+    # New rows are merged into sorted columns of the known ones
+    ids = [contribution.id for contribution in db.contributions]
+    rows = snapshot.rows(sorted(ids))
+    assert [snapshot.id(row) for row in rows] == sorted(ids)
+    for contribution, row in zip(db.contributions, snapshot.rows(ids)):
+        assert snapshot.has_hash(contribution.fingerprint_hash)
+        np.testing.assert_array_equal(
+            snapshot.fingerprint(row),
+            np.frombuffer(contribution.fingerprint, np.uint32),
+        )
+    assert snapshot.watermark == 111.0
+
+
+def test_get_snapshot_syncs_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(snapshot_module, '_snapshot', None)
+    db = FakeDatabase()
+    db.add(np.arange(4, dtype=np.uint32), 100.0)
+
+    assert len(get_snapshot(db)) == 1
+    db.add(np.arange(2, dtype=np.uint32), 150.0)
+    # Synced on first access and when asked to only
+    assert len(get_snapshot(db)) == 1
+    assert len(get_snapshot(db, sync=True)) == 2
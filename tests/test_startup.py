@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+from audata_proof.startup import StartupProfile
+
+
+def test_startup_profile():
+    profile = StartupProfile(enabled=True)
+    with profile.stage('first'):
+        pass
+    profile.import_modules(['json', 'this'])
+
+    assert list(profile.times) == ['first', 'import this']
+    lines = profile.report().splitlines()
+    assert lines[0].startswith('first')
+    assert lines[-1].startswith('total')
+
+
+def test_entry_point_defers_heavy_imports(tmp_path):
+    # Fails on missing inputs before importing any of them
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            'import sys\n'
+            'import audata_proof.audio\n'
+            'from audata_proof.__main__ import run\n'
+            'try:\n'
+            '    run()\n'
+            'except FileNotFoundError:\n'
+            '    pass\n'
+            'heavy = {"torch", "librosa", "speechmos", "onnxruntime",'
+            ' "soxr", "acoustid"}\n'
+            'assert not heavy & set(sys.modules), heavy & set(sys.modules)\n',
+        ],
+        env={
+            **os.environ,
+            'ENV_': 'local',
+            'INPUT_DIR': str(tmp_path / 'missing'),
+        },
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
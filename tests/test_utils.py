@@ -1,7 +1,115 @@
-from audata_proof.utils import decode_db_fingerprint
+import json
+import os
+import zipfile
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from audata_proof.config import settings
+from audata_proof.utils import (
+    decode_db_fingerprint,
+    extract_data,
+    iter_archive,
+    upsert_user_statement,
+)
 from tests import fprint_strings
 
+audio_path = 'demo/input/ai6.ogg'
+
 
 def test_decode_db_fingerprint():
     actual = decode_db_fingerprint(fprint_strings.raw)
     assert str(actual) == fprint_strings.expected
+
+
+def _write_archive(path, members: dict[str, bytes]) -> str:
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return str(path)
+
+
+def test_extract_data_reads_archive_in_memory(tmp_path):
+    with open(audio_path, 'rb') as f:
+        content = f.read()
+    _write_archive(
+        tmp_path / 'upload.zip',
+        {
+            'upload/ai6.ogg': content,
+            'upload/account.json': json.dumps({'telegram_id': '42'}),
+            'upload/notes.txt': b'ignored',
+        },
+    )
+
+    audio_files, telegram_id = extract_data(str(tmp_path))
+
+    # Members are read when they're used
+    assert list(audio_files) == ['ai6.ogg']
+    assert audio_files['ai6.ogg'].read() == content
+    assert telegram_id == '42'
+    # Nothing was extracted
+    assert os.listdir(tmp_path) == ['upload.zip']
+
+
+def test_extract_data_duplicate_names(tmp_path):
+    _write_archive(
+        tmp_path / 'upload.zip',
+        {
+            'a.ogg': b'first',
+            'account.json': json.dumps({'telegram_id': '42'}),
+        },
+    )
+    with open(tmp_path / 'a.ogg', 'wb') as f:
+        f.write(b'second')
+
+    with pytest.raises(ValueError, match='a.ogg'):
+        extract_data(str(tmp_path))
+
+
+def test_iter_archive_duplicate_names(tmp_path):
+    path = _write_archive(
+        tmp_path / 'upload.zip', {'one/a.ogg': b'1', 'two/a.ogg': b'2'}
+    )
+    with pytest.raises(ValueError, match='a.ogg'):
+        list(iter_archive(path))
+
+
+@pytest.mark.parametrize(
+    'limit, value',
+    [
+        ('ARCHIVE_MAX_MEMBERS', 1),
+        ('ARCHIVE_MAX_MEMBER_SIZE', 1000),
+        ('ARCHIVE_MAX_TOTAL_SIZE', 1500),
+        ('ARCHIVE_MAX_RATIO', 10),
+    ],
+)
+def test_iter_archive_limits(monkeypatch, tmp_path, limit, value):
+    path = _write_archive(
+        tmp_path / 'bomb.zip', {'a.ogg': bytes(1024), 'b.ogg': bytes(1024)}
+    )
+    monkeypatch.setattr(settings, limit, value)
+
+    with pytest.raises(ValueError):
+        for _, member in iter_archive(path):
+            member.read()
+
+
+def test_archive_member_read_limit(monkeypatch, tmp_path):
+    path = _write_archive(tmp_path / 'upload.zip', {'a.ogg': bytes(1024)})
+    ((_, member),) = iter_archive(path)
+    # Checked again while decompressing, e.g. if the limit changed
+    monkeypatch.setattr(settings, 'ARCHIVE_MAX_MEMBER_SIZE', 1000)
+    with pytest.raises(ValueError):
+        member.read()
+
+
+def test_upsert_user_statement():
+    statement = upsert_user_statement('42').compile(
+        dialect=postgresql.dialect()
+    )
+    sql = str(statement)
+
+    assert sql.startswith('INSERT INTO users')
+    assert 'ON CONFLICT (telegram_id) DO UPDATE' in sql
+    assert 'RETURNING users.is_banned, xmax = 0 AS created' in sql
+    assert statement.params['telegram_id'] == '42'